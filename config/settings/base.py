@@ -180,6 +180,18 @@ MEDIA_ROOT = "/media/"
 # https://docs.djangoproject.com/en/dev/ref/settings/#media-url
 MEDIA_URL = "/media/"
 
+# REPORTS
+# ------------------------------------------------------------------------------
+# Snapshots of the full report dataset (see flaim.reports.snapshots). Must not be under MEDIA_ROOT, which is served
+# publicly while the reports are only available to logged in users.
+REPORT_SNAPSHOT_DIR = env("REPORT_SNAPSHOT_DIR", default=str(ROOT_DIR("snapshots")))
+
+# DATA DOWNLOADS
+# ------------------------------------------------------------------------------
+# Download bundles of the full product history (see flaim.data.bundles). Like REPORT_SNAPSHOT_DIR this must not be
+# under MEDIA_ROOT; the files are streamed to logged in users by flaim.data.views.BundleFileView.
+DOWNLOAD_BUNDLE_DIR = env("DOWNLOAD_BUNDLE_DIR", default=str(ROOT_DIR("downloads")))
+
 # TEMPLATES
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#templates
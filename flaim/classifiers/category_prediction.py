@@ -1,27 +1,122 @@
+import multiprocessing
+import os
 import pickle
 import string
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 
 import lightgbm as lgb
+import numpy as np
 import pandas as pd
 from nltk.stem import SnowballStemmer
 from nltk.tokenize import word_tokenize
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 
 from flaim.classifiers.category_preprocessing import DataStore
 
+# 'count' fits a vocabulary on the training names; 'hashing' maps tokens straight to a fixed number of columns, so
+# nothing has to be fitted or held in memory and names can be vectorized chunk by chunk
+FEATURE_MODES = ('count', 'hashing')
+
+
+CATEGORY_PARAMS = {
+    'seed': 1,
+    'objective': 'multiclass',
+    'metric': 'multi_error',
+    'max_depth': 9,
+    'num_leaves': 45,
+    'min_data_in_leaf': 2,
+    'feature_fraction': 0.2,
+}
+
+
+def feature_mode(vectorizer) -> str:
+    return 'hashing' if isinstance(vectorizer, HashingVectorizer) else 'count'
+
+
+def vectorize(vectorizer, texts, index=None):
+    """
+    Transforms texts with either kind of vectorizer. Count features keep their vocabulary as column names, which the
+    boosters trained on them expect; hashed features are left as a plain sparse matrix.
+    """
+    matrix = vectorizer.transform(texts)
+    if feature_mode(vectorizer) == 'hashing':
+        return matrix.tocsr()
+    return pd.DataFrame.sparse.from_spmatrix(matrix, columns=vectorizer.get_feature_names(), index=index)
+
+
+def n_features_of(vectorizer) -> int:
+    if feature_mode(vectorizer) == 'hashing':
+        return vectorizer.n_features
+    return len(vectorizer.vocabulary_)
+
+
+def load_artifact(model_path) -> tuple:
+    """
+    Reads a pickled (model, vectorizers, target_encoder, model_version, metadata) tuple. Artifacts written before
+    metadata was stored only hold the first four, in which case the metadata comes back empty.
+    """
+    artifact = pickle.load(open(model_path, 'rb'))
+    return tuple(artifact[:4]) + (artifact[4] if len(artifact) > 4 else {},)
+
+
+def predict_in_chunks(model, vectorizer, texts: pd.Series, chunk_size: int = None, **predict_params) -> np.ndarray:
+    """ Vectorizes and predicts texts chunk_size rows at a time so only one chunk's features are in memory at once """
+    if not chunk_size:
+        chunk_size = max(len(texts), 1)
+    return np.vstack([model.predict(vectorize(vectorizer, texts.iloc[i:i + chunk_size], texts.index[i:i + chunk_size]),
+                                    **predict_params)
+                      for i in range(0, max(len(texts), 1), chunk_size)])
+
+
+def curated_product_codes(ds: DataStore, rows=None) -> [str]:
+    """ Codes of the curator-verified products in ds (or in some rows of it), stored with models trained on them """
+    if ds.product_codes is None:
+        return []
+    codes = ds.product_codes if rows is None else ds.product_codes.loc[rows]
+    return sorted(codes.dropna().unique())
+
+
+# Populated in each subcategory pool worker. Workers are forked so the fitted models are shared copy-on-write with the
+# parent process rather than pickled for every category group.
+_worker_sub_predictor = None
+
+
+def _init_subcategory_worker(sub_predictor):
+    global _worker_sub_predictor
+    _worker_sub_predictor = sub_predictor
+
+
+def _predict_subcategory_group(cat, names: pd.Series, chunk_size=None):
+    # The pool already provides the parallelism; a single LightGBM thread per worker also sidesteps OpenMP's
+    # thread pool misbehaving after fork
+    return cat, _worker_sub_predictor.predict_group(cat, names, chunk_size, num_threads=1)
+
 
 class CategoryPredictor:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, features='count', n_features=2 ** 14):
+        """
+        features picks the name features used when training ('count' or 'hashing', see FEATURE_MODES); n_features is
+        the fixed width of the hashed features. A loaded model always keeps the mode it was trained with.
+        """
         if model_path is None:
             self.model = None
             self.vectorizers = {}
             self.target_encoder = None
             self.model_version = None
+            self.metadata = {}
         else:
-            self.model, self.vectorizers, self.target_encoder, self.model_version = pickle.load(open(model_path, 'rb'))
-
+            self.model, self.vectorizers, self.target_encoder, self.model_version, self.metadata = \
+                load_artifact(model_path)
+            if 'name' in self.vectorizers:
+                features = feature_mode(self.vectorizers['name'])
+
+        if features not in FEATURE_MODES:
+            raise ValueError(f'features must be one of {FEATURE_MODES}, not {features}')
+        self.features = features
+        self.n_features = n_features
         self.stemmer = SnowballStemmer("english", ignore_stopwords=True)
 
     def snowball(self, row):
@@ -31,13 +126,19 @@ class CategoryPredictor:
 
     def train(self, ds: DataStore, process_names=True):
         if process_names:
-            self.vectorizers['name'] = CountVectorizer(max_features=4000, stop_words='english', analyzer='word',
-                                                       strip_accents='ascii', dtype=bool, token_pattern='[a-zA-Z]{3,}',
-                                                       binary=True)
+            stemmed_names = ds.names.apply(self.snowball)
+            if self.features == 'hashing':
+                self.vectorizers['name'] = HashingVectorizer(n_features=self.n_features, stop_words='english',
+                                                             analyzer='word', strip_accents='ascii', dtype=np.float32,
+                                                             token_pattern='[a-zA-Z]{3,}', binary=True, norm=None,
+                                                             alternate_sign=False)
+            else:
+                self.vectorizers['name'] = CountVectorizer(max_features=4000, stop_words='english', analyzer='word',
+                                                           strip_accents='ascii', dtype=bool,
+                                                           token_pattern='[a-zA-Z]{3,}', binary=True)
+                self.vectorizers['name'].fit(stemmed_names)
 
-            name_matrix = self.vectorizers['name'].fit_transform(ds.names.apply(self.snowball))
-            column_names = self.vectorizers['name'].get_feature_names()
-            names = pd.DataFrame.sparse.from_spmatrix(name_matrix, columns=column_names, index=ds.names.index)
+            names = vectorize(self.vectorizers['name'], stemmed_names, ds.names.index)
 
             self.target_encoder = LabelEncoder()
             x_train, x_test, y_train, y_test = train_test_split(names, self.target_encoder.fit_transform(ds.target),
@@ -46,28 +147,69 @@ class CategoryPredictor:
             lgb_train = lgb.Dataset(x_train, y_train)
             lgb_eval = lgb.Dataset(x_test, y_test, reference=lgb_train)
 
-            params = {
-                'seed': 1,
-                'objective': 'multiclass',
-                'num_class': ds.target.nunique(),
-                'metric': 'multi_error',
-                'max_depth': 9,
-                'num_leaves': 45,
-                'min_data_in_leaf': 2,
-                'feature_fraction': 0.2,
-            }
+            params = {**CATEGORY_PARAMS, 'num_class': ds.target.nunique()}
 
             self.model = lgb.train(params, lgb_train, num_boost_round=5000, valid_sets=[lgb_train, lgb_eval],
                                    early_stopping_rounds=100, verbose_eval=False)
-
-    def predict(self, ds: DataStore, process=True):
+            self.metadata = self.build_metadata(ds.target, curated_product_codes=curated_product_codes(ds))
+
+    def build_metadata(self, target: pd.Series, **training_stats) -> dict:
+        """
+        Summarises the trained model so inference doesn't have to work it out again: the Unknown baseline, the classes
+        and number of features the booster expects, and a few training statistics
+        """
+        blank_product = vectorize(self.vectorizers['name'], [''], index=[0])
+        return {
+            'unknown_confidence': float(self.model.predict(blank_product).max(axis=1)[0]),
+            'classes': list(self.target_encoder.classes_),
+            'features': self.features,
+            'n_features': n_features_of(self.vectorizers['name']),
+            'n_training_rows': len(target),
+            'class_counts': {c: int(n) for c, n in target.value_counts().items()},
+            'num_trees': self.model.num_trees(),
+            'trained_at': datetime.now().isoformat(timespec='seconds'),
+            **training_stats,
+        }
+
+    def update(self, ds: DataStore, num_boost_round=100) -> int:
+        """
+        Continues boosting the trained model on the labelled names in ds, keeping the fitted vectorizer and target
+        encoder. Rows labelled with a category the model has never seen can't be learned this way and are skipped.
+        Returns the number of rows used.
+        """
+        known = ds.target.isin(self.target_encoder.classes_)
+        if not known.any():
+            return 0
+
+        stemmed_names = ds.names.loc[known].apply(self.snowball)
+        names = vectorize(self.vectorizers['name'], stemmed_names, stemmed_names.index)
+        lgb_train = lgb.Dataset(names, self.target_encoder.transform(ds.target.loc[known]))
+
+        params = {**CATEGORY_PARAMS, 'num_class': len(self.target_encoder.classes_)}
+        self.model = lgb.train(params, lgb_train, num_boost_round=num_boost_round, init_model=self.model,
+                               keep_training_booster=True, verbose_eval=False)
+        # Training statistics still describe the original corpus; only the warm start is added on top
+        self.metadata = {**self.metadata,
+                         **self.build_metadata(ds.target.loc[known]),
+                         'n_training_rows': self.metadata.get('n_training_rows'),
+                         'class_counts': self.metadata.get('class_counts'),
+                         'n_warm_start_rows': int(known.sum()),
+                         'curated_product_codes': sorted(set(self.metadata.get('curated_product_codes', [])) |
+                                                         set(curated_product_codes(ds, known)))}
+        return int(known.sum())
+
+    def accuracy(self, ds: DataStore, chunk_size=None) -> float:
+        """ Fraction of the labelled names in ds whose top predicted category matches the label """
+        pred = self.predict(ds, process=False, chunk_size=chunk_size)
+        predicted = self.target_encoder.inverse_transform(pred.argmax(axis=1))
+        return float((predicted == ds.target.to_numpy()).mean())
+
+    def predict(self, ds: DataStore, process=True, chunk_size=None):
+        """ chunk_size bounds how many names are vectorized at once; by default the whole store is done in one go """
         if 'name' in self.vectorizers:
-            name_matrix = self.vectorizers['name'].transform(ds.names.apply(self.snowball))
-            column_names = self.vectorizers['name'].get_feature_names()
-            test = pd.DataFrame.sparse.from_spmatrix(name_matrix, columns=column_names, index=ds.names.index)
+            pred = predict_in_chunks(self.model, self.vectorizers['name'], ds.names.apply(self.snowball), chunk_size)
         else:
-            test = ds.df
-        pred = self.model.predict(test)
+            pred = self.model.predict(ds.df)
 
         if process is False:
             return pred
@@ -89,29 +231,66 @@ class CategoryPredictor:
         return pd.concat([pred_name1, confidence1, pred_name2, confidence2, pred_name3, confidence3],
                          axis=1, sort=False)
 
+    def unknown_confidence(self) -> float:
+        """
+        Top confidence the model gives a blank name, i.e. the score of a product with no recognisable words. Stored in
+        the metadata at training time; only models dumped before that have to compute it here.
+        """
+        if 'unknown_confidence' not in self.metadata:
+            blank_product = vectorize(self.vectorizers['name'], [''], index=[0])
+            self.metadata['unknown_confidence'] = float(self.model.predict(blank_product).max(axis=1)[0])
+        return self.metadata['unknown_confidence']
+
+    def unknown_mask(self, confidences, tolerance=1e-6, min_confidence=None) -> np.ndarray:
+        """
+        Flags top confidences that should be reported as Unknown: those within tolerance of the blank-name baseline
+        (a tolerance rather than exact equality, so compiled boosters with slightly different rounding still match)
+        and, if min_confidence is given, any below it
+        """
+        confidences = np.asarray(confidences, dtype=float)
+        mask = np.isclose(confidences, self.unknown_confidence(), rtol=0, atol=tolerance)
+        if min_confidence is not None:
+            mask |= confidences < min_confidence
+        return mask
+
     def dump_model(self, model_path, model_version):
-        pickle.dump((self.model, self.vectorizers, self.target_encoder, model_version), open(model_path, 'wb'))
+        pickle.dump((self.model, self.vectorizers, self.target_encoder, model_version, self.metadata),
+                    open(model_path, 'wb'))
 
 
 class SubcategoryPredictor:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, features='count', n_features=2 ** 12):
+        """ features and n_features behave as they do for CategoryPredictor, applied to every per-category model """
         if model_path is None:
             self.model = None
             self.vectorizers = {}
             self.target_encoder = None
             self.model_version = None
+            self.metadata = {}
         else:
-            self.model, self.vectorizers, self.target_encoder, self.model_version = pickle.load(open(model_path, 'rb'))
+            self.model, self.vectorizers, self.target_encoder, self.model_version, self.metadata = \
+                load_artifact(model_path)
+            if self.vectorizers:
+                features = feature_mode(next(iter(self.vectorizers.values())))
+
+        if features not in FEATURE_MODES:
+            raise ValueError(f'features must be one of {FEATURE_MODES}, not {features}')
+        self.features = features
+        self.n_features = n_features
 
     def train(self, ds: DataStore):
         self.model = {}
+        self.metadata = {'features': self.features, 'trained_at': datetime.now().isoformat(timespec='seconds'),
+                         'categories': {}}
 
         self.vectorizers = {}
         self.target_encoder = {}
 
         for cat in ds.target.unique():
-            target = ds.subtarget.loc[ds.target == cat]
-            names = ds.names.loc[ds.target == cat]
+            # Curator labels may carry a category without a subcategory; those rows only inform the category model
+            in_category = (ds.target == cat) & ds.subtarget.notnull()
+            target = ds.subtarget.loc[in_category]
+            names = ds.names.loc[in_category]
             classes = target.nunique()
 
             if classes == 1:
@@ -122,11 +301,15 @@ class SubcategoryPredictor:
                 self.model[cat] = ''
                 continue
 
-            self.vectorizers[cat] = CountVectorizer(max_features=1000, stop_words='english', analyzer='word',
-                                                    strip_accents='ascii', dtype=int)
-            names_matrix = pd.DataFrame.sparse.from_spmatrix(self.vectorizers[cat].fit_transform(names),
-                                                             columns=self.vectorizers[cat].get_feature_names(),
-                                                             index=names.index)
+            if self.features == 'hashing':
+                self.vectorizers[cat] = HashingVectorizer(n_features=self.n_features, stop_words='english',
+                                                          analyzer='word', strip_accents='ascii', dtype=np.float32,
+                                                          norm=None, alternate_sign=False)
+            else:
+                self.vectorizers[cat] = CountVectorizer(max_features=1000, stop_words='english', analyzer='word',
+                                                        strip_accents='ascii', dtype=int)
+                self.vectorizers[cat].fit(names)
+            names_matrix = vectorize(self.vectorizers[cat], names, names.index)
 
             self.target_encoder[cat] = LabelEncoder()
             encoded_target = self.target_encoder[cat].fit_transform(target)
@@ -152,34 +335,63 @@ class SubcategoryPredictor:
 
             self.model[cat] = lgb.train(params, lgb_train, num_boost_round=5000, valid_sets=[lgb_train, lgb_eval],
                                         early_stopping_rounds=50, verbose_eval=False)
+            self.metadata['categories'][cat] = {
+                'classes': list(self.target_encoder[cat].classes_),
+                'n_features': n_features_of(self.vectorizers[cat]),
+                'n_training_rows': len(target),
+                'num_trees': self.model[cat].num_trees(),
+            }
 
-    def predict(self, ds: DataStore, category_predictions: pd.Series):
-        pred = pd.Series(index=ds.names.index, name='Sub-Category')
-        conf = pd.Series(index=ds.names.index, name='Sub-Category Confidence')
+    def predict_group(self, cat, names: pd.Series, chunk_size=None, **predict_params) -> (list, list):
+        """ Returns the subcategory predictions and confidences for a group of names sharing the category cat """
+        if cat not in self.model.keys():
+            return ['Unknown'] * len(names), [0.0] * len(names)
+        elif isinstance(self.model[cat], str):
+            return [self.model[cat]] * len(names), [1.0] * len(names)
+
+        model_prediction = predict_in_chunks(self.model[cat], self.vectorizers[cat], names, chunk_size,
+                                             **predict_params)
+        return self.target_encoder[cat].inverse_transform(model_prediction.argmax(axis=1)), \
+            model_prediction.max(axis=1)
+
+    def predict(self, ds: DataStore, category_predictions: pd.Series, n_jobs: int = 1, chunk_size=None):
+        """
+        Predicts subcategories within each predicted category. Category groups are independent of each other, so when
+        n_jobs > 1 they are spread across a pool of forked worker processes (n_jobs=-1 uses every core). chunk_size
+        bounds how many names of a group are vectorized at once.
+        """
+        pred = pd.Series(index=ds.names.index, name='Sub-Category', dtype=object)
+        conf = pd.Series(index=ds.names.index, name='Sub-Category Confidence', dtype=float)
 
         if not category_predictions.index.equals(ds.names.index):
             print('some error')
             return None
 
-        for cat in category_predictions.unique():
-            names = ds.names.loc[category_predictions == cat]
-            if cat not in self.model.keys():
-                pred.loc[names.index] = 'Unknown'
-                conf.loc[names.index] = 0.0
-            elif isinstance(self.model[cat], str):
-                pred.loc[names.index] = self.model[cat]
-                conf.loc[names.index] = 1.0
-            else:
-                names_matrix = pd.DataFrame.sparse.from_spmatrix(self.vectorizers[cat].transform(names),
-                                                                 columns=self.vectorizers[cat].get_feature_names(),
-                                                                 index=names.index)
-
-                model_prediction = self.model[cat].predict(names_matrix)
-
-                pred.loc[names.index] = self.target_encoder[cat].inverse_transform(model_prediction.argmax(axis=1))
-                conf.loc[names.index] = model_prediction.max(axis=1)
+        groups = {cat: ds.names.loc[category_predictions == cat] for cat in category_predictions.unique()}
+
+        # Only the groups with a trained booster are worth shipping to the pool
+        model_groups = [cat for cat in groups if cat in self.model.keys() and not isinstance(self.model[cat], str)]
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        n_jobs = min(n_jobs, len(model_groups))
+
+        results = {}
+        if n_jobs > 1:
+            mp_context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp_context,
+                                     initializer=_init_subcategory_worker, initargs=(self,)) as executor:
+                # Submit the largest groups first so a big category doesn't end up running alone at the end
+                futures = [executor.submit(_predict_subcategory_group, cat, groups[cat], chunk_size)
+                           for cat in sorted(model_groups, key=lambda c: len(groups[c]), reverse=True)]
+                results.update(future.result() for future in futures)
+
+        for cat, names in groups.items():
+            if cat not in results:
+                results[cat] = self.predict_group(cat, names, chunk_size)
+            pred.loc[names.index], conf.loc[names.index] = results[cat]
 
         return pd.concat([pred, conf], axis=1)
 
     def dump_model(self, model_path, model_version):
-        pickle.dump((self.model, self.vectorizers, self.target_encoder, model_version), open(model_path, 'wb'))
+        pickle.dump((self.model, self.vectorizers, self.target_encoder, model_version, self.metadata),
+                    open(model_path, 'wb'))
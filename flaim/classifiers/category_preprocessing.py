@@ -1,8 +1,15 @@
+import hashlib
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 
 from flaim.database.product_mappings import REFERENCE_SUBCATEGORIES_CODING_DICT, REFERENCE_CATEGORIES_CODING_DICT, \
     FLIP_TO_FLAIME_CONVERSION_DICT
 
+NUTRIENT_COLUMNS = ['calories', 'sodium', 'calcium_dv', 'totalfat', 'saturatedfat', 'transfat', 'totalcarbohydrate',
+                    'dietaryfiber', 'sugar', 'protein', 'cholesterol', 'vitamina_dv', 'vitaminc_dv', 'iron_dv']
+
 
 class DataStore:
     def __init__(self):
@@ -12,14 +19,91 @@ class DataStore:
         self.ingredients = None
         self.target = None
         self.subtarget = None
+        # Product codes of curator-verified rows, so models can record which curated products they were trained on
+        self.product_codes = None
 
     def preprocess(self, process_names=True, process_ingredients=False):
         self.names = self.df.pop('name')
         self.ingredients = self.df.pop('ingredients')
+        self.df = self.df[NUTRIENT_COLUMNS]
+
+    def to_npz(self, path: Path):
+        """ Writes the store to a compressed .npz file so it can be reloaded without Excel or database access """
+        arrays = {
+            'columns': np.array(self.df.columns, dtype=str),
+            'values': self.df.astype(float).to_numpy(),
+            'names': self.names.fillna('').to_numpy(dtype=str),
+            'ingredients': self.ingredients.fillna('').to_numpy(dtype=str),
+        }
+        # Labels are optional; unlabelled stores (e.g. plain FLAIME) simply don't write them
+        for label in ('target', 'subtarget', 'product_codes'):
+            if getattr(self, label) is not None:
+                arrays[label] = getattr(self, label).fillna('').to_numpy(dtype=str)
+        np.savez_compressed(path, **arrays)
+
+    @staticmethod
+    def from_npz(path: Path) -> 'DataStore':
+        """ Reads a store written by to_npz(). Empty labels are restored as nulls. """
+        ds = DataStore()
+        with np.load(path) as npz:
+            ds.df = pd.DataFrame(npz['values'], columns=npz['columns'])
+            ds.names = pd.Series(npz['names'], name='name', dtype=object)
+            ds.ingredients = pd.Series(npz['ingredients'], name='ingredients', dtype=object)
+            for label in ('target', 'subtarget', 'product_codes'):
+                if label in npz:
+                    setattr(ds, label, pd.Series(npz[label], name=label, dtype=object).replace('', np.nan))
+        return ds
+
+
+def concat_datastores(stores: [DataStore]) -> DataStore:
+    """ Stacks labelled stores into a single training corpus, dropping any rows without a category label """
+    ds = DataStore()
+    ds.df = pd.concat([s.df for s in stores], ignore_index=True)
+    ds.names = pd.concat([s.names for s in stores], ignore_index=True)
+    ds.ingredients = pd.concat([s.ingredients for s in stores], ignore_index=True)
+    ds.target = pd.concat([s.target for s in stores], ignore_index=True)
+    ds.subtarget = pd.concat([s.subtarget for s in stores], ignore_index=True)
+    ds.product_codes = pd.concat([s.product_codes if s.product_codes is not None
+                                  else pd.Series(np.nan, index=s.names.index, dtype=object) for s in stores],
+                                 ignore_index=True)
+
+    labelled = ds.target.notnull()
+    for attr in ('df', 'names', 'ingredients', 'target', 'subtarget', 'product_codes'):
+        setattr(ds, attr, getattr(ds, attr).loc[labelled].reset_index(drop=True))
+    return ds
+
+
+def subset_datastore(ds: DataStore, positions) -> DataStore:
+    """ Returns a new store holding only the rows at the given positions, re-indexed from 0 """
+    subset = DataStore()
+    for attr in ('df', 'names', 'ingredients', 'target', 'subtarget', 'product_codes'):
+        if getattr(ds, attr) is not None:
+            setattr(subset, attr, getattr(ds, attr).iloc[positions].reset_index(drop=True))
+    return subset
+
+
+def split_datastore(ds: DataStore, test_size: float = 0.2, random_state: int = 3) -> (DataStore, DataStore):
+    """ Randomly splits a labelled store into (train, test) stores, e.g. to hold out products for evaluation """
+    positions = np.random.RandomState(random_state).permutation(len(ds.names))
+    n_test = int(round(len(positions) * test_size))
+    return subset_datastore(ds, np.sort(positions[n_test:])), subset_datastore(ds, np.sort(positions[:n_test]))
+
 
-        columns = ['calories', 'sodium', 'calcium_dv', 'totalfat', 'saturatedfat', 'transfat', 'totalcarbohydrate',
-                   'dietaryfiber', 'sugar', 'protein', 'cholesterol', 'vitamina_dv', 'vitaminc_dv', 'iron_dv']
-        self.df = self.df[columns]
+def sample_datastore(ds: DataStore, per_category: int, random_state: int = 3) -> DataStore:
+    """ Samples up to per_category labelled rows from every category, so rare categories are still represented """
+    rng = np.random.RandomState(random_state)
+    positions = []
+    for _, rows in pd.Series(np.arange(len(ds.target)), index=ds.target.to_numpy()).groupby(level=0):
+        positions.extend(rng.choice(rows.to_numpy(), min(len(rows), per_category), replace=False))
+    return subset_datastore(ds, np.sort(positions))
+
+
+class Names(DataStore):
+    """ Bare product names, for predicting categories of products that aren't in FLIP or the database """
+    def __init__(self, names):
+        super().__init__()
+        self.names = pd.Series(list(names), name='name', dtype=object)
+        self.df = pd.DataFrame(index=self.names.index)
 
 
 class FLIP(DataStore):
@@ -46,11 +130,36 @@ class FLIP(DataStore):
         super().preprocess()
 
 
+def load_flip(path: Path, cache_dir: Path = None, **kwargs) -> DataStore:
+    """
+    Returns the parsed FLIP workbook at path. With cache_dir set, the parsed result is cached as .npz keyed on the
+    workbook's size and modification time, so the slow pd.read_excel only runs when the workbook changes.
+    """
+    if cache_dir is None:
+        return FLIP(path, **kwargs)
+
+    path = Path(path)
+    stat = path.stat()
+    key = f'{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}:{sorted(kwargs.items())}'
+    cached = Path(cache_dir) / f'flip_{hashlib.md5(key.encode()).hexdigest()}.npz'
+    if cached.exists():
+        return DataStore.from_npz(cached)
+
+    ds = FLIP(path, **kwargs)
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    ds.to_npz(cached)
+    return ds
+
+
 class FLAIME(DataStore):
-    def __init__(self, products=None, nutrition_facts=None, most_recent_bool=True):
+    def __init__(self, products=None, nutrition_facts=None, most_recent_bool=True, product_ids=None):
         super().__init__()
         if products is not None and nutrition_facts is not None:
-            if most_recent_bool:
+            # An explicit list of ids (e.g. one chunk of a distributed job) takes precedence over most_recent_bool
+            if product_ids is not None:
+                product_df = pd.DataFrame(list(products.objects.filter(id__in=product_ids).values()))
+                nft_df = pd.DataFrame(list(nutrition_facts.objects.filter(product_id__in=product_ids).values()))
+            elif most_recent_bool:
                 product_df = pd.DataFrame(list(products.objects.filter(most_recent=True).values()))
                 nft_df = pd.DataFrame(list(nutrition_facts.objects.filter(product__most_recent=True).values()))
             else:
@@ -66,3 +175,29 @@ class FLAIME(DataStore):
         nft_df = pd.read_csv('data/git_flaime_nutrition_facts.csv')
         self.df = product_df.merge(nft_df, left_on='id', right_on='product_id')
         self.preprocess()
+
+
+class CuratedFLAIME(DataStore):
+    """
+    Most recent FLAIME products whose category has been verified by a curator (i.e. has a
+    CategoryProductCodeMappingSupport record), labelled with the curated category and subcategory
+    """
+    def __init__(self, products, nutrition_facts, mappings):
+        super().__init__()
+        curated_codes = mappings.objects.values('product_code')
+        product_df = pd.DataFrame(list(products.objects.filter(most_recent=True, product_code__in=curated_codes)
+                                       .values('id', 'product_code', 'name')),
+                                  columns=['id', 'product_code', 'name'])
+        nft_df = pd.DataFrame(list(nutrition_facts.objects.filter(product__most_recent=True,
+                                                                  product__product_code__in=curated_codes)
+                                   .values('product_id', 'ingredients', *NUTRIENT_COLUMNS)),
+                              columns=['product_id', 'ingredients'] + NUTRIENT_COLUMNS)
+        labels = pd.DataFrame(list(mappings.objects.values('product_code', 'category', 'subcategory')),
+                              columns=['product_code', 'category', 'subcategory'])
+
+        self.df = product_df.merge(nft_df, left_on='id', right_on='product_id').merge(labels, on='product_code')
+        self.product_ids = self.df['id']
+        self.product_codes = self.df['product_code']
+        self.target = self.df.pop('category')
+        self.subtarget = self.df.pop('subcategory')
+        self.preprocess()
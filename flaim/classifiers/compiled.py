@@ -0,0 +1,141 @@
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from flaim.classifiers.category_prediction import CategoryPredictor, SubcategoryPredictor
+from flaim.classifiers.category_preprocessing import DataStore
+
+"""
+Optional compiled inference backend for the category models. Each LightGBM booster is compiled to a shared library
+with treelite, and the libraries are loaded in place of the boosters so CategoryPredictor/SubcategoryPredictor work
+unchanged. treelite is not part of the base requirements:
+
+>pip install treelite treelite_runtime
+
+Compile once per model version with `python manage.py compile_classifiers`, then pass the output directory to
+`assign_categories --compiled_models` for bulk re-scoring.
+"""
+
+try:
+    import treelite
+    import treelite_runtime
+except ImportError:
+    treelite = None
+    treelite_runtime = None
+
+MANIFEST = 'manifest.json'
+
+
+def _require_treelite():
+    if treelite is None or treelite_runtime is None:
+        raise ImportError('The compiled classifier backend requires treelite and treelite_runtime '
+                          '(pip install treelite treelite_runtime)')
+
+
+class CompiledBooster:
+    """ Stands in for a multiclass lgb.Booster, running predictions through a treelite shared library """
+
+    def __init__(self, libpath: Path, nthread: int = None, chunk_size: int = 4096):
+        _require_treelite()
+        self.libpath = Path(libpath)
+        self.chunk_size = chunk_size
+        self.predictor = treelite_runtime.Predictor(str(libpath), nthread=nthread, verbose=False)
+
+    def predict(self, data, **predict_params) -> np.ndarray:
+        if isinstance(data, pd.DataFrame):
+            data = data.sparse.to_coo().tocsr() if hasattr(data, 'sparse') else data.to_numpy()
+
+        # LightGBM treats absent sparse entries as zeros while treelite treats them as missing, so rows are densified
+        # chunk_size at a time before they go through the library
+        predictions = []
+        for i in range(0, max(data.shape[0], 1), self.chunk_size):
+            chunk = data[i:i + self.chunk_size]
+            if scipy.sparse.issparse(chunk):
+                chunk = chunk.toarray()
+            dmat = treelite_runtime.DMatrix(np.asarray(chunk, dtype=np.float32), dtype='float32')
+            predictions.append(self.predictor.predict(dmat).reshape(chunk.shape[0], -1))
+        return np.vstack(predictions)
+
+
+def compile_predictors(predictor: CategoryPredictor, sub_predictor: SubcategoryPredictor, outdir: Path,
+                       toolchain: str = 'gcc', parallel_comp: int = 8) -> Path:
+    """
+    Compiles the category booster and every per-category subcategory booster into shared libraries in outdir, along
+    with a manifest recording which library belongs to which model. Returns the manifest path.
+    """
+    _require_treelite()
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    def compile_booster(booster, name: str) -> str:
+        libname = f'{name}.so'
+        model = treelite.Model.from_lightgbm(booster)
+        model.export_lib(toolchain=toolchain, libpath=str(outdir / libname), params={'parallel_comp': parallel_comp},
+                         verbose=False)
+        return libname
+
+    manifest = {
+        'model_version': predictor.model_version,
+        'sub_model_version': sub_predictor.model_version,
+        'category': compile_booster(predictor.model, 'category'),
+        # Category names aren't safe file names, so subcategory libraries are numbered
+        'subcategory': {cat: compile_booster(booster, f'subcategory_{i}')
+                        for i, (cat, booster) in enumerate(sorted(sub_predictor.model.items()))
+                        if not isinstance(booster, str)},
+    }
+    manifest_path = outdir / MANIFEST
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest_path
+
+
+def load_compiled(predictor: CategoryPredictor, sub_predictor: SubcategoryPredictor, libdir: Path,
+                  nthread: int = None):
+    """
+    Swaps the boosters of both predictors for the compiled libraries in libdir. The libraries must have been compiled
+    from the same model versions.
+    """
+    libdir = Path(libdir)
+    with open(libdir / MANIFEST) as f:
+        manifest = json.load(f)
+
+    if (manifest['model_version'], manifest['sub_model_version']) != (predictor.model_version,
+                                                                      sub_predictor.model_version):
+        raise ValueError(f'Compiled models in {libdir} are for versions {manifest["model_version"]}/'
+                         f'{manifest["sub_model_version"]}, not {predictor.model_version}/'
+                         f'{sub_predictor.model_version}')
+
+    predictor.model = CompiledBooster(libdir / manifest['category'], nthread)
+    for cat, libname in manifest['subcategory'].items():
+        sub_predictor.model[cat] = CompiledBooster(libdir / libname, nthread)
+
+
+def benchmark(predictor: CategoryPredictor, sub_predictor: SubcategoryPredictor,
+              compiled_predictor: CategoryPredictor, compiled_sub_predictor: SubcategoryPredictor,
+              ds: DataStore, repeat: int = 3) -> pd.DataFrame:
+    """
+    Times category + subcategory prediction over ds with the LightGBM boosters and with the compiled libraries.
+    Returns names/sec for each backend and the largest difference between their category probabilities.
+    """
+    def run(category_predictor, subcategory_predictor):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            probabilities = category_predictor.predict(ds, process=False)
+            category_predictions = pd.Series(category_predictor.target_encoder.inverse_transform(
+                probabilities.argmax(axis=1)), index=ds.names.index)
+            subcategory_predictor.predict(ds, category_predictions)
+            timings.append(time.perf_counter() - start)
+        return len(ds.names) / min(timings), probabilities
+
+    lightgbm_rate, lightgbm_probabilities = run(predictor, sub_predictor)
+    compiled_rate, compiled_probabilities = run(compiled_predictor, compiled_sub_predictor)
+    return pd.DataFrame({
+        'backend': ['lightgbm', 'treelite'],
+        'names/sec': [lightgbm_rate, compiled_rate],
+        'max probability difference': [0.0, float(np.abs(lightgbm_probabilities - compiled_probabilities).max())],
+    })
@@ -0,0 +1,69 @@
+import json
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+from flaim.classifiers.category_prediction import CategoryPredictor, SubcategoryPredictor
+from flaim.classifiers.category_preprocessing import DataStore
+
+"""
+Scoring of the category models against a labelled DataStore. Used by the classifier regression tests in
+flaim/classifiers/tests and by freeze_classifier_sample, which records the baseline those tests compare against by
+running the current models on the frozen sample.
+"""
+
+CLASSIFIER_TEST_DATA = Path(__file__).parent / 'tests' / 'data'
+CLASSIFIER_SAMPLE = CLASSIFIER_TEST_DATA / 'labelled_sample.npz'
+CLASSIFIER_BASELINE = CLASSIFIER_TEST_DATA / 'baseline.json'
+
+
+def predict(predictor: CategoryPredictor, sub_predictor: SubcategoryPredictor, ds: DataStore) -> tuple:
+    probabilities = predictor.predict(ds, process=False)
+    categories = pd.Series(predictor.target_encoder.inverse_transform(probabilities.argmax(axis=1)),
+                           index=ds.names.index)
+    return probabilities, categories, sub_predictor.predict(ds, categories)
+
+
+def evaluate(predictor: CategoryPredictor, sub_predictor: SubcategoryPredictor, ds: DataStore, repeat: int = 3) -> dict:
+    """
+    Scores both models on the labelled store, timing the best of repeat runs. Peak memory is traced in a separate run
+    afterwards, since tracemalloc slows down the allocations being timed.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        probabilities, categories, subcategories = predict(predictor, sub_predictor, ds)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    predict(predictor, sub_predictor, ds)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Labels the encoder has never seen can't be predicted; encoding them as -1 counts them as misses
+    class_index = {c: i for i, c in enumerate(predictor.target_encoder.classes_)}
+    encoded_target = ds.target.map(class_index).fillna(-1).to_numpy()
+    top3 = probabilities.argsort(axis=1)[:, -3:]
+
+    correct = pd.Series(categories.to_numpy() == ds.target.to_numpy(), index=ds.target.to_numpy())
+    has_subtarget = ds.subtarget.notnull().to_numpy()
+    sub_correct = subcategories['Sub-Category'].to_numpy()[has_subtarget] == ds.subtarget.to_numpy()[has_subtarget]
+
+    return {
+        'model_version': predictor.model_version,
+        'sub_model_version': sub_predictor.model_version,
+        'top1_accuracy': float(correct.mean()),
+        'top3_accuracy': float((top3 == encoded_target[:, None]).any(axis=1).mean()),
+        'subcategory_accuracy': float(sub_correct.mean()) if len(sub_correct) else 1.0,
+        'category_recall': {c: float(r) for c, r in correct.groupby(level=0).mean().items()},
+        'category_support': {c: int(n) for c, n in correct.groupby(level=0).size().items()},
+        'names_per_sec': len(ds.names) / min(timings),
+        'peak_memory_mb': peak_memory / 2 ** 20,
+    }
+
+
+def write_baseline(metrics: dict, path: Path = CLASSIFIER_BASELINE):
+    with open(path, 'w') as f:
+        json.dump(metrics, f, indent=2, sort_keys=True)
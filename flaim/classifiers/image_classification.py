@@ -0,0 +1,244 @@
+import abc
+import multiprocessing
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+from flaim.database.models import ProductImage, FrontOfPackLabel, NutritionLabelClassification
+
+"""
+Batch classification of ProductImages on a pool of long-lived worker processes. Each worker builds its classifier
+once and is then fed batches of image paths, so models are loaded once per worker rather than once per image.
+
+Classifiers are pluggable: subclass ImageClassifier and pass its dotted path, e.g.
+
+>python manage.py classify_fop_images --classifier myproject.fop.CerealClassifier
+>python manage.py classify_nutrition_labels --classifier myproject.labels.PanelClassifier
+
+Front-of-pack labels default to CerealClassifier, which runs the CerealClassifier model in-process. A classifier error
+only fails the image that caused it: the rest of its batch is still classified, and failed images are reported and
+picked up again by the next run.
+"""
+
+
+class ImageClassifier(abc.ABC):
+    """
+    Interface for image classifiers run by the pool. __init__ should do any expensive model loading, since it runs once
+    per worker process. classify() receives a batch of absolute image paths and returns one result dict per image.
+
+    For front-of-pack labels each dict needs a 'label_detected' bool and may give a 'classified_image_path' pointing to
+    an annotated copy of the image under MEDIA_ROOT; the whole dict is stored as classifier_result_json.
+
+    For nutrition labels each dict needs a 'classification' that is one of the
+    NutritionLabelClassification.classification_choices codes ('N', 'I' or 'O').
+    """
+
+    @abc.abstractmethod
+    def classify(self, image_paths: [Path]) -> [dict]:
+        pass
+
+
+class CerealClassifier(ImageClassifier):
+    """
+    Front-of-pack classifier running the CerealClassifier model in the worker process. CEREAL_CLASSIFIER_DIR is a
+    checkout of the CerealClassifier project, whose requirements must be installed in this environment, and
+    CEREAL_CLASSIFIER_LOADER the dotted path of the function in it that loads the model. The loader returns a callable
+    taking an image path and an output directory, which writes the annotated image to the directory and returns the
+    result dict the project's cli.py writes as .json. Results go to a <image name>_FOP_classification directory next
+    to each image, like they did with the command line tool.
+    """
+
+    def __init__(self):
+        project_dir = getattr(settings, 'CEREAL_CLASSIFIER_DIR', None)
+        loader = getattr(settings, 'CEREAL_CLASSIFIER_LOADER', None)
+        if project_dir is None or loader is None:
+            raise ImproperlyConfigured('CerealClassifier needs the CEREAL_CLASSIFIER_DIR and CEREAL_CLASSIFIER_LOADER '
+                                       'settings')
+        if str(project_dir) not in sys.path:
+            sys.path.insert(0, str(project_dir))
+        self.model = import_string(loader)()
+
+    def classify(self, image_paths: [Path]) -> [dict]:
+        return [self.classify_image(path) for path in image_paths]
+
+    def classify_image(self, image_path: Path) -> dict:
+        outdir = image_path.parent / f'{image_path.stem}_FOP_classification'
+        if outdir.exists():
+            shutil.rmtree(outdir)  # Get rid of old results
+        outdir.mkdir()
+        return self.model(image_path, outdir)
+
+
+class StubImageClassifier(ImageClassifier):
+    """
+    Deterministic stand-in for tests: never detects a front-of-pack label, points back to the original image and
+    classifies every image as 'other'
+    """
+
+    def classify(self, image_paths: [Path]) -> [dict]:
+        return [{'label_detected': False, 'classified_image_path': str(path), 'classification': 'O'}
+                for path in image_paths]
+
+
+# Populated in each pool worker by _init_image_worker()
+_worker_classifier = None
+
+
+def _init_image_worker(classifier_path: str):
+    global _worker_classifier
+    _worker_classifier = import_string(classifier_path)()
+
+
+def _classify_batch(batch: [(int, str)]) -> [(int, Optional[dict], Optional[str])]:
+    """
+    (image id, result, error) for each image of the batch, where exactly one of result and error is None. If the
+    classifier raises on the batch, its images are retried one at a time so only the ones that fail are lost.
+    """
+    image_ids, image_paths = zip(*batch)
+    try:
+        return [(image_id, result, None) for image_id, result in
+                zip(image_ids, _worker_classifier.classify([Path(p) for p in image_paths]))]
+    except Exception as e:
+        if len(batch) == 1:
+            return [(image_ids[0], None, f'{type(e).__name__}: {e}')]
+
+    results = []
+    for image_id, image_path in batch:
+        try:
+            results.append((image_id, _worker_classifier.classify([Path(image_path)])[0], None))
+        except Exception as e:
+            results.append((image_id, None, f'{type(e).__name__}: {e}'))
+    return results
+
+
+def classify_images(images: [(int, str)], classifier_path: str, n_workers: int = 4, batch_size: int = 32):
+    """
+    Yields (image id, result, error) for each (image id, absolute path) in images, classified in batches of batch_size
+    by n_workers worker processes, each of which builds the classifier once. n_workers=0 runs the classifier in this
+    process instead, which is handy for tests. Either way an image the classifier raises on comes back with the error
+    instead of a result, and the rest of its batch is unaffected.
+    """
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    if n_workers == 0:
+        _init_image_worker(classifier_path)
+        for batch in batches:
+            yield from _classify_batch(batch)
+        return
+
+    # Forked workers must not inherit this process' database connections
+    connections.close_all()
+    mp_context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp_context, initializer=_init_image_worker,
+                             initargs=(classifier_path,)) as executor:
+        futures = [executor.submit(_classify_batch, batch) for batch in batches]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def _successful(results, failures: dict):
+    """ Passes on (image id, result) for the classified images, recording the errors of the others in failures """
+    for image_id, result, error in results:
+        if error is not None:
+            failures[image_id] = error
+        else:
+            yield image_id, result
+
+
+def _report_failures(failures: dict):
+    if failures:
+        print(f'Could not classify {len(failures)} images; they will be retried on the next run')
+        for image_id, error in sorted(failures.items()):
+            print(f'  image {image_id}: {error}')
+
+
+def media_relative_path(path: str) -> str:
+    """ Strips MEDIA_ROOT from an absolute path so ImageFields resolve it as expected """
+    media_root = str(settings.MEDIA_ROOT).rstrip('/') + '/'
+    return path[len(media_root):] if path.startswith(media_root) else path
+
+
+def image_paths(images) -> [(int, str)]:
+    """ (id, absolute path) pairs for a ProductImage queryset, in id order """
+    return [(image_id, str(Path(settings.MEDIA_ROOT) / image_path))
+            for image_id, image_path in images.order_by('id').values_list('id', 'image_path')]
+
+
+def _write_in_chunks(model, objs, write_size: int) -> int:
+    """ Bulk creates the model instances yielded by objs write_size at a time and returns how many were written """
+    created = 0
+    chunk = []
+    for obj in objs:
+        chunk.append(obj)
+        if len(chunk) >= write_size:
+            created += _bulk_create(model, chunk)
+            chunk = []
+    if chunk:
+        created += _bulk_create(model, chunk)
+    return created
+
+
+def _bulk_create(model, chunk) -> int:
+    """
+    Creates the results in chunk for images that don't have one yet. The chunk's ProductImage rows are locked first,
+    so an overlapping run waits here and then sees the results this one wrote; that matters for
+    NutritionLabelClassification, whose image foreign key isn't unique, so conflicts can't simply be ignored.
+    """
+    image_ids = [obj.product_image_id for obj in chunk]
+    with transaction.atomic():
+        list(ProductImage.objects.select_for_update().filter(id__in=image_ids).values_list('id', flat=True))
+        labelled = set(model.objects.filter(product_image_id__in=image_ids).values_list('product_image_id', flat=True))
+        chunk = [obj for obj in chunk if obj.product_image_id not in labelled]
+        model.objects.bulk_create(chunk)
+    return len(chunk)
+
+
+def classify_fop_images(classifier_path: str, n_workers: int = 4, batch_size: int = 32, write_size: int = 500) -> int:
+    """
+    Runs the front-of-pack classifier over every ProductImage without a FrontOfPackLabel and bulk creates the labels
+    write_size at a time. Images that were already classified are skipped, so an interrupted run can simply be
+    restarted, and images the classifier failed on are reported. Returns the number of labels created.
+    """
+    images = image_paths(ProductImage.objects.filter(fop_label__isnull=True))
+    print(f'Found {len(images)} images without a front-of-pack label')
+
+    failures = {}
+    results = _successful(classify_images(images, classifier_path, n_workers, batch_size), failures)
+    labels = (FrontOfPackLabel(product_image_id=image_id, classifier_result_json=result,
+                               label_detected=bool(result['label_detected']),
+                               classified_image_path=media_relative_path(result.get('classified_image_path', '')))
+              for image_id, result in results)
+    created = _write_in_chunks(FrontOfPackLabel, labels, write_size)
+    _report_failures(failures)
+    return created
+
+
+def classify_nutrition_labels(classifier_path: str, n_workers: int = 4, batch_size: int = 32,
+                              write_size: int = 500) -> int:
+    """
+    Runs the nutrition label classifier over every ProductImage without a NutritionLabelClassification and bulk
+    creates the classifications write_size at a time. Like classify_fop_images(), interrupted runs pick up where they
+    left off and failed images are reported. Returns the number of classifications created.
+    """
+    images = image_paths(ProductImage.objects.filter(image_classification__isnull=True))
+    print(f'Found {len(images)} images without a nutrition label classification')
+
+    valid_choices = {code for code, _ in NutritionLabelClassification.classification_choices}
+    failures = {}
+
+    def classifications():
+        for image_id, result in _successful(classify_images(images, classifier_path, n_workers, batch_size), failures):
+            if result.get('classification') not in valid_choices:
+                print(f"Skipping image {image_id}: unexpected classification {result.get('classification')}")
+                continue
+            yield NutritionLabelClassification(product_image_id=image_id, classification=result['classification'])
+
+    created = _write_in_chunks(NutritionLabelClassification, classifications(), write_size)
+    _report_failures(failures)
+    return created
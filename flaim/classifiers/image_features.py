@@ -0,0 +1,159 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from scipy.fftpack import dct
+
+"""
+Precomputed, fixed-size features for ProductImages so image jobs don't have to decode JPEGs from MEDIA_ROOT again.
+
+Records are appended to a single flat binary file and read back as a memory-mapped structured NumPy array, so
+ImageFeatureStore.field('pixels') etc. are zero-copy views onto the file. Populate or extend the store with:
+
+>python manage.py build_image_features
+"""
+
+THUMBNAIL_SIZE = 32
+HISTOGRAM_BINS = 16
+
+FEATURE_DTYPE = np.dtype([
+    ('image_id', np.int64),
+    ('pixels', np.uint8, (THUMBNAIL_SIZE, THUMBNAIL_SIZE, 3)),  # RGB thumbnail
+    ('histogram', np.float32, (3 * HISTOGRAM_BINS,)),  # Normalised per-channel colour histogram
+    ('phash', np.uint64),  # 64-bit DCT perceptual hash
+])
+
+FEATURE_FILE = 'features.dat'
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """ 64-bit pHash: signs of the low-frequency 8x8 DCT coefficients of a 32x32 greyscale copy relative to their median """
+    pixels = np.asarray(image.convert('L').resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    low_frequencies = dct(dct(pixels, axis=0, norm='ortho'), axis=1, norm='ortho')[:8, :8]
+    bits = (low_frequencies > np.median(low_frequencies)).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def compute_image_features(image_id: int, path: Path) -> np.ndarray:
+    """ Returns a single FEATURE_DTYPE record for the image at path """
+    record = np.zeros(1, dtype=FEATURE_DTYPE)
+    with Image.open(path) as image:
+        image = image.convert('RGB')
+        thumbnail = image.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BILINEAR)
+
+        histogram = np.asarray(image.resize((128, 128), Image.BILINEAR).histogram(), dtype=np.float32)
+        # Pillow gives 256 bins per channel; fold them into HISTOGRAM_BINS and normalise each channel
+        histogram = histogram.reshape(3, HISTOGRAM_BINS, -1).sum(axis=2)
+        histogram /= histogram.sum(axis=1, keepdims=True)
+
+        record['image_id'] = image_id
+        record['pixels'] = np.asarray(thumbnail, dtype=np.uint8)
+        record['histogram'] = histogram.ravel()
+        record['phash'] = perceptual_hash(image)
+    return record
+
+
+def _compute_batch(batch: [(int, str)]) -> np.ndarray:
+    records = []
+    for image_id, path in batch:
+        try:
+            records.append(compute_image_features(image_id, Path(path)))
+        except (OSError, ValueError) as e:
+            print(f'Could not compute features for image {image_id} ({path}): {e}')
+    return np.concatenate(records) if records else np.zeros(0, dtype=FEATURE_DTYPE)
+
+
+class ImageFeatureStore:
+    """ Append-only store of FEATURE_DTYPE records in outdir, looked up by ProductImage id """
+
+    def __init__(self, outdir: Path):
+        self.outdir = Path(outdir)
+        self.path = self.outdir / FEATURE_FILE
+        self.records = np.zeros(0, dtype=FEATURE_DTYPE)
+        self._sorted_ids = np.zeros(0, dtype=np.int64)
+        self._order = np.zeros(0, dtype=np.int64)
+        self.reload()
+
+    def reload(self):
+        """ Re-maps the file, e.g. after another process has appended to it """
+        n_records = self.path.stat().st_size // FEATURE_DTYPE.itemsize if self.path.exists() else 0
+        if n_records == 0:
+            return
+        # Only map whole records in case another process is midway through an append
+        self.records = np.memmap(self.path, dtype=FEATURE_DTYPE, mode='r', shape=(n_records,))
+        self._order = np.argsort(self.records['image_id'], kind='stable')
+        self._sorted_ids = self.records['image_id'][self._order]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, image_id: int) -> bool:
+        return bool(self.contains([image_id])[0])
+
+    @property
+    def image_ids(self) -> np.ndarray:
+        return self.records['image_id']
+
+    def field(self, name: str) -> np.ndarray:
+        """ Zero-copy view of one feature ('pixels', 'histogram' or 'phash') for every stored image, in storage order """
+        return self.records[name]
+
+    def contains(self, image_ids) -> np.ndarray:
+        image_ids = np.asarray(image_ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.zeros(len(image_ids), dtype=bool)
+        positions = np.searchsorted(self._sorted_ids, image_ids).clip(max=len(self._sorted_ids) - 1)
+        return self._sorted_ids[positions] == image_ids
+
+    def get(self, image_ids) -> np.ndarray:
+        """ Records for the given image ids, in the order requested. Raises KeyError for ids that aren't stored. """
+        image_ids = np.asarray(image_ids, dtype=np.int64)
+        found = self.contains(image_ids)
+        if not found.all():
+            raise KeyError(f'No features stored for images {image_ids[~found].tolist()}')
+        return self.records[self._order[np.searchsorted(self._sorted_ids, image_ids)]]
+
+    def append(self, records: np.ndarray) -> int:
+        """ Appends records for images that aren't stored yet and returns how many were written """
+        records = records[~self.contains(records['image_id'])]
+        if len(records):
+            self.outdir.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'ab') as f:
+                f.write(records.astype(FEATURE_DTYPE).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.reload()
+        return len(records)
+
+    def similar(self, image_id: int, max_distance: int = 8) -> np.ndarray:
+        """ Ids of other stored images whose perceptual hash is within max_distance bits of image_id's """
+        target = self.get([image_id])['phash'][0]
+        distances = np.unpackbits((self.field('phash') ^ target).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        matches = (distances <= max_distance) & (self.image_ids != image_id)
+        return np.asarray(self.image_ids[matches])
+
+
+def update_feature_store(store: ImageFeatureStore, images: [(int, str)], n_workers: int = 4,
+                         batch_size: int = 256) -> int:
+    """
+    Computes features for the (image id, absolute path) pairs not already in the store, spreading batches across
+    n_workers processes and appending each batch as soon as it is done so an interrupted run keeps its progress.
+    Returns the number of images added.
+    """
+    images = [image for image, stored in zip(images, store.contains([i for i, _ in images])) if not stored]
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+
+    added = 0
+    if n_workers == 0:
+        for batch in batches:
+            added += store.append(_compute_batch(batch))
+        return added
+
+    mp_context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp_context) as executor:
+        for records in executor.map(_compute_batch, batches):
+            added += store.append(records)
+    return added
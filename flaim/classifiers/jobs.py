@@ -0,0 +1,96 @@
+import time
+from pathlib import Path
+from typing import Optional
+
+import django_rq
+from rq import Worker
+from rq.job import Job, JobStatus
+from tqdm import tqdm
+
+from flaim.classifiers.category_preprocessing import FLAIME
+from flaim.classifiers.management.accessories import CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL, \
+    predict_categories, save_predictions
+from flaim.classifiers.service import PENDING_STATUSES, dependency_failed, get_predictors, get_prediction_service
+from flaim.database import models
+
+"""
+RQ jobs for scoring products with the category models across many worker processes/boxes.
+
+Workers should be started with the CategoryPredictionWorker class so the models are unpickled once per worker rather
+than once per job:
+
+>python manage.py rqworker low --worker-class flaim.classifiers.jobs.CategoryPredictionWorker
+"""
+
+
+class CategoryPredictionWorker(Worker):
+    """
+    RQ worker that loads the category models configured in settings (CATEGORY_PREDICTOR_MODEL and
+    SUBCATEGORY_PREDICTOR_MODEL) before it starts taking jobs. Work horses are forked from this process, so every job
+    run by the worker inherits the already loaded models.
+    """
+
+    def work(self, *args, **kwargs):
+        get_predictors(CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL)
+        return super().work(*args, **kwargs)
+
+
+def predict_product_chunk(product_ids: [int], category_predictor_model: str = str(CATEGORY_PREDICTOR_MODEL),
+                          subcategory_predictor_model: str = str(SUBCATEGORY_PREDICTOR_MODEL)) -> int:
+    """ RQ job: predicts categories for one chunk of product ids and bulk writes the results back """
+    predictor, sub_predictor = get_predictors(category_predictor_model, subcategory_predictor_model)
+    if not models.Product.objects.filter(id__in=product_ids).exists():
+        return 0
+
+    data = FLAIME(models.Product, models.NutritionFacts, product_ids=product_ids)
+    df = predict_categories(data, predictor, sub_predictor)
+    return save_predictions(df, predictor.model_version, sub_predictor.model_version)
+
+
+def predict_names_job(names: [str]) -> [dict]:
+    """ RQ job backing service.predict_names_remote(); returns plain records so the result pickles cheaply """
+    return get_prediction_service().predict(names).to_dict('records')
+
+
+def enqueue_category_jobs(product_ids: [int], chunk_size: int = 5000, queue_name: str = 'low',
+                          category_predictor_model: Path = CATEGORY_PREDICTOR_MODEL,
+                          subcategory_predictor_model: Path = SUBCATEGORY_PREDICTOR_MODEL,
+                          job_timeout: int = 3600) -> [Job]:
+    """ Splits product_ids into chunks and enqueues one predict_product_chunk job per chunk on an RQ_QUEUES queue """
+    queue = django_rq.get_queue(queue_name)
+    return [queue.enqueue(predict_product_chunk, product_ids[i:i + chunk_size], str(category_predictor_model),
+                          str(subcategory_predictor_model), job_timeout=job_timeout)
+            for i in range(0, len(product_ids), chunk_size)]
+
+
+def wait_for_jobs(jobs: [Job], poll_interval: int = 5, timeout: Optional[int] = None) -> ([Job], [Job]):
+    """
+    Blocks until every job has either finished or ended some other way (failed, stopped, canceled, expired, or
+    deferred on a dependency that failed), showing progress as chunks complete. Jobs still pending after timeout
+    seconds are given up on and counted as failed. Returns (finished jobs, failed jobs).
+    """
+    pending = list(jobs)
+    finished, failed = [], []
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    with tqdm(total=len(jobs), desc="Waiting for prediction jobs") as progress:
+        while pending:
+            still_pending = []
+            for job in pending:
+                status = job.get_status()
+                if status == JobStatus.FINISHED:
+                    finished.append(job)
+                elif status not in PENDING_STATUSES:
+                    failed.append(job)
+                elif status == JobStatus.DEFERRED and dependency_failed(job):
+                    failed.append(job)
+                else:
+                    still_pending.append(job)
+            progress.update(len(pending) - len(still_pending))
+            pending = still_pending
+            if pending and deadline is not None and time.monotonic() >= deadline:
+                print(f"Gave up waiting on {len(pending)} prediction jobs after {timeout} seconds")
+                failed += pending
+                break
+            if pending:
+                time.sleep(poll_interval)
+    return finished, failed
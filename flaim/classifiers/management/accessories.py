@@ -0,0 +1,219 @@
+from pathlib import Path
+
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+
+from flaim.classifiers.category_prediction import CategoryPredictor, SubcategoryPredictor
+from flaim.classifiers.category_preprocessing import DataStore
+from flaim.database.models import Product, Category, Subcategory, ReferenceCategorySupport, \
+    CategoryProductCodeMappingSupport
+
+"""
+Accessory methods for classifiers.management.commands and the classifier RQ jobs
+"""
+
+# Model files used by the commands, the prediction service and the RQ workers, overridable in settings
+CATEGORY_PREDICTOR_MODEL = Path(getattr(settings, 'CATEGORY_PREDICTOR_MODEL',
+                                        Path(__file__).parents[1] / 'data' / 'category_predictor.pkl'))
+SUBCATEGORY_PREDICTOR_MODEL = Path(getattr(settings, 'SUBCATEGORY_PREDICTOR_MODEL',
+                                           Path(__file__).parents[1] / 'data' / 'subcategory_predictor.pkl'))
+
+# Rules for relabelling predictions as 'Unknown', overridable in settings
+UNKNOWN_TOLERANCE = getattr(settings, 'CATEGORY_UNKNOWN_TOLERANCE', 1e-6)
+UNKNOWN_MIN_CONFIDENCE = getattr(settings, 'CATEGORY_UNKNOWN_MIN_CONFIDENCE', None)
+
+
+def predict_categories(data: DataStore, predictor: CategoryPredictor, sub_predictor: SubcategoryPredictor,
+                       n_jobs: int = 1, chunk_size: int = None, unknown_tolerance: float = UNKNOWN_TOLERANCE,
+                       min_confidence: float = UNKNOWN_MIN_CONFIDENCE) -> pd.DataFrame:
+    """
+    Runs the category and subcategory predictors over a dataset (usually FLAIME) and returns a single frame with the product
+    ids, names and predictions. Products the category model can't tell apart from a blank name (within
+    unknown_tolerance), or whose top confidence is below min_confidence, are labelled 'Unknown'.
+    chunk_size bounds how many names are vectorized at once.
+    """
+    predictions = predictor.predict(data, chunk_size=chunk_size)
+
+    unknowns = predictor.unknown_mask(predictions['Conf 1'], unknown_tolerance, min_confidence)
+    predictions.loc[unknowns, 'Pred 1'] = 'Unknown'
+    sub_predictions = sub_predictor.predict(data, predictions['Pred 1'], n_jobs=n_jobs, chunk_size=chunk_size)
+
+    return pd.concat([data.product_ids, data.names, predictions, sub_predictions], axis=1)
+
+
+# Predicted fields, confidences included, compared to tell whether a product's prediction changed, and curator fields
+# carried over to the new row when it did
+CATEGORY_PREDICTION_FIELDS = ['predicted_category_1', 'confidence_1', 'predicted_category_2', 'confidence_2',
+                              'predicted_category_3', 'confidence_3', 'model_version']
+SUBCATEGORY_PREDICTION_FIELDS = ['parent_category_id', 'predicted_subcategory_1', 'confidence_1', 'model_version']
+CURATOR_FIELDS = ['manual_category', 'verified', 'verified_by_id']
+SUB_CURATOR_FIELDS = ['manual_subcategory', 'verified', 'verified_by_id']
+
+
+def _current_rows(model, ids: [int], fields: [str], chunk_size: int) -> dict:
+    """ {id: {field: value}} for the given rows of model, queried chunk_size ids at a time """
+    rows = {}
+    ids = [i for i in ids if i is not None]
+    for i in range(0, len(ids), chunk_size):
+        rows.update((row['id'], row) for row in model.objects.filter(id__in=ids[i:i + chunk_size])
+                    .values('id', *fields))
+    return rows
+
+
+def _prediction_changed(new, old: dict, fields: [str]) -> bool:
+    """ Whether the unsaved row new differs from the stored row old in any of fields; missing values compare equal """
+    return any(getattr(new, f) != old[f] and not (pd.isnull(getattr(new, f)) and pd.isnull(old[f])) for f in fields)
+
+
+def save_predictions(df: pd.DataFrame, model_version: str, sub_model_version: str, batch_size: int = 1000) -> int:
+    """
+    Writes the output of predict_categories() to the database. Category and Subcategory rows are never modified,
+    since HistoricalProduct records point at the same rows: a product whose prediction changed (or that has no row
+    yet) gets a new row, carrying over any curator fields of its previous one, and its foreign keys are repointed with
+    a bulk update. Products whose prediction is unchanged are left alone. Returns the number of products repointed.
+    """
+    df = df.loc[~df['name'].isnull()]
+    records = df.to_dict('records')
+
+    # Keep the first matching reference row to mirror the previous .filter(...)[0] lookup
+    parent_categories = {}
+    for ref in ReferenceCategorySupport.objects.order_by('id'):
+        parent_categories.setdefault((ref.category_name, ref.subcategory_name), ref)
+
+    chunk_size = batch_size * 10
+    current = {}
+    product_ids = [row['id'] for row in records]
+    for i in range(0, len(product_ids), chunk_size):
+        current.update((product_id, (category_id, subcategory_id)) for product_id, category_id, subcategory_id in
+                       Product.objects.filter(id__in=product_ids[i:i + chunk_size])
+                       .values_list('id', 'category_id', 'subcategory_id'))
+    current_categories = _current_rows(Category, [c for c, _ in current.values()],
+                                       CATEGORY_PREDICTION_FIELDS + CURATOR_FIELDS, chunk_size)
+    current_subcategories = _current_rows(Subcategory, [s for _, s in current.values()],
+                                          SUBCATEGORY_PREDICTION_FIELDS + SUB_CURATOR_FIELDS, chunk_size)
+
+    products, categories, subcategories = [], [], []
+    for row in records:
+        category_id, subcategory_id = current.get(row['id'], (None, None))
+        old_category = current_categories.get(category_id)
+        old_subcategory = current_subcategories.get(subcategory_id)
+
+        category = Category(predicted_category_1=row['Pred 1'],
+                            confidence_1=row['Conf 1'],
+                            predicted_category_2=row['Pred 2'],
+                            confidence_2=row['Conf 2'],
+                            predicted_category_3=row['Pred 3'],
+                            confidence_3=row['Conf 3'],
+                            model_version=model_version)
+        parent_category = parent_categories.get((row['Pred 1'], row['Sub-Category']))
+        subcategory = Subcategory(parent_category=parent_category,
+                                  predicted_subcategory_1=row['Sub-Category'],
+                                  confidence_1=row['Sub-Category Confidence'],
+                                  model_version=sub_model_version)
+
+        category_changed = old_category is None or \
+            _prediction_changed(category, old_category, CATEGORY_PREDICTION_FIELDS)
+        subcategory_changed = old_subcategory is None or \
+            _prediction_changed(subcategory, old_subcategory, SUBCATEGORY_PREDICTION_FIELDS)
+        if not (category_changed or subcategory_changed):
+            continue
+
+        if category_changed:
+            for f in CURATOR_FIELDS:
+                if old_category is not None:
+                    setattr(category, f, old_category[f])
+            categories.append(category)
+        else:
+            category.id = category_id
+        if subcategory_changed:
+            for f in SUB_CURATOR_FIELDS:
+                if old_subcategory is not None:
+                    setattr(subcategory, f, old_subcategory[f])
+            subcategories.append(subcategory)
+        else:
+            subcategory.id = subcategory_id
+        products.append((row['id'], category, subcategory))
+
+    with transaction.atomic():
+        Category.objects.bulk_create(categories, batch_size=batch_size)
+        Subcategory.objects.bulk_create(subcategories, batch_size=batch_size)
+
+        # Unsaved instances carrying only the pk are enough for bulk_update, so the products are never loaded
+        Product.objects.bulk_update([Product(id=product_id, category=c, subcategory=s)
+                                     for product_id, c, s in products], ['category', 'subcategory'],
+                                    batch_size=batch_size)
+    return len(products)
+
+
+def delete_orphaned_categories(batch_size: int = 10000) -> (int, int):
+    """
+    Deletes Category and Subcategory rows that neither a Product nor a HistoricalProduct record points to, with
+    set-based DELETEs of batch_size rows at a time. Returns the number of (categories, subcategories) deleted.
+    """
+    references = [Product._meta.db_table, Product.history.model._meta.db_table]
+    deleted = []
+    for model, column in ((Category, 'category_id'), (Subcategory, 'subcategory_id')):
+        table = model._meta.db_table
+        unreferenced = ' AND '.join(f'NOT EXISTS (SELECT 1 FROM {reference} p WHERE p.{column} = c.id)'
+                                    for reference in references)
+        sql = f'DELETE FROM {table} WHERE id IN (SELECT c.id FROM {table} c WHERE {unreferenced} LIMIT %s)'
+        total = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [batch_size])
+                total += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+        deleted.append(total)
+    return deleted[0], deleted[1]
+
+
+def _copy_fields(model) -> [str]:
+    return [f.attname for f in model._meta.concrete_fields if f.name not in ('id', 'created', 'modified')]
+
+
+def assign_curated_categories(batch_size: int = 1000) -> (int, int):
+    """
+    Sets the manual category/subcategory of every most_recent=True product whose product code has a curated
+    CategoryProductCodeMappingSupport record. Follows the same rule as save_predictions(): Category and Subcategory
+    rows are never modified, so a product whose row doesn't already carry the curated values gets a copy of that row
+    with them set, and is repointed to the copy with a bulk update. Returns the number of (categories, subcategories)
+    created.
+    """
+    mappings = {m['product_code']: m for m in CategoryProductCodeMappingSupport.objects
+                .values('product_code', 'category', 'subcategory', 'verified_by_id')}
+    curated_products = Product.objects.filter(most_recent=True,
+                                              product_code__in=CategoryProductCodeMappingSupport.objects
+                                              .values('product_code'))
+
+    created = []
+    for model, fk, manual_field, mapping_field in ((Category, 'category', 'manual_category', 'category'),
+                                                   (Subcategory, 'subcategory', 'manual_subcategory', 'subcategory')):
+        products = list(curated_products.filter(**{f'{fk}__isnull': False})
+                        .values_list('id', 'product_code', f'{fk}_id'))
+        fields = _copy_fields(model)
+        current = _current_rows(model, [row_id for _, _, row_id in products], fields, batch_size * 10)
+
+        repointed = []
+        for product_id, product_code, row_id in products:
+            mapping = mappings[product_code]
+            if mapping[mapping_field] is None:
+                continue
+            old = current[row_id]
+            curated = {manual_field: mapping[mapping_field], 'verified': True,
+                       'verified_by_id': mapping['verified_by_id']}
+            if all(old[f] == value for f, value in curated.items()):
+                continue
+            row = model(**{f: old[f] for f in fields})
+            for f, value in curated.items():
+                setattr(row, f, value)
+            repointed.append((product_id, row))
+
+        with transaction.atomic():
+            model.objects.bulk_create([row for _, row in repointed], batch_size=batch_size)
+            Product.objects.bulk_update([Product(id=product_id, **{fk: row}) for product_id, row in repointed], [fk],
+                                        batch_size=batch_size)
+        created.append(len(repointed))
+    print(f'Applied curated categories with {created[0]} new categories and {created[1]} new subcategories')
+    return created[0], created[1]
@@ -1,87 +1,71 @@
-import pandas as pd
 from pathlib import Path
+from typing import Optional
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 
-from flaim.data_loaders.management.accessories import find_curated_category
-from flaim.database.models import Product, Category, Subcategory, ReferenceCategorySupport
+from flaim.classifiers.management.accessories import CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL, \
+    predict_categories, save_predictions, assign_curated_categories
 from flaim.classifiers.category_prediction import CategoryPredictor, SubcategoryPredictor
 from flaim.classifiers.category_preprocessing import FLAIME
+from flaim.classifiers.compiled import load_compiled
+from flaim.classifiers.jobs import enqueue_category_jobs, wait_for_jobs
 from flaim.database import models
-from tqdm import tqdm
-
-CATEGORY_PREDICTOR_MODEL = Path(__file__).parents[2] / 'data' / 'category_predictor.pkl'
-SUBCATEGORY_PREDICTOR_MODEL = Path(__file__).parents[2] / 'data' / 'subcategory_predictor.pkl'
 
 User = get_user_model()
 
 
 def assign_categories(category_predictor_model: Path = CATEGORY_PREDICTOR_MODEL,
                       subcategory_predictor_model: Path = SUBCATEGORY_PREDICTOR_MODEL,
-                      most_recent_bool: bool = True):
-    """ Makes predictions and then manual assignments on all most_recent=True products """
+                      most_recent_bool: bool = True,
+                      n_jobs: int = 1,
+                      compiled_models: Optional[Path] = None):
+    """
+    Makes predictions and then manual assignments on all most_recent=True products. n_jobs sets the number of worker
+    processes used for subcategory prediction. compiled_models optionally points to the output of compile_classifiers,
+    which is then used instead of the LightGBM boosters.
+    """
     predictor = CategoryPredictor(category_predictor_model)
     sub_predictor = SubcategoryPredictor(subcategory_predictor_model)
+    if compiled_models is not None:
+        load_compiled(predictor, sub_predictor, compiled_models)
+        print(f'Using compiled models from {compiled_models}')
 
     print(f'Detected category prediction model version {predictor.model_version}')
     print(f'Detected subcategory prediction model version {sub_predictor.model_version}')
 
     data = FLAIME(models.Product, models.NutritionFacts, most_recent_bool)
-    predictions = predictor.predict(data)
-
-    blank_product = pd.DataFrame.sparse.from_spmatrix(predictor.vectorizers['name'].transform(['']),
-                                                      columns=predictor.vectorizers['name'].get_feature_names(),
-                                                      index=[0])
-    unknown_p = predictor.model.predict(blank_product).max(axis=1)[0]
-    unknowns = predictions.loc[predictions['Conf 1'] == unknown_p, 'Pred 1'].index
-
-    predictions.loc[unknowns, 'Pred 1'] = pd.Series('Unknown', index=unknowns)
-    sub_predictions = sub_predictor.predict(data, predictions['Pred 1'])
-
-    df = pd.concat([data.product_ids, data.names, predictions, sub_predictions], axis=1)
+    df = predict_categories(data, predictor, sub_predictor, n_jobs)
     print(f"Found {len(df)} products to update")
-    for i, row in tqdm(df.iterrows(), desc="Predicting categories", total=len(df)):
-        if pd.isnull(row['name']):
-            continue
-        # Category prediction
-        predicted_category = Category.objects.create(predicted_category_1=row['Pred 1'],
-                                                     confidence_1=row['Conf 1'],
-                                                     predicted_category_2=row['Pred 2'],
-                                                     confidence_2=row['Conf 2'],
-                                                     predicted_category_3=row['Pred 3'],
-                                                     confidence_3=row['Conf 3'],
-                                                     model_version=predictor.model_version)
-        o = Product.objects.get(id=row['id'])
-        o.category = predicted_category
-
-        # Subcategory prediction
-        parent_category = ReferenceCategorySupport.objects.filter(category_name=row['Pred 1'],
-                                                                  subcategory_name=row['Sub-Category'])[0]
-        predicted_subcategory = Subcategory.objects.create(parent_category=parent_category,
-                                                           predicted_subcategory_1=row['Sub-Category'],
-                                                           confidence_1=row['Sub-Category Confidence'],
-                                                           model_version=sub_predictor.model_version)
-        o.subcategory = predicted_subcategory
-        o.save()
-
-    # Iterate through all most_recent=True products and set their manual category if it is already known
-    # in the database
-    for obj in tqdm(Product.objects.filter(most_recent=True), desc="Assigning known categories"):
-        curated_category, curated_subcategory, verified_by = find_curated_category(obj.product_code)
-        if curated_category is not None:
-            category = obj.category
-            category.manual_category = curated_category
-            category.verified = True
-            category.verified_by = verified_by
-            category.save()
-            obj.category = category
-        if curated_subcategory is not None:
-            subcategory = obj.subcategory
-            subcategory.manual_subcategory = curated_subcategory
-            subcategory.verified = True
-            subcategory.verified_by = verified_by
-            subcategory.save()
-        obj.save()
+    save_predictions(df, predictor.model_version, sub_predictor.model_version)
+
+    assign_curated_categories()
+
+
+def assign_categories_distributed(category_predictor_model: Path = CATEGORY_PREDICTOR_MODEL,
+                                  subcategory_predictor_model: Path = SUBCATEGORY_PREDICTOR_MODEL,
+                                  most_recent_bool: bool = True,
+                                  chunk_size: int = 5000,
+                                  queue_name: str = 'low',
+                                  timeout: Optional[int] = None) -> int:
+    """
+    Same as assign_categories(), but the products are split into chunks that are scored by RQ workers. Blocks until
+    every chunk is done (or for at most timeout seconds), then applies the manual assignments. Returns the number of
+    chunks that failed or didn't finish in time.
+    """
+    products = models.Product.objects.all()
+    if most_recent_bool:
+        products = products.filter(most_recent=True)
+    product_ids = list(products.order_by('id').values_list('id', flat=True))
+
+    jobs = enqueue_category_jobs(product_ids, chunk_size, queue_name, category_predictor_model,
+                                 subcategory_predictor_model)
+    print(f"Enqueued {len(jobs)} jobs for {len(product_ids)} products on the '{queue_name}' queue")
+    finished, failed = wait_for_jobs(jobs, timeout=timeout)
+    for job in failed:
+        print(f"Prediction job {job.id} failed")
+
+    assign_curated_categories()
+    return len(failed)
 
 
 class Command(BaseCommand):
@@ -93,6 +77,22 @@ class Command(BaseCommand):
         parser.add_argument('--all_products', action='store_true',
                             help='Call this flag in order to predict categories for ALL products in the database rather'
                                  ' than only those with most_recent=True.')
+        parser.add_argument('--n_jobs', type=int, default=1,
+                            help='Number of worker processes to spread subcategory prediction across. Use -1 to use '
+                                 'every available core.')
+        parser.add_argument('--compiled_models', type=str, default=None,
+                            help='Directory written by compile_classifiers. Predictions will run through the compiled '
+                                 'models instead of LightGBM.')
+        parser.add_argument('--distributed', action='store_true',
+                            help='Split the products into chunks and score them on RQ workers instead of in this '
+                                 'process. Workers should be started with '
+                                 '--worker-class flaim.classifiers.jobs.CategoryPredictionWorker')
+        parser.add_argument('--chunk_size', type=int, default=5000,
+                            help='Number of products per RQ job when using --distributed')
+        parser.add_argument('--queue', type=str, default='low',
+                            help='RQ queue to enqueue jobs on when using --distributed')
+        parser.add_argument('--timeout', type=int, default=None,
+                            help='Seconds to wait for the --distributed jobs before giving up on those not done')
 
     def handle(self, *args, **options):
         if options['all_products']:
@@ -102,4 +102,14 @@ class Command(BaseCommand):
             self.stdout.write(self.style.SUCCESS(f'Predicting categories for recent products in database'))
             most_recent_bool = True
 
-        assign_categories(CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL, most_recent_bool)
+        if options['distributed']:
+            failed = assign_categories_distributed(CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL,
+                                                   most_recent_bool, options['chunk_size'], options['queue'],
+                                                   options['timeout'])
+            if failed:
+                self.stdout.write(self.style.ERROR(f'{failed} prediction jobs failed; see the RQ dashboard'))
+                return
+        else:
+            compiled_models = Path(options['compiled_models']) if options['compiled_models'] is not None else None
+            assign_categories(CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL, most_recent_bool,
+                              options['n_jobs'], compiled_models)
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from flaim.classifiers.image_features import ImageFeatureStore, update_feature_store
+from flaim.database.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Computes resized pixels, colour histograms and perceptual hashes for every ProductImage not yet in the ' \
+           'image feature store and appends them to it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store', type=str, default=str(Path(settings.MEDIA_ROOT) / 'image_features'),
+                            help='Directory holding the feature store')
+        parser.add_argument('--n_workers', type=int, default=4,
+                            help='Number of worker processes. 0 computes features in this process.')
+        parser.add_argument('--batch_size', type=int, default=256,
+                            help='Number of images per worker batch; each finished batch is appended to the store')
+
+    def handle(self, *args, **options):
+        store = ImageFeatureStore(Path(options['store']))
+        images = [(image_id, str(Path(settings.MEDIA_ROOT) / image_path)) for image_id, image_path in
+                  ProductImage.objects.order_by('id').values_list('id', 'image_path')]
+        self.stdout.write(self.style.SUCCESS(f'{len(store)} of {len(images)} images already have features'))
+
+        # Forked workers must not inherit this process' database connections
+        connections.close_all()
+        added = update_feature_store(store, images, options['n_workers'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Done! Added features for {added} images to {store.path}'))
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from flaim.classifiers.image_classification import classify_fop_images
+
+CEREAL_CLASSIFIER = 'flaim.classifiers.image_classification.CerealClassifier'
+
+
+class Command(BaseCommand):
+    help = 'Classifies front-of-pack labels for every ProductImage that does not have a FrontOfPackLabel yet, using ' \
+           'a pool of worker processes that each load the classifier once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--classifier', type=str,
+                            default=getattr(settings, 'FOP_IMAGE_CLASSIFIER', CEREAL_CLASSIFIER),
+                            help='Dotted path to an ImageClassifier subclass. Defaults to '
+                                 'settings.FOP_IMAGE_CLASSIFIER, or to CerealClassifier if that is not set')
+        parser.add_argument('--n_workers', type=int, default=4,
+                            help='Number of worker processes. 0 classifies in this process.')
+        parser.add_argument('--batch_size', type=int, default=32,
+                            help='Number of images handed to a worker at a time')
+
+    def handle(self, *args, **options):
+        if options['classifier'] is None:
+            self.stdout.write(self.style.ERROR('No classifier configured: pass --classifier or set '
+                                               'FOP_IMAGE_CLASSIFIER'))
+            return
+
+        created = classify_fop_images(options['classifier'], options['n_workers'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Done! Created {created} front-of-pack labels'))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from flaim.classifiers.image_classification import classify_nutrition_labels
+
+
+class Command(BaseCommand):
+    help = 'Classifies every ProductImage without a NutritionLabelClassification as a nutrition facts table, ' \
+           'ingredients list or other image, using a pool of worker processes that each load the classifier once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--classifier', type=str, default=getattr(settings, 'NUTRITION_LABEL_CLASSIFIER', None),
+                            help='Dotted path to an ImageClassifier subclass. Defaults to '
+                                 'settings.NUTRITION_LABEL_CLASSIFIER')
+        parser.add_argument('--n_workers', type=int, default=4,
+                            help='Number of worker processes. 0 classifies in this process.')
+        parser.add_argument('--batch_size', type=int, default=32,
+                            help='Number of images handed to a worker at a time')
+
+    def handle(self, *args, **options):
+        if options['classifier'] is None:
+            self.stdout.write(self.style.ERROR('No classifier configured: pass --classifier or set '
+                                               'NUTRITION_LABEL_CLASSIFIER'))
+            return
+
+        created = classify_nutrition_labels(options['classifier'], options['n_workers'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Done! Created {created} nutrition label classifications'))
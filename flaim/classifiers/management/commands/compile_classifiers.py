@@ -0,0 +1,43 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from flaim.classifiers.category_prediction import CategoryPredictor, SubcategoryPredictor
+from flaim.classifiers.category_preprocessing import FLAIME
+from flaim.classifiers.compiled import compile_predictors, load_compiled, benchmark
+from flaim.classifiers.management.accessories import CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL
+from flaim.database import models
+
+COMPILED_MODELS_DIR = CATEGORY_PREDICTOR_MODEL.parent / 'compiled'
+
+
+class Command(BaseCommand):
+    help = 'Compiles the category and subcategory LightGBM models into shared libraries with treelite for faster ' \
+           'bulk prediction. Optionally benchmarks the compiled models against LightGBM on the most recent products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--outdir', type=str, default=str(COMPILED_MODELS_DIR),
+                            help='Directory to write the compiled libraries and manifest to')
+        parser.add_argument('--toolchain', type=str, default='gcc',
+                            help='C compiler treelite should use, e.g. gcc or clang')
+        parser.add_argument('--benchmark', action='store_true',
+                            help='Compare names/sec of the compiled models against LightGBM on most_recent products')
+
+    def handle(self, *args, **options):
+        outdir = Path(options['outdir'])
+        predictor = CategoryPredictor(CATEGORY_PREDICTOR_MODEL)
+        sub_predictor = SubcategoryPredictor(SUBCATEGORY_PREDICTOR_MODEL)
+
+        self.stdout.write(self.style.SUCCESS(f'Compiling category model version {predictor.model_version} and '
+                                             f'subcategory model version {sub_predictor.model_version}'))
+        manifest = compile_predictors(predictor, sub_predictor, outdir, toolchain=options['toolchain'])
+        self.stdout.write(self.style.SUCCESS(f'Done! Compiled models are listed in {manifest}'))
+
+        if options['benchmark']:
+            compiled_predictor = CategoryPredictor(CATEGORY_PREDICTOR_MODEL)
+            compiled_sub_predictor = SubcategoryPredictor(SUBCATEGORY_PREDICTOR_MODEL)
+            load_compiled(compiled_predictor, compiled_sub_predictor, outdir)
+
+            data = FLAIME(models.Product, models.NutritionFacts)
+            results = benchmark(predictor, sub_predictor, compiled_predictor, compiled_sub_predictor, data)
+            self.stdout.write(results.to_string(index=False))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from flaim.classifiers.management.accessories import delete_orphaned_categories
+
+
+class Command(BaseCommand):
+    help = 'Deletes Category and Subcategory rows that are no longer referenced by any Product or historical ' \
+           'Product record.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch_size', type=int, default=10000,
+                            help='Number of rows deleted per transaction')
+
+    def handle(self, *args, **options):
+        categories, subcategories = delete_orphaned_categories(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Done! Deleted {categories} orphaned categories and {subcategories} '
+                                             f'orphaned subcategories'))
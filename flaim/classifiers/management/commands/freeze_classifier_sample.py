@@ -0,0 +1,49 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from flaim.classifiers.category_prediction import CategoryPredictor, SubcategoryPredictor
+from flaim.classifiers.category_preprocessing import CuratedFLAIME, DataStore, sample_datastore
+from flaim.classifiers.evaluation import CLASSIFIER_SAMPLE, CLASSIFIER_BASELINE, evaluate, write_baseline
+from flaim.classifiers.management.accessories import CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL
+from flaim.database import models
+
+
+class Command(BaseCommand):
+    help = 'Writes a fixed, labelled sample of curator-verified products (names, ingredients and nutrition facts) ' \
+           'for the classifier regression tests in flaim/classifiers/tests, then records their baseline by running ' \
+           'the current category models on it. Only rerun this when the sample or the models should deliberately ' \
+           'change; use --baseline_only to re-record the baseline for new models on the existing sample.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per_category', type=int, default=100,
+                            help='Maximum number of products sampled from each category')
+        parser.add_argument('--out', type=str, default=str(CLASSIFIER_SAMPLE),
+                            help='Path to write the sample to')
+        parser.add_argument('--baseline', type=str, default=str(CLASSIFIER_BASELINE),
+                            help='Path to write the baseline metrics to')
+        parser.add_argument('--baseline_only', action='store_true', default=False,
+                            help='Keep the existing sample and only record a new baseline')
+
+    def handle(self, *args, **options):
+        for path in (CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL):
+            if not path.exists():
+                raise CommandError(f'{path} is missing; train the models with `python manage.py train_classifiers`')
+
+        if options['baseline_only']:
+            sample = DataStore.from_npz(options['out'])
+        else:
+            curated = CuratedFLAIME(models.Product, models.NutritionFacts, models.CategoryProductCodeMappingSupport)
+            sample = sample_datastore(curated, options['per_category'])
+            Path(options['out']).parent.mkdir(parents=True, exist_ok=True)
+            sample.to_npz(options['out'])
+            self.stdout.write(self.style.SUCCESS(f'Wrote {len(sample.names)} products across '
+                                                 f'{sample.target.nunique()} categories to {options["out"]}'))
+
+        metrics = evaluate(CategoryPredictor(CATEGORY_PREDICTOR_MODEL),
+                           SubcategoryPredictor(SUBCATEGORY_PREDICTOR_MODEL), sample)
+        write_baseline(metrics, options['baseline'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Recorded baseline for model versions {metrics['model_version']}/{metrics['sub_model_version']} to "
+            f"{options['baseline']}: top-1 {metrics['top1_accuracy']:.4f}, top-3 {metrics['top3_accuracy']:.4f}, "
+            f"subcategory {metrics['subcategory_accuracy']:.4f}, {metrics['names_per_sec']:.0f} names/sec"))
@@ -0,0 +1,108 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from flaim.classifiers.category_prediction import CategoryPredictor, SubcategoryPredictor
+from flaim.classifiers.category_preprocessing import DataStore, CuratedFLAIME, split_datastore, concat_datastores, \
+    subset_datastore
+from flaim.classifiers.management.accessories import CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL
+from flaim.database import models
+
+
+def warm_start_category_model(model_version: str,
+                              category_predictor_model: Path = CATEGORY_PREDICTOR_MODEL,
+                              subcategory_predictor_model: Path = SUBCATEGORY_PREDICTOR_MODEL,
+                              corpus_path: Optional[Path] = None,
+                              held_out: float = 0.2,
+                              num_boost_round: int = 100,
+                              min_improvement: float = 0.0) -> (float, float, bool):
+    """
+    Continues boosting the current category model on the curator-verified products and promotes the result under
+    model_version only if it beats the current model on held-out products.
+
+    Held-out products are drawn only from curated products the current model hasn't been trained on (models record
+    the curated product codes they were trained on in their metadata), so neither model has seen them. Curated
+    products the current model has already seen are all used for training. If corpus_path points to a training
+    corpus written by train_classifiers, the same fraction of it is added to the held-out set so the new model can't
+    win by forgetting the original training data; the current model has seen those rows, so they only make promotion
+    harder. If that leaves nothing to evaluate on, a CommandError is raised before any training and nothing is
+    promoted.
+
+    The subcategory model isn't retrained, but is stamped with model_version alongside the category model so the two
+    artifacts always carry the same version.
+
+    Returns (current accuracy, retrained accuracy, whether the retrained model was promoted).
+    """
+    current = CategoryPredictor(category_predictor_model)
+    curated = CuratedFLAIME(models.Product, models.NutritionFacts, models.CategoryProductCodeMappingSupport)
+    if 'curated_product_codes' not in current.metadata:
+        print(f'Model version {current.model_version} does not record its curated training products; held-out '
+              f'products may include some it was trained on')
+    seen = curated.product_codes.isin(current.metadata.get('curated_product_codes', [])).to_numpy()
+    unseen_train, curated_test = split_datastore(subset_datastore(curated, np.flatnonzero(~seen)), held_out)
+    curated_train = concat_datastores([subset_datastore(curated, np.flatnonzero(seen)), unseen_train])
+
+    evaluation_stores = [curated_test]
+    if corpus_path is not None:
+        evaluation_stores.append(split_datastore(DataStore.from_npz(corpus_path), held_out)[1])
+    evaluation = concat_datastores(evaluation_stores)
+    if len(evaluation.names) == 0:
+        reason = 'no corpus was given' if corpus_path is None else f'no corpus rows were held out from {corpus_path}'
+        raise CommandError(f'No held-out products to evaluate on: every curated product has already been seen by model '
+                           f'version {current.model_version} and {reason}. Pass a corpus with --corpus, or retrain '
+                           f'once more products have been curated.')
+
+    retrained = CategoryPredictor(category_predictor_model)
+    n_rows = retrained.update(curated_train, num_boost_round)
+    print(f'Continued training model version {current.model_version} on {n_rows} curated products')
+
+    current_accuracy = current.accuracy(evaluation)
+    retrained_accuracy = retrained.accuracy(evaluation)
+    print(f'Held-out accuracy on {len(evaluation.names)} products ({len(curated_test.names)} unseen curated): '
+          f'current {current_accuracy:.4f}, retrained {retrained_accuracy:.4f}')
+
+    promote = n_rows > 0 and retrained_accuracy > current_accuracy + min_improvement
+    if promote:
+        sub_predictor = SubcategoryPredictor(subcategory_predictor_model)
+        # Both artifacts are fully written before either replaces the current one
+        tmp_paths = [f'{category_predictor_model}.tmp', f'{subcategory_predictor_model}.tmp']
+        retrained.dump_model(tmp_paths[0], model_version)
+        sub_predictor.dump_model(tmp_paths[1], model_version)
+        os.replace(tmp_paths[0], category_predictor_model)
+        os.replace(tmp_paths[1], subcategory_predictor_model)
+    return current_accuracy, retrained_accuracy, promote
+
+
+class Command(BaseCommand):
+    help = 'Continues training the category prediction model on curator-verified products instead of retraining ' \
+           'from scratch. The retrained model only replaces the current one if it scores better on held-out products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model_version', type=str, required=True,
+                            help='Version string stored with the retrained model if it is promoted, e.g. 2.1')
+        parser.add_argument('--corpus', type=str, default=None,
+                            help='Training corpus .npz written by train_classifiers. Part of it is added to the '
+                                 'held-out set.')
+        parser.add_argument('--held_out', type=float, default=0.2,
+                            help='Fraction of products held out for evaluation')
+        parser.add_argument('--num_boost_round', type=int, default=100,
+                            help='Number of boosting rounds added to the current model')
+        parser.add_argument('--min_improvement', type=float, default=0.0,
+                            help='Held-out accuracy gain required before the retrained model is promoted')
+
+    def handle(self, *args, **options):
+        corpus_path = Path(options['corpus']) if options['corpus'] is not None else None
+        current_accuracy, retrained_accuracy, promoted = warm_start_category_model(
+            options['model_version'], CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL, corpus_path,
+            options['held_out'], options['num_boost_round'], options['min_improvement'])
+
+        if promoted:
+            self.stdout.write(self.style.SUCCESS(f'Promoted category model version {options["model_version"]} '
+                                                 f'({current_accuracy:.4f} -> {retrained_accuracy:.4f}); the '
+                                                 f'subcategory model was stamped with the same version'))
+        else:
+            self.stdout.write(self.style.WARNING('Retrained model did not beat the current model; keeping the '
+                                                 'current model'))
@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from django.core.management.base import BaseCommand
+
+from flaim.classifiers.category_prediction import CategoryPredictor, SubcategoryPredictor, FEATURE_MODES
+from flaim.classifiers.category_preprocessing import DataStore, CuratedFLAIME, load_flip, concat_datastores
+from flaim.classifiers.management.accessories import CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL
+from flaim.database import models
+
+CORPUS_CACHE_DIR = CATEGORY_PREDICTOR_MODEL.parent / 'cache'
+
+
+def build_training_corpus(flip_path: Optional[Path], cache_dir: Path = CORPUS_CACHE_DIR,
+                          include_curated: bool = True) -> DataStore:
+    """
+    Combines the (cached) FLIP workbook with the curator-verified FLAIME products into a single labelled corpus
+    """
+    stores = []
+    if flip_path is not None:
+        stores.append(load_flip(flip_path, cache_dir))
+    if include_curated:
+        stores.append(CuratedFLAIME(models.Product, models.NutritionFacts, models.CategoryProductCodeMappingSupport))
+    return concat_datastores(stores)
+
+
+def _train_and_dump(predictor_class, corpus_path: str, model_path: str, model_version: str, features: str) -> str:
+    """ Trains one predictor on the corpus file and swaps the new model into place once it is fully written """
+    predictor = predictor_class(features=features)
+    predictor.train(DataStore.from_npz(corpus_path))
+
+    tmp_path = f'{model_path}.tmp'
+    predictor.dump_model(tmp_path, model_version)
+    os.replace(tmp_path, model_path)
+    return model_path
+
+
+def train_classifiers(flip_path: Optional[Path], model_version: str,
+                      category_predictor_model: Path = CATEGORY_PREDICTOR_MODEL,
+                      subcategory_predictor_model: Path = SUBCATEGORY_PREDICTOR_MODEL,
+                      cache_dir: Path = CORPUS_CACHE_DIR,
+                      include_curated: bool = True,
+                      features: str = 'count') -> Path:
+    """
+    Builds the training corpus, writes it to cache_dir and trains the category and subcategory predictors on it in
+    two parallel processes using the given feature mode ('count' or 'hashing'). Returns the path to the corpus file.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    corpus = build_training_corpus(flip_path, cache_dir, include_curated)
+    print(f'Built training corpus with {len(corpus.names)} products across {corpus.target.nunique()} categories')
+    corpus_path = cache_dir / f'training_corpus_{model_version}.npz'
+    corpus.to_npz(corpus_path)
+
+    # Workers are forked before any LightGBM code has run in this process
+    mp_context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=2, mp_context=mp_context) as executor:
+        futures = [
+            executor.submit(_train_and_dump, CategoryPredictor, str(corpus_path), str(category_predictor_model),
+                            model_version, features),
+            executor.submit(_train_and_dump, SubcategoryPredictor, str(corpus_path), str(subcategory_predictor_model),
+                            model_version, features),
+        ]
+        for future in futures:
+            print(f'Wrote {future.result()}')
+    return corpus_path
+
+
+class Command(BaseCommand):
+    help = 'Trains the category and subcategory prediction models from the FLIP workbook and curator-verified ' \
+           'FLAIME products, and writes them to the paths used by assign_categories.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model_version', type=str, required=True,
+                            help='Version string stored with the models, e.g. 2.0')
+        parser.add_argument('--flip', type=str, default=None,
+                            help='Path to the FLIP Excel workbook. The parsed workbook is cached, so it is only read '
+                                 'again when the file changes.')
+        parser.add_argument('--no_curated', action='store_true',
+                            help='Leave the curator-verified FLAIME products out of the training corpus')
+        parser.add_argument('--features', type=str, default='count', choices=list(FEATURE_MODES),
+                            help="Name features to train on. 'hashing' uses a fixed-size hashed feature space "
+                                 "instead of a fitted vocabulary, so prediction memory doesn't grow with the corpus.")
+        parser.add_argument('--cache_dir', type=str, default=str(CORPUS_CACHE_DIR),
+                            help='Directory for the cached FLIP workbook and training corpus files')
+
+    def handle(self, *args, **options):
+        flip_path = Path(options['flip']) if options['flip'] is not None else None
+        if flip_path is None and options['no_curated']:
+            self.stdout.write(self.style.ERROR('Nothing to train on: provide --flip and/or drop --no_curated'))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f'Training category models version {options["model_version"]}'))
+        corpus_path = train_classifiers(flip_path, options['model_version'], cache_dir=Path(options['cache_dir']),
+                                        include_curated=not options['no_curated'], features=options['features'])
+        self.stdout.write(self.style.SUCCESS(f'Done! Training corpus is available at {corpus_path}'))
@@ -0,0 +1,177 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import django_rq
+import pandas as pd
+from django.conf import settings
+from rq.job import Job, JobStatus
+
+from flaim.classifiers.category_prediction import CategoryPredictor, SubcategoryPredictor
+from flaim.classifiers.category_preprocessing import Names
+from flaim.classifiers.management.accessories import CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL, \
+    predict_categories
+
+"""
+Long-lived category prediction service. The models are unpickled once per process and kept in memory, so callers such
+as the product curator or the API only pay for the prediction itself:
+
+>from flaim.classifiers.service import predict_names
+>predict_names(['Honey Nut Cheerios', 'Old Cheddar Cheese'])
+
+Web processes that shouldn't hold the models in memory can use predict_names_remote() instead, which hands the names to
+an RQ worker started with flaim.classifiers.jobs.CategoryPredictionWorker on the CATEGORY_PREDICTION_QUEUE queue.
+The model files default to the CATEGORY_PREDICTOR_MODEL and SUBCATEGORY_PREDICTOR_MODEL settings.
+"""
+
+PREDICTION_COLUMNS = ['name', 'Pred 1', 'Conf 1', 'Pred 2', 'Conf 2', 'Pred 3', 'Conf 3', 'Sub-Category',
+                      'Sub-Category Confidence']
+PREDICTION_QUEUE = getattr(settings, 'CATEGORY_PREDICTION_QUEUE', 'high')
+
+# Jobs in any other state (finished, failed, stopped, canceled or expired from Redis) won't change state again
+PENDING_STATUSES = {JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED, getattr(JobStatus, 'SCHEDULED', None)}
+
+# (category model path, subcategory model path) -> (CategoryPredictor, SubcategoryPredictor)
+_predictors = {}
+_predictors_lock = threading.Lock()
+
+
+def get_predictors(category_predictor_model: Path = CATEGORY_PREDICTOR_MODEL,
+                   subcategory_predictor_model: Path = SUBCATEGORY_PREDICTOR_MODEL) -> tuple:
+    """ Returns the predictors for the given model files, loading them on first use only """
+    key = (str(category_predictor_model), str(subcategory_predictor_model))
+    with _predictors_lock:
+        if key not in _predictors:
+            _predictors[key] = (CategoryPredictor(category_predictor_model),
+                                SubcategoryPredictor(subcategory_predictor_model))
+    return _predictors[key]
+
+
+class PredictionService:
+    """
+    Serves category predictions for lists of product names. Concurrent callers are micro-batched: requests that arrive
+    within max_wait seconds of each other (up to max_batch_size names) are scored with a single model call by a
+    background thread, which is also the only thread that touches the models.
+    """
+
+    def __init__(self, category_predictor_model: Path = CATEGORY_PREDICTOR_MODEL,
+                 subcategory_predictor_model: Path = SUBCATEGORY_PREDICTOR_MODEL,
+                 max_batch_size: int = 512, max_wait: float = 0.005):
+        self.category_predictor_model = category_predictor_model
+        self.subcategory_predictor_model = subcategory_predictor_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._requests = queue.Queue()
+        self._batcher = None
+        self._batcher_lock = threading.Lock()
+
+    def predict_names(self, names: [str]) -> pd.DataFrame:
+        """
+        Returns one row per name, in the same order as names, with the columns listed in PREDICTION_COLUMNS
+        """
+        names = list(names)
+        if not names:
+            return self.predict(names)
+
+        future = Future()
+        self._requests.put((names, future))
+        self._start_batcher()
+        return future.result()
+
+    def predict(self, names: [str]) -> pd.DataFrame:
+        """ Scores names immediately in the calling thread, without batching """
+        if not names:
+            return pd.DataFrame(columns=PREDICTION_COLUMNS)
+        predictor, sub_predictor = get_predictors(self.category_predictor_model, self.subcategory_predictor_model)
+        return predict_categories(Names(names), predictor, sub_predictor)
+
+    def _start_batcher(self):
+        with self._batcher_lock:
+            if self._batcher is None or not self._batcher.is_alive():
+                self._batcher = threading.Thread(target=self._run_batcher, name='category-prediction-batcher',
+                                                 daemon=True)
+                self._batcher.start()
+
+    def _run_batcher(self):
+        while True:
+            batch = [self._requests.get()]
+            batch_size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while batch_size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                batch_size += len(request[0])
+            self._process_batch(batch)
+
+    def _process_batch(self, batch: [tuple]):
+        try:
+            results = self.predict([name for names, future in batch for name in names])
+        except Exception as e:
+            for names, future in batch:
+                future.set_exception(e)
+            return
+
+        start = 0
+        for names, future in batch:
+            future.set_result(results.iloc[start:start + len(names)].reset_index(drop=True))
+            start += len(names)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_prediction_service() -> PredictionService:
+    """ Returns the process-wide PredictionService, creating it on first use """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = PredictionService()
+    return _service
+
+
+def predict_names(names: [str]) -> pd.DataFrame:
+    """ Predicts categories and subcategories for names with the process-wide PredictionService """
+    return get_prediction_service().predict_names(names)
+
+
+def dependency_failed(job: Job) -> bool:
+    """ True if a deferred job's dependency ended without finishing, so the job will never be queued """
+    dependency = job.dependency
+    if dependency is None:
+        return False
+    status = dependency.get_status()
+    return status not in PENDING_STATUSES and status != JobStatus.FINISHED
+
+
+def predict_names_remote(names: [str], queue_name: str = PREDICTION_QUEUE, timeout: float = 30,
+                         poll_interval: float = 0.02) -> pd.DataFrame:
+    """
+    Same as predict_names(), but the prediction runs on an RQ worker that already has the models loaded. Raises a
+    RuntimeError as soon as the job ends without finishing (failed, stopped, canceled, expired, or deferred on a
+    dependency that failed).
+    """
+    names = list(names)
+    if not names:
+        return pd.DataFrame(columns=PREDICTION_COLUMNS)
+
+    job = django_rq.get_queue(queue_name).enqueue('flaim.classifiers.jobs.predict_names_job', names, result_ttl=60)
+    deadline = time.monotonic() + timeout
+    while True:
+        status = job.get_status()
+        if status == JobStatus.FINISHED:
+            return pd.DataFrame(job.result, columns=PREDICTION_COLUMNS)
+        if status not in PENDING_STATUSES or (status == JobStatus.DEFERRED and dependency_failed(job)):
+            raise RuntimeError(f'Category prediction job {job.id} ended without finishing (status {status})')
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'Category prediction job {job.id} did not finish within {timeout} seconds')
+        time.sleep(poll_interval)
@@ -0,0 +1,74 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, SimpleTestCase, override_settings
+
+from flaim.classifiers.image_classification import ImageClassifier, CerealClassifier, StubImageClassifier, \
+    classify_fop_images, classify_nutrition_labels
+from flaim.database import models
+
+STUB_CLASSIFIER = 'flaim.classifiers.image_classification.StubImageClassifier'
+FLAKY_CLASSIFIER = 'flaim.classifiers.tests.test_image_classification.FlakyImageClassifier'
+
+
+class FlakyImageClassifier(StubImageClassifier):
+    """ Fails on image_1, like a corrupt image would """
+
+    def classify(self, image_paths):
+        if any(path.name == 'image_1.jpg' for path in image_paths):
+            raise ValueError('cannot identify image file')
+        return super().classify(image_paths)
+
+
+class ClassifyFOPImagesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        product = models.Product.objects.create(product_code="EA_000000", name="Test Product Name", store="LOBLAWS")
+        for i in range(3):
+            models.ProductImage.objects.create(product=product, image_path=f"LOBLAWS/20200101/image_{i}.jpg",
+                                               image_number=i)
+
+    def test_labels_created(self):
+        created = classify_fop_images(STUB_CLASSIFIER, n_workers=0, batch_size=2)
+        self.assertEqual(created, 3)
+        self.assertEqual(models.FrontOfPackLabel.objects.filter(label_detected=False).count(), 3)
+        label = models.FrontOfPackLabel.objects.get(product_image__image_number=0)
+        self.assertEqual(label.classified_image_path.name, "LOBLAWS/20200101/image_0.jpg")
+
+    def test_failed_images_dont_fail_their_batch(self):
+        self.assertEqual(classify_fop_images(FLAKY_CLASSIFIER, n_workers=0, batch_size=3), 2)
+        self.assertEqual(set(models.FrontOfPackLabel.objects.values_list('product_image__image_number', flat=True)),
+                         {0, 2})
+        # Retried, and failed again, on the next run
+        self.assertEqual(classify_fop_images(FLAKY_CLASSIFIER, n_workers=0), 0)
+
+    def test_classified_images_skipped(self):
+        classify_fop_images(STUB_CLASSIFIER, n_workers=0)
+        self.assertEqual(classify_fop_images(STUB_CLASSIFIER, n_workers=0), 0)
+        self.assertEqual(models.FrontOfPackLabel.objects.count(), 3)
+
+
+class ClassifyNutritionLabelsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        product = models.Product.objects.create(product_code="EA_000000", name="Test Product Name", store="LOBLAWS")
+        for i in range(3):
+            models.ProductImage.objects.create(product=product, image_path=f"LOBLAWS/20200101/image_{i}.jpg",
+                                               image_number=i)
+
+    def test_classifications_created_once(self):
+        self.assertEqual(classify_nutrition_labels(STUB_CLASSIFIER, n_workers=0, batch_size=2), 3)
+        self.assertEqual(classify_nutrition_labels(STUB_CLASSIFIER, n_workers=0), 0)
+        self.assertEqual(models.NutritionLabelClassification.objects.filter(classification='O').count(), 3)
+
+
+class ImageClassifierTest(SimpleTestCase):
+
+    def test_classify_is_abstract(self):
+        with self.assertRaises(TypeError):
+            ImageClassifier()
+
+    @override_settings(CEREAL_CLASSIFIER_DIR=None, CEREAL_CLASSIFIER_LOADER=None)
+    def test_cereal_classifier_needs_settings(self):
+        with self.assertRaises(ImproperlyConfigured):
+            CerealClassifier()
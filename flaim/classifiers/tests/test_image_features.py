@@ -0,0 +1,35 @@
+import numpy as np
+from PIL import Image
+
+from flaim.classifiers.image_features import ImageFeatureStore, update_feature_store, FEATURE_DTYPE, THUMBNAIL_SIZE
+
+
+def write_image(path, colour):
+    Image.new('RGB', (64, 48), colour).save(path)
+    return str(path)
+
+
+def test_features_appended_incrementally(tmp_path):
+    images = [(i, write_image(tmp_path / f'image_{i}.jpg', colour)) for i, colour in
+              [(3, (255, 0, 0)), (1, (0, 255, 0)), (2, (0, 0, 255))]]
+    store = ImageFeatureStore(tmp_path / 'store')
+
+    assert update_feature_store(store, images[:2], n_workers=0) == 2
+    assert update_feature_store(store, images, n_workers=0) == 1
+    assert len(ImageFeatureStore(tmp_path / 'store')) == 3
+
+    records = store.get([2, 3])
+    assert records.dtype == FEATURE_DTYPE
+    assert records['image_id'].tolist() == [2, 3]
+    assert records['pixels'].shape == (2, THUMBNAIL_SIZE, THUMBNAIL_SIZE, 3)
+    assert np.allclose(records['histogram'].reshape(2, 3, -1).sum(axis=2), 1)
+    assert isinstance(store.field('pixels'), np.memmap)
+
+
+def test_missing_and_unreadable_images(tmp_path):
+    (tmp_path / 'broken.jpg').write_bytes(b'not an image')
+    store = ImageFeatureStore(tmp_path / 'store')
+
+    assert update_feature_store(store, [(1, str(tmp_path / 'broken.jpg'))], n_workers=0) == 0
+    assert 1 not in store
+    assert store.contains([1, 2]).tolist() == [False, False]
@@ -0,0 +1,83 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from flaim.classifiers.category_prediction import CategoryPredictor, SubcategoryPredictor
+from flaim.classifiers.category_preprocessing import DataStore
+from flaim.classifiers.evaluation import CLASSIFIER_SAMPLE, CLASSIFIER_BASELINE, evaluate
+from flaim.classifiers.management.accessories import CATEGORY_PREDICTOR_MODEL, SUBCATEGORY_PREDICTOR_MODEL
+
+"""
+Accuracy and throughput regression tests for the category models, run against the frozen sample of curator-verified
+products in tests/data and compared against the baseline.json recorded by running the models on it. Both are written
+by
+
+>python manage.py freeze_classifier_sample
+
+against the production database with the deployed models; after an intended change to the models, re-record the
+baseline with `--baseline_only`.
+
+The models aren't part of the repository, so the tests are skipped when the models, the sample or the baseline are
+missing, and only fail when the models score below the baseline. Tolerances can be loosened on noisy machines with
+MAX_ACCURACY_DROP, MAX_RECALL_DROP and MAX_THROUGHPUT_DROP.
+"""
+
+MAX_ACCURACY_DROP = float(os.environ.get('MAX_ACCURACY_DROP', 0.01))
+MAX_RECALL_DROP = float(os.environ.get('MAX_RECALL_DROP', 0.05))
+MAX_THROUGHPUT_DROP = float(os.environ.get('MAX_THROUGHPUT_DROP', 0.25))
+# Per-category recall is too noisy to compare for categories with only a handful of sampled products
+MIN_CATEGORY_SUPPORT = 20
+
+pytestmark = [
+    pytest.mark.skipif(not (CATEGORY_PREDICTOR_MODEL.exists() and SUBCATEGORY_PREDICTOR_MODEL.exists()),
+                       reason='Category models not found; train them with `python manage.py train_classifiers`'),
+    pytest.mark.skipif(not (CLASSIFIER_SAMPLE.exists() and CLASSIFIER_BASELINE.exists()),
+                       reason='No frozen sample and baseline; write them with '
+                              '`python manage.py freeze_classifier_sample`'),
+]
+
+
+@pytest.fixture(scope='module')
+def metrics() -> dict:
+    results = evaluate(CategoryPredictor(CATEGORY_PREDICTOR_MODEL), SubcategoryPredictor(SUBCATEGORY_PREDICTOR_MODEL),
+                       DataStore.from_npz(CLASSIFIER_SAMPLE))
+
+    print(f"\nModel versions {results['model_version']}/{results['sub_model_version']}: "
+          f"top-1 {results['top1_accuracy']:.4f}, top-3 {results['top3_accuracy']:.4f}, "
+          f"subcategory {results['subcategory_accuracy']:.4f}, {results['names_per_sec']:.0f} names/sec, "
+          f"peak {results['peak_memory_mb']:.1f} MB")
+    for category, recall in sorted(results['category_recall'].items()):
+        print(f"  {category}: recall {recall:.4f} (n={results['category_support'][category]})")
+    return results
+
+
+@pytest.fixture(scope='module')
+def baseline() -> dict:
+    with open(CLASSIFIER_BASELINE) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('metric', ['top1_accuracy', 'top3_accuracy', 'subcategory_accuracy'])
+def test_accuracy(metrics, baseline, metric):
+    assert metrics[metric] >= baseline[metric] - MAX_ACCURACY_DROP, \
+        f'{metric} dropped from {baseline[metric]:.4f} to {metrics[metric]:.4f}'
+
+
+def test_category_recall(metrics, baseline):
+    regressions = {category: (recall, metrics['category_recall'].get(category, 0.0))
+                   for category, recall in baseline['category_recall'].items()
+                   if baseline['category_support'][category] >= MIN_CATEGORY_SUPPORT
+                   and metrics['category_recall'].get(category, 0.0) < recall - MAX_RECALL_DROP}
+    assert not regressions, f'Recall dropped for {regressions}'
+
+
+def test_throughput(metrics, baseline):
+    assert metrics['names_per_sec'] >= baseline['names_per_sec'] * (1 - MAX_THROUGHPUT_DROP), \
+        f"Throughput dropped from {baseline['names_per_sec']:.0f} to {metrics['names_per_sec']:.0f} names/sec"
+
+
+def test_predictions_are_well_formed(metrics):
+    assert 0.0 <= metrics['top1_accuracy'] <= metrics['top3_accuracy'] <= 1.0
+    assert np.isfinite(metrics['names_per_sec']) and metrics['names_per_sec'] > 0
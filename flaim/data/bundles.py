@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import django_rq
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from flaim.reports.datasets import dataset_sql, write_parquet, export_dataset, EXCLUDED_COLUMNS
+from flaim.reports.exports import write_product_report
+
+"""
+Versioned download bundles for the data download page. After each load the load command queues a background job
+(schedule_download_bundle) that writes a new bundle directory under DOWNLOAD_BUNDLE_DIR holding:
+
+- the most recent products as gzipped CSV (the export_product_report format)
+- the most recent products as Parquet
+- the full history as a tar of the partitioned Parquet dataset written by export_dataset, which is kept up to date
+  in DOWNLOAD_BUNDLE_DIR/dataset so only new scrape batches are exported each time
+
+along with a manifest.json and SHA256SUMS. Bundles are written under a temporary name and renamed into place when
+complete. Downloads never touch the database, but they do hold the full product history, so DOWNLOAD_BUNDLE_DIR is
+kept out of the publicly served MEDIA_ROOT and the files are only streamed to logged in users by BundleFileView.
+"""
+
+MANIFEST = 'manifest.json'
+CHECKSUMS = 'SHA256SUMS'
+KEEP_BUNDLES = getattr(settings, 'DOWNLOAD_BUNDLE_KEEP', 3)
+BUNDLE_PENDING_KEY = 'data:bundle_pending'
+
+
+def bundle_dir() -> Path:
+    """ DOWNLOAD_BUNDLE_DIR, which has to be outside MEDIA_ROOT: the web server serves MEDIA_ROOT to anyone """
+    path = Path(getattr(settings, 'DOWNLOAD_BUNDLE_DIR', Path(tempfile.gettempdir()) / 'flaim_downloads')).resolve()
+    media_root = Path(settings.MEDIA_ROOT).resolve()
+    if path == media_root or media_root in path.parents:
+        raise ImproperlyConfigured(f'DOWNLOAD_BUNDLE_DIR ({path}) must not be inside MEDIA_ROOT ({media_root})')
+    return path
+
+
+def sha256sum(path: Path, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _bundle_versions() -> [str]:
+    """ Published bundle versions, newest first. Versions are timestamps, so they sort by name. """
+    root = bundle_dir()
+    if not root.exists():
+        return []
+    return sorted((p.name for p in root.iterdir()
+                   if p.is_dir() and not p.name.startswith('.') and (p / MANIFEST).exists()), reverse=True)
+
+
+def build_download_bundle(chunk_size: int = 10000) -> Path:
+    """ Writes a new bundle, publishes it and removes all but the KEEP_BUNDLES newest. Returns the bundle directory. """
+    root = bundle_dir()
+    # Microseconds keep builds finishing within the same second from colliding on os.replace
+    version = timezone.now().strftime('%Y%m%d-%H%M%S-%f')
+    tmp_dir = root / f'.{version}.tmp'
+    tmp_dir.mkdir(parents=True)
+
+    try:
+        files = []
+        name = f'flaime_products_{version}.csv.gz'
+        count = write_product_report(tmp_dir / name, compress=True, chunk_size=chunk_size)
+        files.append({'name': name, 'rows': count, 'description': 'Most recent products with nutrition facts (CSV)'})
+
+        name = f'flaime_products_{version}.parquet'
+        sql, params = dataset_sql(most_recent=True)
+        count = write_parquet(sql, params, tmp_dir / name, EXCLUDED_COLUMNS, chunk_size)
+        files.append({'name': name, 'rows': count,
+                      'description': 'Most recent products, including those without nutrition facts (Parquet)'})
+
+        dataset = root / 'dataset'
+        dataset.mkdir(exist_ok=True)
+        export_dataset(dataset, chunk_size=chunk_size)
+        name = f'flaime_history_{version}.tar'
+        # Parquet files are already compressed
+        with tarfile.open(tmp_dir / name, 'w') as tar:
+            tar.add(dataset, arcname=f'flaime_history_{version}',
+                    filter=lambda info: None if Path(info.name).name.startswith('.') else info)
+        files.append({'name': name, 'rows': None,
+                      'description': 'Every product ever loaded, as Parquet partitioned by store and scrape date'})
+
+        for f in files:
+            path = tmp_dir / f['name']
+            f['size'] = path.stat().st_size
+            f['sha256'] = sha256sum(path)
+
+        with open(tmp_dir / CHECKSUMS, 'w') as out:
+            out.writelines(f'{f["sha256"]}  {f["name"]}\n' for f in files)
+        with open(tmp_dir / MANIFEST, 'w') as out:
+            json.dump({'version': version, 'created': timezone.now().isoformat(), 'files': files}, out, indent=2)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    path = root / version
+    os.replace(tmp_dir, path)
+
+    for old in _bundle_versions()[KEEP_BUNDLES:]:
+        shutil.rmtree(root / old, ignore_errors=True)
+    return path
+
+
+def list_download_bundles() -> [dict]:
+    """ Manifests of the published bundles, newest first, with a url for each file """
+    bundles = []
+    for version in _bundle_versions():
+        with open(bundle_dir() / version / MANIFEST) as f:
+            manifest = json.load(f)
+        manifest['created'] = datetime.fromisoformat(manifest['created'])
+        for file in manifest['files']:
+            file['url'] = reverse('data:data_download_file', args=[version, file['name']])
+        manifest['checksums_url'] = reverse('data:data_download_file', args=[version, CHECKSUMS])
+        bundles.append(manifest)
+    return bundles
+
+
+def bundle_file(version: str, name: str) -> Optional[Path]:
+    """ Path of a file of a published bundle, or None if there is no such bundle or the bundle has no such file """
+    if version not in _bundle_versions():
+        return None
+    with open(bundle_dir() / version / MANIFEST) as f:
+        names = {file['name'] for file in json.load(f)['files']} | {CHECKSUMS}
+    return bundle_dir() / version / name if name in names else None
+
+
+def scheduled_build_download_bundle():
+    """ RQ job queued by schedule_download_bundle() """
+    cache.delete(BUNDLE_PENDING_KEY)
+    build_download_bundle()
+
+
+def schedule_download_bundle(queue_name: str = 'low'):
+    """
+    Queues a bundle build, e.g. after a data load. Loads finishing while a build is already queued are picked up by
+    that build. Set DOWNLOAD_BUNDLES = False to turn bundles off.
+    """
+    if not getattr(settings, 'DOWNLOAD_BUNDLES', True):
+        return
+    if cache.add(BUNDLE_PENDING_KEY, True, timeout=60 * 60 * 6):
+        transaction.on_commit(lambda: django_rq.get_queue(queue_name).enqueue(scheduled_build_download_bundle,
+                                                                              job_timeout=60 * 60 * 2))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from flaim.data.bundles import build_download_bundle
+
+
+class Command(BaseCommand):
+    help = 'Builds a new set of download bundles (CSV, Parquet and full history) for the data download page. This ' \
+           'runs in the background after every data load, so it is only needed to rebuild them by hand.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk_size', type=int, default=10000,
+                            help='Number of rows fetched from the database and written at a time')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Building download bundle...'))
+        path = build_download_bundle(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Done! Bundle is available at {path}'))
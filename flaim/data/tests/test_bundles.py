@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+from flaim.data.bundles import list_download_bundles, bundle_dir, sha256sum, MANIFEST
+
+
+@pytest.fixture
+def downloads(settings, tmp_path_factory):
+    # Outside the per-test MEDIA_ROOT set in flaim/conftest.py
+    path = tmp_path_factory.mktemp('downloads')
+    settings.DOWNLOAD_BUNDLE_DIR = path
+
+    for version in ('20220101-000000', '20220201-000000'):
+        (path / version).mkdir()
+        (path / version / 'products.csv.gz').write_bytes(b'data')
+        manifest = {'version': version, 'created': '2022-01-01T00:00:00+00:00',
+                    'files': [{'name': 'products.csv.gz', 'rows': 1, 'size': 4,
+                               'sha256': sha256sum(path / version / 'products.csv.gz')}]}
+        (path / version / MANIFEST).write_text(json.dumps(manifest))
+    # Unfinished bundles and the history dataset aren't listed
+    (path / '.20220301-000000.tmp').mkdir()
+    (path / 'dataset').mkdir()
+    return path
+
+
+def test_list_download_bundles(downloads):
+    bundles = list_download_bundles()
+    assert [b['version'] for b in bundles] == ['20220201-000000', '20220101-000000']
+    assert bundles[0]['files'][0]['url'] == '/data/download/20220201-000000/products.csv.gz'
+    assert bundles[0]['checksums_url'] == '/data/download/20220201-000000/SHA256SUMS'
+    assert bundles[0]['files'][0]['sha256'] == \
+        '3a6eb0790f39ac87c94f3856b2dd2c5d110e6811602261a9a923d3bb23adc8b7'
+
+
+def test_bundle_dir_outside_media_root(settings, tmp_path):
+    settings.DOWNLOAD_BUNDLE_DIR = tmp_path / 'downloads'
+    settings.MEDIA_ROOT = str(tmp_path)
+    with pytest.raises(ImproperlyConfigured):
+        bundle_dir()
+
+
+@pytest.mark.django_db
+def test_bundle_file_view(downloads, client, user):
+    url = '/data/download/20220201-000000/products.csv.gz'
+    assert client.get(url).status_code == 302
+
+    client.force_login(user)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert b''.join(response.streaming_content) == b'data'
+    assert 'attachment' in response['Content-Disposition']
+
+    assert client.get('/data/download/20220201-000000/manifest.json').status_code == 404
+    assert client.get('/data/download/20220301-000000/products.csv.gz').status_code == 404
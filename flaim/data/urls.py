@@ -1,10 +1,11 @@
 from django.urls import path
 
-from flaim.data.views import QualityView, DownloadView
+from flaim.data.views import QualityView, DownloadView, BundleFileView
 
 app_name = "data"
 
 urlpatterns = [
     path("download/", DownloadView.as_view(), name='data_download'),
+    path("download/<str:version>/<str:name>", BundleFileView.as_view(), name='data_download_file'),
     path("quality/", QualityView.as_view(), name='data_quality'),
 ]
@@ -1,16 +1,37 @@
-from django.views.generic import TemplateView
-from django.db.models import F
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import FileResponse, Http404
+from django.views.generic import TemplateView, View
 
-from flaim.database import models
+from flaim.data.bundles import list_download_bundles, bundle_file
+from flaim.reports.analytics import read_report_dataset
+from flaim.reports.cache import cached_report_frame
 import plotly.graph_objects as go
 import plotly.express as px
 from plotly.io import to_html
 import pandas as pd
 
 
-class DownloadView(TemplateView):
+class DownloadView(LoginRequiredMixin, TemplateView):
     template_name = 'data/download.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Read from the bundle manifests on disk; the files themselves are streamed by BundleFileView
+        bundles = list_download_bundles()
+        context['latest_bundle'] = bundles[0] if bundles else None
+        context['older_bundles'] = bundles[1:]
+        return context
+
+
+class BundleFileView(LoginRequiredMixin, View):
+    """ Streams a file of a published download bundle; bundles live outside MEDIA_ROOT so this is the only way in """
+
+    def get(self, request, version, name):
+        path = bundle_file(version, name)
+        if path is None or not path.exists():
+            raise Http404(f'No download bundle file {version}/{name}')
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
+
 
 class QualityView(TemplateView):
     template_name = 'data/quality.html'
@@ -45,19 +66,11 @@ class QualityView(TemplateView):
 
 # Fetch dataset
 def get_df():
-    products = models.Product
-    nutrition_facts = models.NutritionFacts
-    df1 = pd.DataFrame(list(products.objects
-                            .annotate(category_text=F('category__predicted_category_1'))
-                            .annotate(manual_category_text=F('category__manual_category'))
-                            .filter(most_recent=True)
-                            .values()))
-    df2 = pd.DataFrame(list(nutrition_facts.objects.filter(product__most_recent=True).values()))
-    df2.drop(columns=['id', 'created', 'modified'], inplace=True)
-    df = df1.merge(df2, left_on='id', right_on='product_id').drop(columns=['id', 'created', 'modified', 'most_recent',
-                                                                           'category_id'])
-    manual_index = df['manual_category_text'].dropna().index
-    df['category_text'].loc[manual_index] = df['manual_category_text'].dropna()
+    return cached_report_frame('quality', _build_df)
+
+
+def _build_df():
+    df = read_report_dataset().drop(columns=['subcategory_text', 'manual_subcategory_text'])
     df = df.loc[(df['category_text'] != 'Unknown') & (df['category_text'] != 'Not Food')]
     df['sugar'] /= 100
     df['brand'] = df['brand'].str.replace('’', "'")
@@ -1,79 +1,64 @@
-from typing import Optional, Tuple
-from tqdm import tqdm
+import re
+import numpy as np
 import pandas as pd
+from django.db import connection, transaction
 
-from flaim.database.models import CategoryProductCodeMappingSupport, Product, VarietyPackProductCodeMappingSupport
+from flaim.database.models import Product, VarietyPackProductCodeMappingSupport
 
 """
 Accessory methods for data_loaders.management.commands
 """
 
 
-def assign_variety_pack_flag():
-    # Iterate through all most_recent=True products and set their manual category if it is already known
-    # in the database
-    for obj in tqdm(Product.objects.filter(most_recent=True), desc="Assigning known variety pack flags"):
-        curated_variety_pack_flag = find_curated_variety_pack_flag(obj.product_code)
-        obj.variety_pack = curated_variety_pack_flag
-        obj.save()
-
-
-def find_curated_variety_pack_flag(product_code: str) -> bool:
+def assign_variety_pack_flag() -> int:
     """
-    Given a product code, queries the VarietyPackProductCode support table to find if it has been flagged as a variety
-    pack or not. Note the value defaults to False since most products are likely not variety packs.
+    Sets variety_pack on every most_recent=True product from the VarietyPackProductCodeMappingSupport table (False for
+    product codes without a record), using set-based UPDATE statements instead of a query and save per product. Only
+    products whose flag actually changes are written. Returns the number of products updated.
     """
-    try:
-        obj = VarietyPackProductCodeMappingSupport.objects.get(product_code=product_code)
-        return obj.variety_pack
-    except VarietyPackProductCodeMappingSupport.DoesNotExist:
-        return False
+    product_table = Product._meta.db_table
+    mapping_table = VarietyPackProductCodeMappingSupport._meta.db_table
+    flagged_sql = f'''
+        UPDATE {product_table} AS p
+        SET variety_pack = m.variety_pack
+        FROM {mapping_table} AS m
+        WHERE m.product_code = p.product_code AND p.most_recent AND p.variety_pack IS DISTINCT FROM m.variety_pack
+    '''
+    unflagged_sql = f'''
+        UPDATE {product_table} AS p
+        SET variety_pack = FALSE
+        WHERE p.most_recent AND p.variety_pack IS DISTINCT FROM FALSE
+          AND NOT EXISTS (SELECT 1 FROM {mapping_table} AS m WHERE m.product_code = p.product_code)
+    '''
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(flagged_sql)
+        updated = cursor.rowcount
+        cursor.execute(unflagged_sql)
+        updated += cursor.rowcount
+    print(f'Assigned known variety pack flags to {updated} products')
+    return updated
 
 
-def find_curated_category(product_code: str) -> [Tuple[Optional[str], Optional[str], Optional[str]]]:
-    """
-    Tries to retrieve a manually curated category from the database based on the provided product_code
-    returns None if query can't find a match
-    """
-    try:
-        obj = CategoryProductCodeMappingSupport.objects.get(product_code=product_code)
-        return obj.category, obj.subcategory, obj.verified_by
-    except CategoryProductCodeMappingSupport.DoesNotExist:
-        return None, None, None
+ATWATER_SUBSTITUTES = ['advantame', 'acesulfame', 'aspartame', 'erythritol', 'hydrogenated starch hydrolysates',
+                       'isomalt', 'isolmalt', 'lactitol', 'maltitol', 'mannitol', 'monk fruit extract', 'neotame',
+                       'sorbitol', 'saccharin', 'sucralose', 'thaumatin', 'xylitol']
+ATWATER_SUBSTITUTE_PATTERN = re.compile('|'.join(re.escape(s) for s in ATWATER_SUBSTITUTES))
+ATWATER_COLUMNS = ['ingredients', 'totalcarbohydrate', 'protein', 'totalfat', 'dietaryfiber', 'calories']
+ATWATER_RESULTS = ['Within Threshold', 'High Fiber', 'Contains Substitute', 'Investigation Required',
+                   'Missing Information']
 
 
 def get_atwater_results(df: pd.DataFrame) -> pd.Series:
-    substitutes = ['advantame', 'acesulfame', 'aspartame', 'erythritol', 'hydrogenated starch hydrolysates', 'isomalt',
-                   'isolmalt', 'lactitol', 'maltitol', 'mannitol', 'monk fruit extract', 'neotame', 'sorbitol',
-                   'saccharin', 'sucralose', 'thaumatin', 'xylitol']
-    columns = ['ingredients', 'totalcarbohydrate', 'protein', 'totalfat', 'dietaryfiber', 'calories']
-    test_results = ['Within Threshold', 'High Fiber', 'Contains Substitute', 'Investigation Required',
-                    'Missing Information']
-
-    def contains_substitute(row):
-        for s in substitutes:
-            if s in row:
-                return s
-        return 'none'
-
-    def final_pass(row):
-        if row['pass']:
-            return test_results[0]
-        elif row['pass-fiber']:
-            return test_results[1]
-        elif row['substitute'] != 'none':
-            return test_results[2]
-        else:
-            return test_results[3]
-
-    a_df = df[['name'] + columns].dropna(how='any', subset=['calories']).dropna(how='all', subset=columns)
-    a_df['atwater'] = a_df['totalcarbohydrate'].fillna(0) * 4 + a_df['protein'].fillna(0) * 4 + \
-                      a_df['totalfat'].fillna(0) * 9
-    a_df['atwater-fiber'] = a_df['atwater'] - a_df['dietaryfiber'].fillna(0) * 4
-    a_df['difference'] = ((a_df['calories'] - a_df['atwater']) / a_df['calories']).fillna(0)
-    a_df['difference-fiber'] = ((a_df['calories'] - a_df['atwater-fiber']) / a_df['calories']).fillna(0)
-    a_df['pass'] = ((a_df['difference'].abs() < 0.2) | ((a_df['calories'] - a_df['atwater']).abs() < 13.5))  # | \
-    a_df['pass-fiber'] = ((a_df['difference-fiber'].abs() < 0.2) | ((a_df['calories'] - a_df['atwater']).abs() < 13.5))
-    a_df['substitute'] = a_df['ingredients'].str.lower().fillna('').apply(contains_substitute)
+    a_df = df[['name'] + ATWATER_COLUMNS].dropna(how='any', subset=['calories']).dropna(how='all',
+                                                                                       subset=ATWATER_COLUMNS)
+    atwater = a_df['totalcarbohydrate'].fillna(0) * 4 + a_df['protein'].fillna(0) * 4 + a_df['totalfat'].fillna(0) * 9
+    atwater_fiber = atwater - a_df['dietaryfiber'].fillna(0) * 4
+    difference = ((a_df['calories'] - atwater) / a_df['calories']).fillna(0)
+    difference_fiber = ((a_df['calories'] - atwater_fiber) / a_df['calories']).fillna(0)
+    within_absolute = (a_df['calories'] - atwater).abs() < 13.5
+    passed = (difference.abs() < 0.2) | within_absolute
+    passed_fiber = (difference_fiber.abs() < 0.2) | within_absolute
+    substitute = a_df['ingredients'].str.lower().str.contains(ATWATER_SUBSTITUTE_PATTERN).fillna(False).astype(bool)
 
-    return a_df.apply(final_pass, axis=1).reindex(df.index).fillna(test_results[4])
+    results = np.select([passed, passed_fiber, substitute], ATWATER_RESULTS[:3], default=ATWATER_RESULTS[3])
+    return pd.Series(results, index=a_df.index, dtype=object).reindex(df.index).fillna(ATWATER_RESULTS[4])
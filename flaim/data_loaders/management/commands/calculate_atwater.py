@@ -1,20 +1,32 @@
 import pandas as pd
 from django.core.management.base import BaseCommand
-from flaim.data_loaders.management.accessories import get_atwater_results
+from django.db import connection, transaction
+from flaim.data_loaders.management.accessories import get_atwater_results, ATWATER_COLUMNS
 from flaim.database.models import Product, NutritionFacts
-from tqdm import tqdm
 
 
-def calculate_atwater():
-    product_df = pd.DataFrame(list(Product.objects.filter(most_recent=True).values()))
-    nft_df = pd.DataFrame(list(NutritionFacts.objects.filter(product__most_recent=True).values()))
+def calculate_atwater() -> int:
+    """
+    Computes the Atwater result for every most_recent=True product and writes them back with a single UPDATE joined
+    against the results, touching only products whose result changed. Returns the number of products updated.
+    """
+    product_df = pd.DataFrame(list(Product.objects.filter(most_recent=True).values('id', 'name')),
+                              columns=['id', 'name'])
+    nft_df = pd.DataFrame(list(NutritionFacts.objects.filter(product__most_recent=True)
+                               .values('product_id', *ATWATER_COLUMNS)),
+                          columns=['product_id'] + ATWATER_COLUMNS)
     df = product_df.merge(nft_df, left_on='id', right_on='product_id')
     df['atwater_result'] = get_atwater_results(df)
 
-    for i, row in tqdm(df.iterrows(), total=len(df), desc="Updating database"):
-        product = Product.objects.get(id=row['id_x'])
-        product.atwater_result = row['atwater_result']
-        product.save()
+    sql = f'''
+        UPDATE {Product._meta.db_table} AS p
+        SET atwater_result = r.atwater_result
+        FROM unnest(%s::integer[], %s::text[]) AS r(id, atwater_result)
+        WHERE p.id = r.id AND p.atwater_result IS DISTINCT FROM r.atwater_result
+    '''
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, [df['id'].astype(int).tolist(), df['atwater_result'].tolist()])
+        return cursor.rowcount
 
 
 class Command(BaseCommand):
@@ -22,5 +34,5 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS(f'Calculating Atwater results...'))
-        calculate_atwater()
-        self.stdout.write(self.style.SUCCESS(f'Done!'))
+        updated = calculate_atwater()
+        self.stdout.write(self.style.SUCCESS(f'Done! Updated {updated} products'))
@@ -10,6 +10,8 @@ from flaim.data_loaders.management.accessories import assign_variety_pack_flag
 from flaim.database.models import Product, CostcoProduct, NutritionFacts, ProductImage, ScrapeBatch
 from flaim.classifiers.management.commands.assign_categories import assign_categories
 from flaim.data_loaders.management.commands.calculate_atwater import calculate_atwater
+from flaim.reports.analytics import refresh_report_data
+from flaim.data.bundles import schedule_download_bundle
 from django.contrib.auth import get_user_model
 from flaim.data_loaders.management.commands.load_loblaws_to_db import  read_json
 
@@ -180,4 +182,10 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS(f'Calculating Atwater result for products'))
         calculate_atwater()
 
+        self.stdout.write(self.style.SUCCESS(f'Refreshing report data'))
+        refresh_report_data(scrape)
+
+        self.stdout.write(self.style.SUCCESS(f'Queueing download bundles'))
+        schedule_download_bundle()
+
         self.stdout.write(self.style.SUCCESS(f'Loading complete!'))
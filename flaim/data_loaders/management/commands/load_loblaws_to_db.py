@@ -13,6 +13,8 @@ import re
 from flaim.database.models import Product, LoblawsProduct, NutritionFacts, ScrapeBatch, ProductImage
 from flaim.classifiers.management.commands.assign_categories import assign_categories
 from flaim.data_loaders.management.commands.calculate_atwater import calculate_atwater
+from flaim.reports.analytics import refresh_report_data
+from flaim.data.bundles import schedule_download_bundle
 from flaim.data_loaders.management.accessories import assign_variety_pack_flag
 
 User = get_user_model()
@@ -370,4 +372,10 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS(f'Calculating Atwater result for products'))
         calculate_atwater()
 
+        self.stdout.write(self.style.SUCCESS(f'Refreshing report data'))
+        refresh_report_data(scrape)
+
+        self.stdout.write(self.style.SUCCESS(f'Queueing download bundles'))
+        schedule_download_bundle()
+
         self.stdout.write(self.style.SUCCESS(f'Loading complete!'))
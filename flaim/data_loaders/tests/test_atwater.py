@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+
+from flaim.data_loaders.management.accessories import get_atwater_results
+
+
+def test_atwater_results():
+    df = pd.DataFrame({
+        'name': ['pass', 'fiber', 'substitute', 'fail', 'missing'],
+        'ingredients': ['oats', 'bran', 'Water, SUCRALOSE', np.nan, 'water'],
+        'totalcarbohydrate': [20, 20, 20, 20, np.nan],
+        'protein': [5, 5, 5, 5, np.nan],
+        'totalfat': [0, 0, 0, 0, np.nan],
+        'dietaryfiber': [0, 10, 0, 0, np.nan],
+        'calories': [100, 60, 30, 30, np.nan],
+    })
+    assert get_atwater_results(df).tolist() == ['Within Threshold', 'High Fiber', 'Contains Substitute',
+                                                'Investigation Required', 'Missing Information']
@@ -4,6 +4,7 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from flaim.database.product_mappings import REFERENCE_CATEGORIES_DICT
 from flaim.database.models import ReferenceCategorySupport
+from flaim.reports.analytics import schedule_report_refresh
 
 User = get_user_model()
 
@@ -315,6 +316,7 @@ class AdvancedProductSerializer(serializers.ModelSerializer, EagerLoadingMixin):
             product_mapping.category = instance.category.manual_category
             product_mapping.save()
 
+        schedule_report_refresh()
         return instance
 
     class Meta:
@@ -0,0 +1,38 @@
+import pandas as pd
+from django.db import connection
+
+"""
+category_aggregates is a small materialized view of per-category and per-subcategory statistics computed from
+product_analytics with percentile_cont, so the category and subcategory reports can fetch a few dozen numbers instead of
+grouping the full dataset in pandas. It applies the same product filters as ReportData, and medians of nutrients
+treat missing values as 0 like the reports always have. The *_rank columns are each row's 0-based position when its
+category (or its subcategory within the parent category) is ranked by the nutrient median, highest first.
+top_ingredients holds the (up to) three ingredients listed by the most products, from the lowercased, comma-separated
+ingredient lists.
+
+The view is created by reports migration 0002 and recreated with top_ingredients by 0004, which hold its SQL, and
+refreshed along with product_analytics by refresh_report_data(). Changing the statistics it holds needs a new reports migration that recreates the view.
+"""
+
+CATEGORY_AGGREGATES = 'category_aggregates'
+
+
+def refresh_category_aggregates(concurrently: bool = True):
+    with connection.cursor() as cursor:
+        cursor.execute(f'REFRESH MATERIALIZED VIEW {"CONCURRENTLY " if concurrently else ""}{CATEGORY_AGGREGATES}')
+
+
+def read_category_aggregates(level: str, category: str = None) -> pd.DataFrame:
+    """
+    Statistics for every category (level='category', indexed by category_text) or every subcategory (level=
+    'subcategory', indexed by subcategory_text), optionally only the subcategories of one category
+    """
+    sql = f'SELECT * FROM {CATEGORY_AGGREGATES} WHERE level = %s'
+    params = [level]
+    if category is not None:
+        sql += ' AND category_text = %s'
+        params.append(category)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        df = pd.DataFrame(cursor.fetchall(), columns=[c[0] for c in cursor.description])
+    return df.set_index('category_text' if level == 'category' else 'subcategory_text')
@@ -0,0 +1,93 @@
+import logging
+import time
+
+import django_rq
+import pandas as pd
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from flaim.reports.aggregates import refresh_category_aggregates
+from flaim.reports.cache import bump_data_version, schedule_figure_warmup
+from flaim.reports.histograms import update_nutrient_histograms
+from flaim.reports.snapshots import snapshots_enabled, write_snapshot, read_snapshot
+
+"""
+product_analytics is a materialized view holding one denormalized row per most_recent=True product that has nutrition
+facts: the product fields, its best (manual if set, otherwise predicted) category and subcategory, and every
+NutritionFacts column. Report, data quality and visualizer pages read from it instead of merging Product and
+NutritionFacts in pandas on every request.
+
+The view is created by reports migration 0001, which holds its SQL, and refreshed by refresh_report_data() at the end
+of every data load, or in the background by schedule_report_refresh() after curator edits. Changing a Product or
+NutritionFacts field the view selects needs a new reports migration that recreates the view.
+"""
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_ANALYTICS = 'product_analytics'
+REFRESH_PENDING_KEY = 'reports:refresh_pending'
+
+
+def refresh_product_analytics(concurrently: bool = True):
+    """ Rebuilds product_analytics. A concurrent refresh keeps the old rows readable by report pages meanwhile. """
+    with connection.cursor() as cursor:
+        cursor.execute(f'REFRESH MATERIALIZED VIEW {"CONCURRENTLY " if concurrently else ""}{PRODUCT_ANALYTICS}')
+
+
+def read_product_analytics(columns: [str] = None) -> pd.DataFrame:
+    """ Reads product_analytics (optionally only some columns) into a DataFrame """
+    select = ', '.join(connection.ops.quote_name(c) for c in columns) if columns else '*'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {select} FROM {PRODUCT_ANALYTICS}')
+        return pd.DataFrame(cursor.fetchall(), columns=[c[0] for c in cursor.description])
+
+
+def read_report_dataset(columns: [str] = None) -> pd.DataFrame:
+    """ The product_analytics rows, read from the current columnar snapshot if there is one and the view otherwise """
+    df = read_snapshot(columns)
+    return df if df is not None else read_product_analytics(columns)
+
+
+def refresh_report_data(batch=None):
+    """
+    Brings everything the report pages read up to date: refreshes product_analytics and the category aggregates and
+    nutrient histograms built from it, publishes a new snapshot of product_analytics, bumps the report data version so
+    cached frames and figures are rebuilt, and queues the jobs that pre-render the figures. Called at the end of every
+    data load with the ScrapeBatch that was loaded, in which case only that store's histograms are recomputed.
+    """
+    refresh_product_analytics()
+    refresh_category_aggregates()
+    update_nutrient_histograms([batch.store] if batch is not None else None)
+    if snapshots_enabled():
+        # Written under a fresh version so the file name never collides with a snapshot a worker still has mapped
+        write_snapshot(read_product_analytics(), int(time.time() * 1000))
+    bump_data_version()
+    schedule_figure_warmup()
+
+
+def scheduled_refresh_report_data():
+    """ RQ job queued by schedule_report_refresh() """
+    cache.delete(REFRESH_PENDING_KEY)
+    refresh_report_data()
+
+
+def _enqueue_report_refresh(queue_name: str):
+    # The pending flag is only left set once the job is actually queued, or the next hour of edits would be dropped
+    try:
+        if cache.add(REFRESH_PENDING_KEY, True, timeout=60 * 60):
+            try:
+                django_rq.get_queue(queue_name).enqueue(scheduled_refresh_report_data)
+            except Exception:
+                cache.delete(REFRESH_PENDING_KEY)
+                raise
+    except Exception:
+        logger.exception('Could not queue a report data refresh')
+
+
+def schedule_report_refresh(queue_name: str = 'low'):
+    """
+    Queues a background refresh of the report data once the current transaction commits, e.g. after a curator edit.
+    Edits arriving while a refresh is already queued are picked up by that refresh, so a burst of edits only triggers
+    one. Failing to queue it (e.g. with Redis down) is logged rather than raised, so it never breaks the edit itself.
+    """
+    transaction.on_commit(lambda: _enqueue_report_refresh(queue_name))
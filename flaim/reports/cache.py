@@ -0,0 +1,121 @@
+"""
+Caching for the prepared report DataFrames.
+
+Frames are kept in memory in each worker process, keyed by a data version held in the cache backend. The version is
+bumped whenever the report data changes (see flaim.reports.analytics.refresh_report_data), after which each worker
+rebuilds its frame on its next request. With REPORT_DATA_SHARED_CACHE = True, a rebuilt frame is also stored in the
+cache backend as Arrow IPC bytes so only the first worker has to query the database.
+
+Rendered figures are cached the same way, except that they only live in the cache backend: building one (KDE fitting
+for the distribution plots, Plotly serialization for all of them) costs far more than fetching it. After each load the
+FIGURE_WARMERS jobs render every figure the report pages can ask for, so visitors never pay for it.
+"""
+import hashlib
+import logging
+import time
+
+import django_rq
+import pyarrow as pa
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DATA_VERSION_KEY = 'reports:data_version'
+SHARED_FRAME_TIMEOUT = 60 * 60 * 24
+FIGURE_TIMEOUT = getattr(settings, 'REPORT_FIGURE_TIMEOUT', 60 * 60 * 24)
+
+# RQ jobs run after each load to pre-render figures; dotted paths so apps that use cached_figure can add theirs
+FIGURE_WARMERS = ['flaim.reports.figures.warm_report_figures',
+                  'flaim.visualizer.views.warm_visualizer_figures']
+
+# name -> (data version, DataFrame)
+_frames = {}
+
+
+def get_data_version() -> int:
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        # Seeded from the clock so a flushed cache can never hand out a version an older frame was cached under
+        cache.add(DATA_VERSION_KEY, int(time.time()), timeout=None)
+        version = cache.get(DATA_VERSION_KEY, int(time.time()))
+    return version
+
+
+def bump_data_version() -> int:
+    try:
+        return cache.incr(DATA_VERSION_KEY)
+    except ValueError:
+        version = int(time.time())
+        cache.set(DATA_VERSION_KEY, version, timeout=None)
+        return version
+
+
+def _shared_key(name: str, version: int) -> str:
+    return f'reports:frame:{name}:{version}'
+
+
+def _to_ipc(df) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _from_ipc(data: bytes):
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+def cached_report_frame(name: str, build):
+    """
+    Returns the frame called name for the current data version, calling build() to make it on a miss. The same object
+    is handed to every caller in the process, so callers must copy it before modifying it.
+    """
+    version = get_data_version()
+    cached = _frames.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    use_shared = getattr(settings, 'REPORT_DATA_SHARED_CACHE', False)
+    df = None
+    if use_shared:
+        data = cache.get(_shared_key(name, version))
+        if data is not None:
+            df = _from_ipc(data)
+    if df is None:
+        df = build()
+        if use_shared:
+            try:
+                cache.set(_shared_key(name, version), _to_ipc(df), timeout=SHARED_FRAME_TIMEOUT)
+            except pa.ArrowException as e:
+                logger.warning('Could not share report frame %s through the cache: %s', name, e)
+
+    _frames[name] = (version, df)
+    return df
+
+
+def _figure_key(name: str, filters: tuple, version: int) -> str:
+    # Filters are category/store names, which aren't safe in every cache backend's keys
+    digest = hashlib.md5('\x1f'.join(str(f) for f in filters).encode()).hexdigest()
+    return f'reports:figure:{name}:{version}:{digest}'
+
+
+def cached_figure(name: str, build, *filters):
+    """
+    Returns the figure called name for the given filters and the current data version, calling build() to render it on
+    a miss. build() can return anything the cache backend can store, usually the HTML fragment from plotly.io.to_html.
+    """
+    key = _figure_key(name, filters, get_data_version())
+    figure = cache.get(key)
+    if figure is None:
+        figure = build()
+        cache.set(key, figure, timeout=FIGURE_TIMEOUT)
+    return figure
+
+
+def schedule_figure_warmup(queue_name: str = 'low'):
+    """ Queues the FIGURE_WARMERS jobs, which render against the data version current when they run """
+    queue = django_rq.get_queue(queue_name)
+    for warmer in FIGURE_WARMERS:
+        queue.enqueue(warmer)
@@ -1,36 +1,21 @@
 import pandas as pd
 
-from django.db.models import F
+from django.db.models import F, OuterRef, Subquery
 from flaim.database import models
+from flaim.reports.analytics import read_report_dataset
+from flaim.reports.cache import cached_report_frame
+
+# NutritionLabelClassification codes as the image labels used by the store report
+IMAGE_CLASSIFICATION_LABELS = {'N': 'nutrition', 'I': 'ingredients', 'O': 'other'}
 
 
 class ReportData:
     def __init__(self):
-        self.df = self._get_data()
+        # Shared by every request in this process until the report data changes; views copy it before modifying it
+        self.df = cached_report_frame(type(self).__name__, self._get_data)
 
     def _get_data(self):
-        products = models.Product
-        nutrition_facts = models.NutritionFacts
-        df1 = pd.DataFrame(list(products.objects
-                                .annotate(category_text=F('category__predicted_category_1'))
-                                .annotate(manual_category_text=F('category__manual_category'))
-                                .annotate(subcategory_text=F('subcategory__predicted_subcategory_1'))
-                                .annotate(manual_subcategory_text=F('subcategory__manual_subcategory'))
-                                .filter(most_recent=True)
-                                .values()))
-        df2 = pd.DataFrame(list(nutrition_facts.objects.filter(product__most_recent=True)
-                                .annotate(product_code=F('product__product_code'))
-                                .values()))
-
-        df = df1.merge(df2.drop(columns=['id', 'created', 'modified']),
-                       on='product_code').drop(columns=['id', 'created', 'modified', 'product_id'])
-
-        manual_index = df['manual_category_text'].dropna().index
-        df['category_text'].loc[manual_index] = df['manual_category_text'].dropna()
-
-        manual_sub_index = df['manual_subcategory_text'].dropna().index
-        df['subcategory_text'].loc[manual_sub_index] = df['manual_subcategory_text'].dropna()
-
+        df = read_report_dataset()
         df = df.loc[(df['category_text'] != 'Unknown') & (df['category_text'] != 'Not Food')
                     & (df['category_text'] != 'Uncategorized')]
         df['sugar'] /= 100
@@ -46,6 +31,15 @@ class StoreReportData(ReportData):
     def _get_data(self):
         df = super()._get_data()
         images = models.ProductImage
-        df3 = pd.DataFrame(list(images.objects.annotate(product_code=F('product__product_code')).values()))
-        df = df.merge(df3, how='outer', on='product_code').drop(columns=['id', 'product_id', 'created', 'modified'])
+        latest_classification = models.NutritionLabelClassification.objects.filter(
+            product_image=OuterRef('pk')).order_by('-created').values('classification')[:1]
+        df3 = pd.DataFrame(list(images.objects.annotate(product_code=F('product__product_code'))
+                                .annotate(classification=Subquery(latest_classification))
+                                .values()),
+                           columns=[f.attname for f in images._meta.concrete_fields] + ['product_code',
+                                                                                       'classification'])
+        # Labels from the nutrition label classifier take precedence over the ones loaders parsed from file names
+        df3['image_label'] = df3.pop('classification').map(IMAGE_CLASSIFICATION_LABELS).fillna(df3['image_label'])
+        df = df.merge(df3.drop(columns=['product_id']), how='outer', on='product_code').drop(
+            columns=['id', 'product_id', 'created', 'modified'])
         return df.drop_duplicates(subset='name')
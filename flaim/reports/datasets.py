@@ -0,0 +1,190 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.db import connection
+
+from flaim.database.models import Product, NutritionFacts, ProductImage, ScrapeBatch
+from flaim.reports.exports import product_report_sql
+
+"""
+Parquet export of the full product dataset: every product with its nutrition facts, categories and image paths,
+partitioned hive style by store and scrape date (store=LOBLAWS/scrape_date=2021-01-15/batch_12.parquet) so it can be
+read with pandas.read_parquet or pyarrow.dataset and filtered on either without touching the other partitions.
+
+Each ScrapeBatch becomes one file that is written once, after which exports only add files for new batches. Columns
+that change after a batch is loaded (most_recent) are left out; run with rebuild=True to rewrite every partition with
+current categories. Products loaded before scrape batches existed have no batch; they are written once per store to
+an explicit store=LOBLAWS/scrape_date=unknown/batch_unknown.parquet partition.
+"""
+
+# Given by the partition directories rather than stored in the files
+PARTITION_COLUMNS = ['store', 'scrape_date']
+EXCLUDED_COLUMNS = {'most_recent'}
+# Stands in for the scrape date and batch id of products without a ScrapeBatch
+UNKNOWN_PARTITION = 'unknown'
+# Stored dictionary encoded, so they are read back as pandas categoricals
+CATEGORICAL_COLUMNS = {'brand', 'atwater_result', 'price_units', 'predicted_category', 'predicted_subcategory',
+                       'manual_category', 'manual_subcategory'}
+
+
+def _arrow_type(field, float_type):
+    internal_type = field.get_internal_type()
+    if internal_type in ('AutoField', 'BigAutoField', 'ForeignKey', 'OneToOneField'):
+        return pa.int64()
+    if internal_type == 'IntegerField':
+        return pa.int32()
+    if internal_type == 'FloatField':
+        return float_type
+    if internal_type in ('BooleanField', 'NullBooleanField'):
+        return pa.bool_()
+    if internal_type == 'DateTimeField':
+        return pa.timestamp('us', tz='UTC')
+    if internal_type == 'DateField':
+        return pa.date32()
+    if internal_type == 'ArrayField':
+        return pa.list_(pa.string())
+    return pa.string()
+
+
+def dataset_schema(columns: [str]):
+    """ Arrow schema for the given dataset columns: float32 nutrients, dictionary encoded CATEGORICAL_COLUMNS """
+    types = {'image_paths': pa.list_(pa.string()), 'image_labels': pa.list_(pa.string())}
+    # Nutrition facts first so Product's types win for the id column both models have
+    for model, float_type in ((NutritionFacts, pa.float32()), (Product, pa.float64())):
+        types.update((f.column, _arrow_type(f, float_type)) for f in model._meta.concrete_fields)
+    for column in CATEGORICAL_COLUMNS:
+        types[column] = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([pa.field(column, types.get(column, pa.string())) for column in columns])
+
+
+def dataset_sql(batch_id: Optional[int] = None, most_recent: bool = False, stores: Optional[list] = None,
+                unbatched: bool = False) -> (str, list):
+    """
+    Product report rows, including products without nutrition facts, plus image paths. Limited to one scrape batch,
+    to products without a scrape batch, to some stores and/or to most_recent=True products if asked.
+    """
+    report_sql, params = product_report_sql(most_recent=True if most_recent else None, stores=stores,
+                                            batch_ids=[batch_id] if batch_id is not None else None,
+                                            require_nutrition=False, unbatched=unbatched)
+    sql = f'''
+        SELECT r.*, i.image_paths, i.image_labels
+        FROM ({report_sql}) AS r
+        LEFT JOIN LATERAL (
+            SELECT array_agg(image_path ORDER BY image_number) AS image_paths,
+                   array_agg(image_label ORDER BY image_number) AS image_labels
+            FROM {ProductImage._meta.db_table}
+            WHERE product_id = r.id
+        ) AS i ON TRUE
+        ORDER BY r.id
+    '''
+    return sql, params
+
+
+def partition_path(outdir: Path, batch: ScrapeBatch) -> Path:
+    scrape_date = batch.scrape_date or batch.created.date()
+    partition = Path(outdir) / f'store={batch.store}' / f'scrape_date={scrape_date.isoformat()}'
+    return partition / f'batch_{batch.id}.parquet'
+
+
+def unbatched_partition_path(outdir: Path, store: str) -> Path:
+    partition = Path(outdir) / f'store={store}' / f'scrape_date={UNKNOWN_PARTITION}'
+    return partition / f'batch_{UNKNOWN_PARTITION}.parquet'
+
+
+def _to_arrow(rows: list, indices: [int], schema):
+    arrays = []
+    for i, field in zip(indices, schema):
+        values = [row[i] for row in rows]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(sql: str, params: list, path: Path, excluded_columns: set = frozenset(),
+                  chunk_size: int = 10000) -> int:
+    """
+    Writes the rows of a dataset query to a Parquet file chunk_size rows at a time, each chunk becoming a row group.
+    The file only appears under its final name once complete, and not at all if there are no rows. Returns the number
+    of rows written.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Dot-prefixed files are skipped by dataset readers
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+
+    count = 0
+    writer = None
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchmany(chunk_size)
+        columns = [c[0] for c in cursor.description]
+        indices = [i for i, c in enumerate(columns) if c not in excluded_columns]
+        schema = dataset_schema([columns[i] for i in indices])
+        try:
+            writer = pq.ParquetWriter(str(tmp_path), schema, compression='snappy')
+            while rows:
+                writer.write_table(_to_arrow(rows, indices, schema))
+                count += len(rows)
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    if count:
+        os.replace(tmp_path, path)
+    else:
+        tmp_path.unlink()
+    return count
+
+
+def write_batch_partition(batch: ScrapeBatch, outdir: Path, chunk_size: int = 10000) -> int:
+    """ Writes the products of one scrape batch to its partition. Returns the number of products written. """
+    sql, params = dataset_sql(batch.id)
+    return write_parquet(sql, params, partition_path(outdir, batch), set(PARTITION_COLUMNS) | EXCLUDED_COLUMNS,
+                         chunk_size)
+
+
+def write_unbatched_partition(store: str, outdir: Path, chunk_size: int = 10000) -> int:
+    """ Writes the products of a store that have no scrape batch. Returns the number of products written. """
+    sql, params = dataset_sql(stores=[store], unbatched=True)
+    return write_parquet(sql, params, unbatched_partition_path(outdir, store),
+                         set(PARTITION_COLUMNS) | EXCLUDED_COLUMNS, chunk_size)
+
+
+def export_dataset(outdir: Path, stores: Optional[list] = None, rebuild: bool = False,
+                   chunk_size: int = 10000) -> [Path]:
+    """
+    Writes a partition for every scrape batch (optionally only those of some stores) that doesn't have one yet, or for
+    every batch if rebuild is True, and likewise one per store for products without a scrape batch. Returns the paths
+    written.
+    """
+    batches = ScrapeBatch.objects.order_by('id')
+    if stores is not None:
+        batches = batches.filter(store__in=stores)
+
+    written = []
+    for batch in batches:
+        path = partition_path(outdir, batch)
+        if path.exists() and not rebuild:
+            continue
+        count = write_batch_partition(batch, outdir, chunk_size)
+        if count:
+            print(f'Wrote {count} products from {batch} to {path}')
+            written.append(path)
+
+    unbatched = Product.objects.filter(batch__isnull=True)
+    if stores is not None:
+        unbatched = unbatched.filter(store__in=stores)
+    for store in unbatched.order_by('store').values_list('store', flat=True).distinct():
+        path = unbatched_partition_path(outdir, store)
+        if path.exists() and not rebuild:
+            continue
+        count = write_unbatched_partition(store, outdir, chunk_size)
+        if count:
+            print(f'Wrote {count} {store} products without a scrape batch to {path}')
+            written.append(path)
+    return written
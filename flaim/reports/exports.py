@@ -0,0 +1,103 @@
+import csv
+import gzip
+from pathlib import Path
+from typing import Optional
+
+from django.db import connection
+
+from flaim.database.models import Product, NutritionFacts, Category, Subcategory, ReferenceCategorySupport
+
+"""
+Product report export. The report is a single SQL query joining products, their nutrition facts, their predicted and
+manual categories and the reference category ids, read through a server-side cursor and written to disk chunk_size rows
+at a time, so memory use stays flat no matter how many products are exported.
+"""
+
+# Replaced by the category text and reference id columns
+EXCLUDED_PRODUCT_FIELDS = {'category', 'subcategory'}
+EXCLUDED_NUTRITION_FIELDS = {'id', 'created', 'modified'}
+
+
+def product_report_sql(most_recent: Optional[bool] = True, categories: Optional[list] = None,
+                       stores: Optional[list] = None, batch_ids: Optional[list] = None, require_nutrition: bool = True,
+                       unbatched: bool = False) -> (str, list):
+    """
+    Query and parameters for the product report: one row per product with nutrition facts (or per product at all if
+    require_nutrition is False), limited to products with that most_recent flag unless most_recent is None, and
+    optionally to some categories (predicted or manual), stores and scrape batches, or to products without a scrape
+    batch
+    """
+    product_columns = [f'p.{f.column}' for f in Product._meta.concrete_fields if f.name not in EXCLUDED_PRODUCT_FIELDS]
+    nutrition_columns = [f'nf.{f.column}' for f in NutritionFacts._meta.concrete_fields
+                         if f.name not in EXCLUDED_NUTRITION_FIELDS]
+    columns = ',\n               '.join(
+        product_columns +
+        ['c.predicted_category_1 AS predicted_category',
+         's.predicted_subcategory_1 AS predicted_subcategory',
+         'c.manual_category AS manual_category',
+         's.manual_subcategory AS manual_subcategory',
+         'pc.category_id AS predicted_category_id',
+         'ps.subcategory_id AS predicted_subcategory_id',
+         'mc.category_id AS manual_category_id',
+         'ms.subcategory_id AS manual_subcategory_id'] + nutrition_columns)
+
+    where, params = [], []
+    if most_recent is not None:
+        where.append('p.most_recent' if most_recent else 'NOT p.most_recent')
+    if categories is not None:
+        where.append('(c.predicted_category_1 = ANY(%s) OR c.manual_category = ANY(%s))')
+        params += [list(categories), list(categories)]
+    if stores is not None:
+        where.append('p.store = ANY(%s)')
+        params.append(list(stores))
+    if batch_ids is not None:
+        where.append('p.batch_id = ANY(%s)')
+        params.append(list(batch_ids))
+    if unbatched:
+        where.append('p.batch_id IS NULL')
+
+    reference_table = ReferenceCategorySupport._meta.db_table
+    sql = f'''
+        WITH category_ids AS (
+            SELECT DISTINCT ON (category_name) category_name, category_id
+            FROM {reference_table}
+            ORDER BY category_name, id
+        ), subcategory_ids AS (
+            SELECT DISTINCT ON (subcategory_name) subcategory_name, subcategory_id
+            FROM {reference_table}
+            ORDER BY subcategory_name, id
+        )
+        SELECT {columns}
+        FROM {Product._meta.db_table} AS p
+        {'JOIN' if require_nutrition else 'LEFT JOIN'} {NutritionFacts._meta.db_table} AS nf ON nf.product_id = p.id
+        LEFT JOIN {Category._meta.db_table} AS c ON c.id = p.category_id
+        LEFT JOIN {Subcategory._meta.db_table} AS s ON s.id = p.subcategory_id
+        LEFT JOIN category_ids AS pc ON pc.category_name = c.predicted_category_1
+        LEFT JOIN subcategory_ids AS ps ON ps.subcategory_name = s.predicted_subcategory_1
+        LEFT JOIN category_ids AS mc ON mc.category_name = c.manual_category
+        LEFT JOIN subcategory_ids AS ms ON ms.subcategory_name = s.manual_subcategory
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY p.id
+    '''
+    return sql, params
+
+
+def write_product_report(outfile: Path, most_recent: Optional[bool] = True, categories: Optional[list] = None,
+                         stores: Optional[list] = None, compress: bool = False, chunk_size: int = 10000) -> int:
+    """
+    Streams the product report to a CSV file, gzipped if compress is True. Returns the number of products written.
+    """
+    sql, params = product_report_sql(most_recent, categories, stores)
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(outfile, 'wt', newline='', encoding='utf-8') as f, connection.chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        writer = csv.writer(f)
+        # A server-side cursor only has a description once the first rows are fetched
+        rows = cursor.fetchmany(chunk_size)
+        writer.writerow([c[0] for c in cursor.description])
+        while rows:
+            writer.writerows(rows)
+            count += len(rows)
+            rows = cursor.fetchmany(chunk_size)
+    return count
@@ -0,0 +1,51 @@
+import pandas as pd
+
+from flaim.database.product_mappings import PRODUCT_STORES
+from flaim.reports.aggregates import read_category_aggregates
+from flaim.reports.cache import cached_figure
+from flaim.reports.data import StoreReportData
+from flaim.reports.histograms import HISTOGRAM_NUTRIENTS, read_nutrient_histograms
+from flaim.reports.plots import nutrient_histogram_plot, category_nutrient_distribution_plot
+
+"""
+Cached report figures. Each figure is rendered once per data version through flaim.reports.cache.cached_figure, and
+warm_report_figures() renders all of them ahead of time after each load.
+"""
+
+# Drawn on the category and subcategory reports; all binned the same way so they can share an axis
+CATEGORY_FIGURE_NUTRIENTS = ['sodium_dv', 'saturatedfat_dv', 'sugar']
+
+
+def category_distribution_figure(category: str, subcategory: str = None) -> str:
+    """ Nutrient distribution plot of a category report, or of a subcategory report if subcategory is given """
+    def build():
+        histograms = pd.concat({HISTOGRAM_NUTRIENTS[n].label: read_nutrient_histograms(n, category=category,
+                                                                                      subcategory=subcategory)['count']
+                                for n in CATEGORY_FIGURE_NUTRIENTS}, axis=1)
+        return nutrient_histogram_plot(histograms, HISTOGRAM_NUTRIENTS[CATEGORY_FIGURE_NUTRIENTS[0]])
+
+    return cached_figure('nutrient_distribution', build, category, subcategory or '')
+
+
+def store_distribution_figure(store: str) -> str:
+    """ Products over the 15% DV threshold by category, for a store report """
+    def build():
+        df = StoreReportData().df
+        return category_nutrient_distribution_plot(df.loc[df['store'] == store].copy())
+
+    return cached_figure('category_nutrient_distribution', build, store)
+
+
+def warm_report_figures() -> int:
+    """ RQ job rendering the figure of every category, subcategory and store report. Returns the number rendered. """
+    count = 0
+    for category in read_category_aggregates('category').index:
+        category_distribution_figure(category)
+        count += 1
+    for subcategory, row in read_category_aggregates('subcategory').iterrows():
+        category_distribution_figure(row['category_text'], subcategory)
+        count += 1
+    for store, _ in PRODUCT_STORES:
+        store_distribution_figure(store)
+        count += 1
+    return count
@@ -0,0 +1,135 @@
+from typing import NamedTuple
+
+import pandas as pd
+from django.db import connection, transaction
+
+"""
+nutrient_histograms holds fixed-bin counts of nutrient values per (nutrient, category, subcategory, store), computed
+from product_analytics with width_bucket. Report pages that show nutrient distributions sum the few hundred rows they
+need instead of loading and binning raw values on every request.
+
+Bin 0 counts values below a nutrient's range and bin `bins + 1` values above it. Products are filtered like ReportData
+except that duplicate names are only dropped within a store, which is what lets each store's rows be recomputed on their
+own: a data load only replaces the rows of the store its ScrapeBatch belongs to.
+
+The table is created and first filled by reports migration 0003, which holds its SQL, and kept up to date by
+refresh_report_data().
+"""
+
+NUTRIENT_HISTOGRAMS = 'nutrient_histograms'
+
+
+class HistogramNutrient(NamedTuple):
+    label: str
+    expression: str  # SQL over product_analytics columns
+    low: float
+    high: float
+    bins: int
+    daily_value: bool = True
+
+    @property
+    def width(self) -> float:
+        return (self.high - self.low) / self.bins
+
+    def bin_centers(self) -> pd.Series:
+        """ Value at the middle of each in-range bin, indexed by bin number """
+        bins = pd.RangeIndex(1, self.bins + 1)
+        return pd.Series(self.low + (bins - 0.5) * self.width, index=bins)
+
+
+# Daily values are stored as fractions; sugar has no daily value, so grams / 100 stands in for one like in the reports
+HISTOGRAM_NUTRIENTS = {
+    'calories': HistogramNutrient('Calories', 'calories', 0, 1000, 100, daily_value=False),
+    'sodium_dv': HistogramNutrient('Sodium', 'sodium_dv', 0, 1, 100),
+    'totalfat_dv': HistogramNutrient('Total Fat', 'totalfat_dv', 0, 1, 100),
+    'saturatedfat_dv': HistogramNutrient('Saturated Fat', 'saturatedfat_dv', 0, 1, 100),
+    'cholesterol_dv': HistogramNutrient('Cholesterol', 'cholesterol_dv', 0, 1, 100),
+    'totalcarbohydrate_dv': HistogramNutrient('Carbohydrate', 'totalcarbohydrate_dv', 0, 1, 100),
+    'dietaryfiber_dv': HistogramNutrient('Fibre', 'dietaryfiber_dv', 0, 1, 100),
+    'sugar': HistogramNutrient('Sugar', 'sugar / 100.0', 0, 1, 100),
+    'protein': HistogramNutrient('Protein (g)', 'protein', 0, 50, 100, daily_value=False),
+}
+
+
+def _insert_histograms_sql(stores: bool) -> str:
+    expressions = ',\n               '.join(f'{n.expression} AS {name}' for name, n in HISTOGRAM_NUTRIENTS.items())
+    selects = '\n        UNION ALL\n'.join(f'''
+        SELECT '{name}', category_text, subcategory_text, store,
+               width_bucket({name}::float8, {n.low}, {n.high}, {n.bins}) AS bin, COUNT(*), MAX(batch_id)
+        FROM products
+        WHERE {name} IS NOT NULL
+        GROUP BY category_text, subcategory_text, store, bin''' for name, n in HISTOGRAM_NUTRIENTS.items())
+    return f'''
+        WITH products AS (
+            SELECT DISTINCT ON (store, name) store, COALESCE(category_text, '') AS category_text,
+                   COALESCE(subcategory_text, '') AS subcategory_text, batch_id,
+                   {expressions}
+            FROM product_analytics
+            WHERE store IS NOT NULL AND (category_text IS NULL
+                                         OR category_text NOT IN ('Unknown', 'Not Food', 'Uncategorized'))
+                  {'AND store = ANY(%s)' if stores else ''}
+            ORDER BY store, name, product_id
+        )
+        INSERT INTO {NUTRIENT_HISTOGRAMS} (nutrient, category_text, subcategory_text, store, bin, count, batch_id)
+        {selects}
+    '''
+
+
+def update_nutrient_histograms(stores: [str] = None) -> int:
+    """
+    Recomputes the histograms of the given stores (all of them by default) from product_analytics, which must already
+    be refreshed. Returns the number of rows changed, i.e. those deleted plus those inserted.
+    """
+    if stores is None:
+        statements = [(f'DELETE FROM {NUTRIENT_HISTOGRAMS}', None), (_insert_histograms_sql(stores=False), None)]
+    else:
+        statements = [(f'DELETE FROM {NUTRIENT_HISTOGRAMS} WHERE store = ANY(%s)', [list(stores)]),
+                      (_insert_histograms_sql(stores=True), [list(stores)])]
+
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for sql, params in statements:
+            cursor.execute(sql, params)
+            count += max(cursor.rowcount, 0)
+    return count
+
+
+def read_nutrient_histograms(nutrient: str, by: str = None, category: str = None, subcategory: str = None,
+                             store: str = None) -> pd.DataFrame:
+    """
+    Counts per bin of one nutrient for the products matching the given filters, with a column per value of by
+    ('category_text', 'subcategory_text' or 'store'), or a single 'count' column. Every bin from 0 to bins + 1 is
+    present.
+    """
+    spec = HISTOGRAM_NUTRIENTS[nutrient]
+    group = ['bin'] + ([by] if by is not None else [])
+    if by is not None and by not in ('category_text', 'subcategory_text', 'store'):
+        raise ValueError(f'Unknown histogram grouping {by}')
+
+    sql = f'SELECT {", ".join(group)}, SUM(count) AS count FROM {NUTRIENT_HISTOGRAMS} WHERE nutrient = %s'
+    params = [nutrient]
+    for column, value in (('category_text', category), ('subcategory_text', subcategory), ('store', store)):
+        if value is not None:
+            sql += f' AND {column} = %s'
+            params.append(value)
+    sql += f' GROUP BY {", ".join(group)}'
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        df = pd.DataFrame(cursor.fetchall(), columns=[c[0] for c in cursor.description])
+
+    bins = pd.RangeIndex(0, spec.bins + 2, name='bin')
+    if by is None:
+        return df.set_index('bin')[['count']].astype(int).reindex(bins, fill_value=0)
+    return df.pivot(index='bin', columns=by, values='count').reindex(bins).fillna(0).astype(int)
+
+
+def histogram_quantile(counts: pd.Series, nutrient: str, q: float) -> float:
+    """ Estimates a quantile of the binned values, taking the upper edge of the bin it falls in """
+    spec = HISTOGRAM_NUTRIENTS[nutrient]
+    total = counts.sum()
+    if total == 0:
+        return float('nan')
+    position = counts.cumsum().searchsorted(q * total)
+    edge = spec.low + counts.index[min(position, len(counts) - 1)] * spec.width
+    return float(min(max(edge, spec.low), spec.high))
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from flaim.database.product_mappings import PRODUCT_STORES
+from flaim.reports.datasets import export_dataset
+
+
+class Command(BaseCommand):
+    help = 'Export the full product dataset (products, nutrition facts, categories and image paths) as Parquet, ' \
+           'partitioned by store and scrape date. Only scrape batches that have not been exported yet are written, ' \
+           'so the command can be re-run after every data load.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--outdir',
+                            type=str,
+                            required=True,
+                            help='Root directory of the Parquet dataset')
+        parser.add_argument('--stores',
+                            type=str,
+                            nargs='+',
+                            default=None,
+                            choices=[x[0] for x in PRODUCT_STORES],
+                            help='Only export scrape batches from these stores e.g. LOBLAWS WALMART')
+        parser.add_argument('--rebuild',
+                            action='store_true',
+                            default=False,
+                            help='Rewrite every partition, e.g. to pick up category changes in older batches')
+        parser.add_argument('--chunk_size',
+                            type=int,
+                            default=10000,
+                            help='Number of rows fetched from the database and written as one row group')
+
+    def handle(self, *args, **options):
+        outdir = Path(options['outdir'])
+        outdir.mkdir(parents=True, exist_ok=True)
+
+        self.stdout.write(self.style.SUCCESS(f'Exporting dataset to {outdir}'))
+        written = export_dataset(outdir, options['stores'], options['rebuild'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Done! Wrote {len(written)} new partitions'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from flaim.reports.analytics import refresh_report_data
+
+
+class Command(BaseCommand):
+    help = 'Refreshes the product_analytics view and other precomputed data read by the report pages. This runs ' \
+           'automatically at the end of every data load.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Refreshing report data...'))
+        refresh_report_data()
+        self.stdout.write(self.style.SUCCESS(f'Done!'))
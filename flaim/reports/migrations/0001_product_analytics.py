@@ -0,0 +1,57 @@
+from django.db import migrations
+
+"""
+Creates the product_analytics materialized view described in flaim.reports.analytics. The SQL is written out here
+rather than built from the models, so this migration stays the same however Product and NutritionFacts change later.
+Adding, removing or renaming a Product or NutritionFacts column the view selects needs a new migration that drops and
+recreates the view with the updated column list (and its indexes).
+"""
+
+CREATE_PRODUCT_ANALYTICS_SQL = [
+    '''CREATE MATERIALIZED VIEW product_analytics AS
+        SELECT p.id AS product_id, p.product_code, p.name, p.brand, p.description, p.variety_pack,
+               p.breadcrumbs_text, p.breadcrumbs_array, p.batch_id, p.store, p.price, p.price_float, p.price_units,
+               p.upc_code, p.upc_array, p.nutrition_available, p.unidentified_nft_format, p.nielsen_product, p.url,
+               p.atwater_result, p.storage, p.manufacturer, p.ultimate_company, p.private_label,
+               COALESCE(c.manual_category, c.predicted_category_1) AS category_text,
+               c.manual_category AS manual_category_text,
+               COALESCE(s.manual_subcategory, s.predicted_subcategory_1) AS subcategory_text,
+               s.manual_subcategory AS manual_subcategory_text, nf.total_size, nf.serving_size_raw, nf.serving_size,
+               nf.serving_size_units, nf.ingredients, nf.ingredients_french, nf.calories, nf.sodium, nf.sodium_dv,
+               nf.calcium, nf.calcium_dv, nf.totalfat, nf.totalfat_dv, nf.monounsaturated_fat,
+               nf.polyunsaturated_fat, nf.omega3fattyacids, nf.omega6fattyacids, nf.saturatedfat, nf.saturatedfat_dv,
+               nf.transfat, nf.transfat_dv, nf.potassium, nf.potassium_dv, nf.totalcarbohydrate,
+               nf.totalcarbohydrate_dv, nf.othercarbohydrates, nf.dietaryfiber, nf.dietaryfiber_dv, nf.sugar,
+               nf.sugar_dv, nf.protein, nf.cholesterol, nf.cholesterol_dv, nf.copper, nf.copper_dv, nf.choline,
+               nf.choline_dv, nf.chromium, nf.chromium_dv, nf.vitamina, nf.vitamina_dv, nf.vitaminc, nf.vitaminc_dv,
+               nf.vitamind, nf.vitamind_dv, nf.vitamine, nf.vitamine_dv, nf.niacin, nf.niacin_dv, nf.vitaminb6,
+               nf.vitaminb6_dv, nf.folacin, nf.folate, nf.folate_dv, nf.vitaminb12, nf.vitaminb12_dv,
+               nf.pantothenicacid, nf.pantothenate, nf.pantothenate_dv, nf.alcohol, nf.alcohol_dv, nf.erythritol,
+               nf.glycerol, nf.isomalt, nf.lactitol, nf.maltitol, nf.mannitol, nf.polydextrose, nf.sorbitol,
+               nf.biotin, nf.biotin_dv, nf.xylitol, nf.iron, nf.iron_dv, nf.riboflavin, nf.riboflavin_dv,
+               nf.selenium, nf.selenium_dv, nf.starch, nf.magnesium, nf.magnesium_dv, nf.manganese, nf.manganese_dv,
+               nf.molybdenum, nf.molybdenum_dv, nf.phosphorus, nf.phosphorus_dv, nf.thiamine, nf.thiamine_dv,
+               nf.zinc, nf.zinc_dv, nf.soluble_fibre, nf.insoluble_fibre, nf.sugar_alcohols, nf.vitamink,
+               nf.vitamink_dv, nf.iodide, nf.iodide_dv, nf.chloride, nf.chloride_dv
+        FROM database_product AS p
+        JOIN database_nutritionfacts AS nf ON nf.product_id = p.id
+        LEFT JOIN database_category AS c ON c.id = p.category_id
+        LEFT JOIN database_subcategory AS s ON s.id = p.subcategory_id
+        WHERE p.most_recent''',
+    # A unique index is what allows the view to be refreshed concurrently
+    'CREATE UNIQUE INDEX product_analytics_product_id ON product_analytics (product_id)',
+    'CREATE INDEX product_analytics_category_text ON product_analytics (category_text)',
+    'CREATE INDEX product_analytics_store ON product_analytics (store)',
+]
+DROP_PRODUCT_ANALYTICS_SQL = 'DROP MATERIALIZED VIEW IF EXISTS product_analytics'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0037_auto_20220721_0836'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_PRODUCT_ANALYTICS_SQL, DROP_PRODUCT_ANALYTICS_SQL),
+    ]
@@ -0,0 +1,82 @@
+from django.db import migrations
+
+"""
+Creates the category_aggregates materialized view described in flaim.reports.aggregates. The SQL is written out here
+rather than imported from that module, so this migration stays the same however the module changes later; changing the
+view's statistics needs a new migration that drops and recreates it.
+"""
+
+CREATE_CATEGORY_AGGREGATES_SQL = [
+    '''CREATE MATERIALIZED VIEW category_aggregates AS
+        WITH products AS (
+            SELECT DISTINCT ON (name) category_text, subcategory_text, store, manual_category_text, atwater_result,
+                   calories, sodium_dv, saturatedfat_dv, sugar / 100.0 AS sugar,
+                   COALESCE(length(ingredients) - length(replace(ingredients, ',', '')) + 1, 1) AS ingredient_count
+            FROM product_analytics
+            WHERE category_text IS NOT NULL AND category_text NOT IN ('Unknown', 'Not Food', 'Uncategorized')
+            ORDER BY name, product_id
+        ), grouped AS (
+            SELECT 'category' AS level, category_text, '' AS subcategory_text,
+                   COUNT(*) AS product_count,
+                   COUNT(DISTINCT store) AS store_count,
+                   COUNT(manual_category_text) AS manual_category_count,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY COALESCE(calories, 0)) AS calories_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY COALESCE(sodium_dv, 0)) AS sodium_dv_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY COALESCE(saturatedfat_dv, 0)) AS saturatedfat_dv_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY COALESCE(sugar, 0)) AS sugar_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY sodium_dv) AS sodium_dv_ranking_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY saturatedfat_dv) AS saturatedfat_dv_ranking_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY sugar) AS sugar_ranking_median,
+                   percentile_cont(0.25) WITHIN GROUP (ORDER BY ingredient_count) AS ingredient_count_q25,
+                   percentile_cont(0.75) WITHIN GROUP (ORDER BY ingredient_count) AS ingredient_count_q75,
+                   COUNT(*) FILTER (WHERE atwater_result = 'Within Threshold') AS atwater_pass,
+                   COUNT(*) FILTER (WHERE atwater_result = 'Investigation Required') AS atwater_fail,
+                   COUNT(*) FILTER (WHERE atwater_result = 'Missing Information') AS atwater_missing
+            FROM products
+            GROUP BY category_text
+            UNION ALL
+            SELECT 'subcategory' AS level, category_text, subcategory_text,
+                   COUNT(*) AS product_count,
+                   COUNT(DISTINCT store) AS store_count,
+                   COUNT(manual_category_text) AS manual_category_count,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY COALESCE(calories, 0)) AS calories_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY COALESCE(sodium_dv, 0)) AS sodium_dv_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY COALESCE(saturatedfat_dv, 0)) AS saturatedfat_dv_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY COALESCE(sugar, 0)) AS sugar_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY sodium_dv) AS sodium_dv_ranking_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY saturatedfat_dv) AS saturatedfat_dv_ranking_median,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY sugar) AS sugar_ranking_median,
+                   percentile_cont(0.25) WITHIN GROUP (ORDER BY ingredient_count) AS ingredient_count_q25,
+                   percentile_cont(0.75) WITHIN GROUP (ORDER BY ingredient_count) AS ingredient_count_q75,
+                   COUNT(*) FILTER (WHERE atwater_result = 'Within Threshold') AS atwater_pass,
+                   COUNT(*) FILTER (WHERE atwater_result = 'Investigation Required') AS atwater_fail,
+                   COUNT(*) FILTER (WHERE atwater_result = 'Missing Information') AS atwater_missing
+            FROM products
+            WHERE subcategory_text IS NOT NULL
+            GROUP BY category_text, subcategory_text
+        )
+        SELECT *,
+               ROW_NUMBER() OVER (PARTITION BY level, CASE WHEN level = 'subcategory' THEN category_text END
+                                  ORDER BY sodium_dv_ranking_median DESC NULLS LAST, category_text,
+                                           subcategory_text) - 1 AS sodium_rank,
+               ROW_NUMBER() OVER (PARTITION BY level, CASE WHEN level = 'subcategory' THEN category_text END
+                                  ORDER BY saturatedfat_dv_ranking_median DESC NULLS LAST, category_text,
+                                           subcategory_text) - 1 AS fat_rank,
+               ROW_NUMBER() OVER (PARTITION BY level, CASE WHEN level = 'subcategory' THEN category_text END
+                                  ORDER BY sugar_ranking_median DESC NULLS LAST, category_text,
+                                           subcategory_text) - 1 AS sugar_rank
+        FROM grouped''',
+    'CREATE UNIQUE INDEX category_aggregates_key ON category_aggregates (level, category_text, subcategory_text)',
+]
+DROP_CATEGORY_AGGREGATES_SQL = 'DROP MATERIALIZED VIEW IF EXISTS category_aggregates'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0001_product_analytics'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_CATEGORY_AGGREGATES_SQL, DROP_CATEGORY_AGGREGATES_SQL),
+    ]
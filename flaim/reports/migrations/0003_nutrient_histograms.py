@@ -0,0 +1,109 @@
+from django.db import migrations
+
+"""
+Creates the nutrient_histograms table described in flaim.reports.histograms and fills it from product_analytics. The
+SQL is written out here rather than imported from that module, so this migration stays the same however the module's
+nutrients and bins change later; refresh_report_data() recomputes the rows with the current bins after the next load.
+"""
+
+CREATE_NUTRIENT_HISTOGRAMS_SQL = [
+    '''CREATE TABLE nutrient_histograms (
+            nutrient varchar(50) NOT NULL,
+            category_text text NOT NULL,
+            subcategory_text text NOT NULL,
+            store varchar(50) NOT NULL,
+            bin integer NOT NULL,
+            count integer NOT NULL,
+            batch_id integer,
+            PRIMARY KEY (nutrient, category_text, subcategory_text, store, bin)
+        )''',
+    'CREATE INDEX nutrient_histograms_store ON nutrient_histograms (store)',
+]
+DROP_NUTRIENT_HISTOGRAMS_SQL = 'DROP TABLE IF EXISTS nutrient_histograms'
+
+FILL_NUTRIENT_HISTOGRAMS_SQL = '''
+    WITH products AS (
+        SELECT DISTINCT ON (store, name) store, COALESCE(category_text, '') AS category_text,
+               COALESCE(subcategory_text, '') AS subcategory_text, batch_id,
+               calories AS calories,
+               sodium_dv AS sodium_dv,
+               totalfat_dv AS totalfat_dv,
+               saturatedfat_dv AS saturatedfat_dv,
+               cholesterol_dv AS cholesterol_dv,
+               totalcarbohydrate_dv AS totalcarbohydrate_dv,
+               dietaryfiber_dv AS dietaryfiber_dv,
+               sugar / 100.0 AS sugar,
+               protein AS protein
+        FROM product_analytics
+        WHERE store IS NOT NULL AND (category_text IS NULL
+                                     OR category_text NOT IN ('Unknown', 'Not Food', 'Uncategorized'))
+        ORDER BY store, name, product_id
+    )
+    INSERT INTO nutrient_histograms (nutrient, category_text, subcategory_text, store, bin, count, batch_id)
+    SELECT 'calories', category_text, subcategory_text, store,
+           width_bucket(calories::float8, 0, 1000, 100) AS bin, COUNT(*), MAX(batch_id)
+    FROM products
+    WHERE calories IS NOT NULL
+    GROUP BY category_text, subcategory_text, store, bin
+    UNION ALL
+    SELECT 'sodium_dv', category_text, subcategory_text, store,
+           width_bucket(sodium_dv::float8, 0, 1, 100) AS bin, COUNT(*), MAX(batch_id)
+    FROM products
+    WHERE sodium_dv IS NOT NULL
+    GROUP BY category_text, subcategory_text, store, bin
+    UNION ALL
+    SELECT 'totalfat_dv', category_text, subcategory_text, store,
+           width_bucket(totalfat_dv::float8, 0, 1, 100) AS bin, COUNT(*), MAX(batch_id)
+    FROM products
+    WHERE totalfat_dv IS NOT NULL
+    GROUP BY category_text, subcategory_text, store, bin
+    UNION ALL
+    SELECT 'saturatedfat_dv', category_text, subcategory_text, store,
+           width_bucket(saturatedfat_dv::float8, 0, 1, 100) AS bin, COUNT(*), MAX(batch_id)
+    FROM products
+    WHERE saturatedfat_dv IS NOT NULL
+    GROUP BY category_text, subcategory_text, store, bin
+    UNION ALL
+    SELECT 'cholesterol_dv', category_text, subcategory_text, store,
+           width_bucket(cholesterol_dv::float8, 0, 1, 100) AS bin, COUNT(*), MAX(batch_id)
+    FROM products
+    WHERE cholesterol_dv IS NOT NULL
+    GROUP BY category_text, subcategory_text, store, bin
+    UNION ALL
+    SELECT 'totalcarbohydrate_dv', category_text, subcategory_text, store,
+           width_bucket(totalcarbohydrate_dv::float8, 0, 1, 100) AS bin, COUNT(*), MAX(batch_id)
+    FROM products
+    WHERE totalcarbohydrate_dv IS NOT NULL
+    GROUP BY category_text, subcategory_text, store, bin
+    UNION ALL
+    SELECT 'dietaryfiber_dv', category_text, subcategory_text, store,
+           width_bucket(dietaryfiber_dv::float8, 0, 1, 100) AS bin, COUNT(*), MAX(batch_id)
+    FROM products
+    WHERE dietaryfiber_dv IS NOT NULL
+    GROUP BY category_text, subcategory_text, store, bin
+    UNION ALL
+    SELECT 'sugar', category_text, subcategory_text, store,
+           width_bucket(sugar::float8, 0, 1, 100) AS bin, COUNT(*), MAX(batch_id)
+    FROM products
+    WHERE sugar IS NOT NULL
+    GROUP BY category_text, subcategory_text, store, bin
+    UNION ALL
+    SELECT 'protein', category_text, subcategory_text, store,
+           width_bucket(protein::float8, 0, 50, 100) AS bin, COUNT(*), MAX(batch_id)
+    FROM products
+    WHERE protein IS NOT NULL
+    GROUP BY category_text, subcategory_text, store, bin
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0002_category_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_NUTRIENT_HISTOGRAMS_SQL, DROP_NUTRIENT_HISTOGRAMS_SQL),
+        # Reversed by dropping the table
+        migrations.RunSQL(FILL_NUTRIENT_HISTOGRAMS_SQL, migrations.RunSQL.noop),
+    ]
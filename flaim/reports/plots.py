@@ -1,48 +1,66 @@
+from itertools import cycle
 from textwrap import wrap
 
 import pandas as pd
-import plotly.figure_factory as ff
 import plotly.graph_objects as go
-from numpy.linalg import LinAlgError
 from plotly.express.colors import qualitative
 from plotly.io import to_html
 
+from flaim.reports.histograms import HistogramNutrient
 
-def nutrient_distribution_plot(df: pd.DataFrame):
-    nutrients = ['sodium_dv', 'saturatedfat_dv', 'sugar']
 
-    try:
-        fig = ff.create_distplot(df[nutrients].dropna(how='all').fillna(0).T.values,
-                                 ['Sodium', 'Saturated Fat', 'Sugar'], colors=qualitative.Vivid, histnorm='probability',
-                                 bin_size=0.01, show_rug=False, )
-        fig.update_layout(
-            width=1100,
-            font_size=18,
-            xaxis=dict(
-                title='Daily Value',
-                tickformat='%',
-                showgrid=True,
-                range=[0, min([1, max(df[n].quantile(0.95) for n in nutrients)])]
-            ),
-            yaxis=dict(
-                tickformat='%',
-                title='Proportion of Products'
-            ),
-            margin=dict(
-                l=100,
-                r=20,
-                b=30,
-                t=30,
-            ),
-            legend_title='Nutrients'
-        )
+def nutrient_histogram_plot(histograms: pd.DataFrame, nutrient: HistogramNutrient, threshold: float = 0.15,
+                            legend_title: str = 'Nutrients'):
+    """
+    Plots binned counts from flaim.reports.histograms as the proportion of products in each bin, one trace per column
+    of histograms. Every column must be binned like nutrient. Values outside the nutrient's range count towards the
+    proportions but aren't drawn. A vertical line marks threshold for daily value nutrients.
+    """
+    totals = histograms.sum()
+    if not totals.any():
+        return "Not enough data to generate graph."
+    proportions = histograms / totals.where(totals > 0)
+    centers = nutrient.bin_centers()
+
+    # Cut the axis off at the 95th percentile of the widest trace like the old density plots did
+    reaching = (proportions.cumsum() >= 0.95).idxmax()
+    upper = min(nutrient.high, nutrient.low + max(reaching.max(), 1) * nutrient.width)
+
+    data = [go.Bar(name=str(column), x=centers, y=proportions.loc[centers.index, column], width=nutrient.width,
+                   marker_color=color, opacity=0.7)
+            for column, color in zip(proportions.columns, cycle(qualitative.Vivid))]
+
+    fig = go.Figure(data=data)
+    fig.update_layout(
+        width=1100,
+        font_size=18,
+        barmode='overlay',
+        xaxis=dict(
+            title='Daily Value' if nutrient.daily_value else nutrient.label,
+            tickformat='%' if nutrient.daily_value else None,
+            showgrid=True,
+            range=[nutrient.low, upper]
+        ),
+        yaxis=dict(
+            tickformat='%',
+            title='Proportion of Products'
+        ),
+        margin=dict(
+            l=100,
+            r=20,
+            b=30,
+            t=30,
+        ),
+        legend_title=legend_title
+    )
 
+    if nutrient.daily_value and threshold is not None:
         fig.add_shape(dict(
             type='line',
             yref='paper',
-            x0=0.15,
+            x0=threshold,
             y0=0,
-            x1=0.15,
+            x1=threshold,
             y1=1,
             line=dict(
                 color='Black',
@@ -51,22 +69,18 @@ def nutrient_distribution_plot(df: pd.DataFrame):
 
         fig.add_annotation(text='← Low in Nutrient',
                            yref='paper',
-                           x=0.145, y=1,
+                           x=threshold - 0.005, y=1,
                            showarrow=False,
                            xanchor='right',
                            yanchor='bottom',
                            font_color='green')
         fig.add_annotation(text='High in Nutrient →',
                            yref='paper',
-                           x=0.155, y=1,
+                           x=threshold + 0.005, y=1,
                            showarrow=False,
                            xanchor='left',
                            yanchor='bottom',
                            font_color='red')
-    except LinAlgError:
-        return "Graph can't be displayed."
-    except ValueError:
-        return "Not enough data to generate graph."
 
     return to_html(fig, include_plotlyjs=False, full_html=False)
 
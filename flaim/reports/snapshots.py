@@ -0,0 +1,73 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import pyarrow.feather as feather
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+"""
+Columnar snapshots of the report dataset. After each refresh the product_analytics rows are written to an uncompressed
+Arrow IPC (Feather v2) file, which report workers memory-map rather than querying Postgres. Pages of a mapped file are
+shared through the OS page cache by every worker on the box, and columns without nulls are handed to pandas without
+copying.
+
+Snapshots are written under a versioned name and published by atomically replacing the product_analytics.arrow
+symlink, so readers always see a complete file. Workers that already mapped the previous snapshot keep reading it until
+they pick up the new data version. With REPORT_SNAPSHOTS = False reports read from the database instead.
+"""
+
+SNAPSHOT_NAME = 'product_analytics.arrow'
+KEEP_SNAPSHOTS = 2
+
+
+def snapshots_enabled() -> bool:
+    return getattr(settings, 'REPORT_SNAPSHOTS', True)
+
+
+def snapshot_dir() -> Path:
+    """
+    REPORT_SNAPSHOT_DIR, which has to be outside MEDIA_ROOT: snapshots hold the full report dataset, and the web server
+    serves MEDIA_ROOT to anyone
+    """
+    path = Path(getattr(settings, 'REPORT_SNAPSHOT_DIR', Path(tempfile.gettempdir()) / 'flaim_snapshots')).resolve()
+    media_root = Path(settings.MEDIA_ROOT).resolve()
+    if path == media_root or media_root in path.parents:
+        raise ImproperlyConfigured(f'REPORT_SNAPSHOT_DIR ({path}) must not be inside MEDIA_ROOT ({media_root})')
+    return path
+
+
+def write_snapshot(df: pd.DataFrame, version: int) -> Path:
+    """ Writes df as snapshot version and makes it the current snapshot. Returns the path of the published file. """
+    outdir = snapshot_dir()
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    path = outdir / f'product_analytics.{version}.arrow'
+    tmp_path = path.with_suffix('.tmp')
+    # Uncompressed so readers can memory-map the buffers directly
+    feather.write_feather(df.reset_index(drop=True), str(tmp_path), compression='uncompressed')
+    os.replace(tmp_path, path)
+
+    link = outdir / SNAPSHOT_NAME
+    tmp_link = outdir / f'{SNAPSHOT_NAME}.tmp'
+    if tmp_link.is_symlink():
+        tmp_link.unlink()
+    tmp_link.symlink_to(path.name)
+    os.replace(tmp_link, link)
+
+    # Readers hold an open mapping of older files, so removing them only frees the space once those readers move on
+    for old in sorted(outdir.glob('product_analytics.*.arrow'), key=os.path.getmtime)[:-KEEP_SNAPSHOTS]:
+        if old.resolve() != path.resolve():
+            old.unlink()
+    return path
+
+
+def read_snapshot(columns: [str] = None) -> Optional[pd.DataFrame]:
+    """ Memory-maps the current snapshot and returns it (optionally only some columns), or None if there isn't one """
+    path = snapshot_dir() / SNAPSHOT_NAME
+    if not snapshots_enabled() or not path.exists():
+        return None
+    table = feather.read_table(str(path), columns=columns, memory_map=True)
+    return table.to_pandas(split_blocks=True)
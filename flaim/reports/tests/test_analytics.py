@@ -0,0 +1,18 @@
+import django_rq
+from django.core.cache import cache
+
+from flaim.reports.analytics import schedule_report_refresh, REFRESH_PENDING_KEY
+
+
+class BrokenQueue:
+    def enqueue(self, *args, **kwargs):
+        raise ConnectionError('Redis is down')
+
+
+def test_failed_refresh_enqueue_is_not_raised(monkeypatch):
+    cache.delete(REFRESH_PENDING_KEY)
+    monkeypatch.setattr(django_rq, 'get_queue', lambda name: BrokenQueue())
+    # Outside a transaction the on_commit callback runs straight away
+    schedule_report_refresh()
+    # Not left pending, so the next edit tries again
+    assert cache.get(REFRESH_PENDING_KEY) is None
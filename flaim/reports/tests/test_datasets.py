@@ -0,0 +1,45 @@
+import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from flaim.database.models import Product, NutritionFacts, ScrapeBatch
+from flaim.reports.datasets import dataset_schema, export_dataset, partition_path, unbatched_partition_path
+
+
+def test_dataset_types():
+    columns = ['id', 'brand', 'name', 'sodium_dv', 'calories', 'breadcrumbs_array', 'image_paths', 'created']
+    schema = dataset_schema(columns)
+    assert schema.field('id').type == pa.int64()
+    assert pa.types.is_dictionary(schema.field('brand').type)
+    assert schema.field('name').type == pa.string()
+    assert schema.field('sodium_dv').type == pa.float32()
+    assert schema.field('calories').type == pa.int32()
+    assert schema.field('breadcrumbs_array').type == pa.list_(pa.string())
+    assert schema.field('image_paths').type == pa.list_(pa.string())
+
+
+@pytest.mark.django_db
+def test_export_dataset(tmp_path):
+    batch = ScrapeBatch.objects.create(store='LOBLAWS', scrape_date=datetime.date(2021, 1, 15))
+    chips = Product.objects.create(product_code='1', name='Chips', brand='No Name', store='LOBLAWS', batch=batch,
+                                   breadcrumbs_array=['Snacks', 'Chips'])
+    NutritionFacts.objects.create(product=chips, sodium_dv=0.12, calories=150)
+    Product.objects.create(product_code='2', name='Soda', store='LOBLAWS', batch=batch)
+    Product.objects.create(product_code='3', name='Crackers', store='LOBLAWS')
+
+    written = export_dataset(tmp_path)
+    assert written == [partition_path(tmp_path, batch), unbatched_partition_path(tmp_path, 'LOBLAWS')]
+    assert str(written[0].relative_to(tmp_path)) == f'store=LOBLAWS/scrape_date=2021-01-15/batch_{batch.id}.parquet'
+    assert str(written[1].relative_to(tmp_path)) == 'store=LOBLAWS/scrape_date=unknown/batch_unknown.parquet'
+
+    df = pq.read_table(str(written[0])).to_pandas()
+    assert list(df['name']) == ['Chips', 'Soda']
+    assert 'store' not in df.columns and 'most_recent' not in df.columns
+    assert df['brand'].dtype.name == 'category'
+    assert df['sodium_dv'].dtype.name == 'float32'
+    assert list(pq.read_table(str(written[1])).to_pandas()['name']) == ['Crackers']
+
+    # Partitions are only written once
+    assert export_dataset(tmp_path) == []
@@ -0,0 +1,22 @@
+from django.core.cache import cache
+
+from flaim.reports.cache import cached_figure, bump_data_version
+
+
+def test_figure_rendered_once_per_version():
+    cache.clear()
+    calls = []
+
+    def build():
+        calls.append(1)
+        return f'<div>{len(calls)}</div>'
+
+    assert cached_figure('test', build, 'Beverages') == '<div>1</div>'
+    assert cached_figure('test', build, 'Beverages') == '<div>1</div>'
+    assert len(calls) == 1
+
+    # Different filters are different figures
+    assert cached_figure('test', build, 'Snacks') == '<div>2</div>'
+
+    bump_data_version()
+    assert cached_figure('test', build, 'Beverages') == '<div>3</div>'
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from flaim.reports.histograms import HISTOGRAM_NUTRIENTS, histogram_quantile
+from flaim.reports.plots import nutrient_histogram_plot
+
+
+def test_histogram_quantile():
+    sodium = HISTOGRAM_NUTRIENTS['sodium_dv']
+    counts = pd.Series(0, index=pd.RangeIndex(0, sodium.bins + 2))
+    counts[5] = 10  # values in [0.04, 0.05)
+    counts[20] = 10  # values in [0.19, 0.20)
+    assert histogram_quantile(counts, 'sodium_dv', 0.25) == 0.05
+    assert histogram_quantile(counts, 'sodium_dv', 0.75) == 0.2
+    assert pd.isnull(histogram_quantile(counts * 0, 'sodium_dv', 0.5))
+
+
+def test_nutrient_histogram_plot():
+    sodium = HISTOGRAM_NUTRIENTS['sodium_dv']
+    histograms = pd.DataFrame({'LOBLAWS': 0, 'WALMART': 0}, index=pd.RangeIndex(0, sodium.bins + 2))
+    assert nutrient_histogram_plot(histograms, sodium) == "Not enough data to generate graph."
+
+    histograms.loc[[3, 30], 'LOBLAWS'] = 5
+    histograms.loc[sodium.bins + 1, 'WALMART'] = 1
+    html = nutrient_histogram_plot(histograms, sodium)
+    assert 'LOBLAWS' in html and 'WALMART' in html
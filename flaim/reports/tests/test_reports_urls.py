@@ -18,3 +18,8 @@ def test_store_report():
         == f"/reports/store/Loblaws/"
     )
     assert resolve(f"/reports/store/Loblaws/").view_name == "reports:store_report"
+
+
+def test_nutrient_report():
+    assert reverse("reports:nutrient_report") == "/reports/nutrient/"
+    assert resolve("/reports/nutrient/").view_name == "reports:nutrient_report"
@@ -39,10 +39,8 @@ def build_top_x_sentence(s: pd.Series, x):
     return sen_par[0] + ', and ' + sen_par[-1]
 
 
-# This gets the 3 most common ingredients but does not preprocess the ingredient lists
-def build_top_ingredient_sentence(ingredients: pd.Series):
-    common_ingredients = pd.Series(' '.join(ingredients.fillna('').str.lower().tolist())
-                                   .split(',')).value_counts().head(3).index.tolist()
+# Takes the most common ingredients of a (sub)category, as stored in the top_ingredients column of category_aggregates
+def build_top_ingredient_sentence(common_ingredients: list):
     if len(common_ingredients) >= 3:
         return f'The three most common ingredients in this category are \
                 {common_ingredients[0]}, {common_ingredients[1]}, and {common_ingredients[2]}.'
@@ -4,12 +4,16 @@ from urllib.parse import unquote
 import numpy as np
 import pandas as pd
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404
 from django.views.generic import TemplateView
 
 from flaim.database.product_mappings import PRODUCT_STORES, REFERENCE_CATEGORIES_DICT, \
     REFERENCE_SUBCATEGORIES_CODING_DICT
-from flaim.reports.data import ReportData, StoreReportData
-from flaim.reports.plots import nutrient_distribution_plot, category_nutrient_distribution_plot
+from flaim.reports.aggregates import read_category_aggregates
+from flaim.reports.data import StoreReportData
+from flaim.reports.figures import category_distribution_figure, store_distribution_figure
+from flaim.reports.histograms import HISTOGRAM_NUTRIENTS, read_nutrient_histograms, histogram_quantile
+from flaim.reports.plots import nutrient_histogram_plot
 from flaim.reports.util import nutrient_color, rank_suffix, build_top_x_sentence, make_list, \
     build_top_ingredient_sentence
 
@@ -19,45 +23,83 @@ class ProductView(LoginRequiredMixin, TemplateView):
 
 
 class NutrientView(LoginRequiredMixin, TemplateView):
-    template_name = 'reports_base.html'
+    template_name = 'reports/nutrient_report.html'
+    groupings = {'store': 'Store', 'category_text': 'Category', 'subcategory_text': 'Subcategory'}
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['nutrients'] = [(name, n.label) for name, n in HISTOGRAM_NUTRIENTS.items()]
+        context['product_categories'] = REFERENCE_CATEGORIES_DICT.keys()
+        context['product_stores'] = [x[0] for x in PRODUCT_STORES]
+        context['groupings'] = self.groupings.items()
+
+        # Filters come from the query string, e.g. /reports/nutrient/?nutrient=sugar&category=Snacks&by=store
+        context['nutrient'] = self.request.GET.get('nutrient', 'sodium_dv')
+        if context['nutrient'] not in HISTOGRAM_NUTRIENTS:
+            raise Http404(f'No nutrient called {context["nutrient"]}')
+        nutrient = HISTOGRAM_NUTRIENTS[context['nutrient']]
+        context['nutrient_label'] = nutrient.label
+        for key in ('category', 'store', 'by'):
+            context[key] = self.request.GET.get(key) or None
+        if context['by'] not in self.groupings:
+            context['by'] = None
+
+        histograms = read_nutrient_histograms(context['nutrient'], by=context['by'], category=context['category'],
+                                              store=context['store'])
+        counts = histograms.sum(axis=1)
+        context['product_count'] = int(counts.sum())
+        median = histogram_quantile(counts, context['nutrient'], 0.5)
+        if context['product_count'] == 0:
+            context['median'] = '-'
+        elif nutrient.daily_value:
+            context['median'] = f'{median * 100:.0f}%'
+            context['median_color'] = nutrient_color(median)
+            # Bins are right-open, so the ones past the threshold hold the products at or over 15% DV
+            over = int(counts.loc[counts.index > round((0.15 - nutrient.low) / nutrient.width)].sum())
+            context['over_15'] = f'{over / context["product_count"] * 100:.0f}%'
+        else:
+            context['median'] = f'{median:.0f}'
 
-def category_context_builder(df: pd.DataFrame, context: dict):
-    ingredient_count = df['ingredients'].str.findall(',').fillna('').apply(lambda row: len(row) + 1)
-    context['ingredient_q25'] = int(ingredient_count.quantile(0.25))
-    context['ingredient_q75'] = int(ingredient_count.quantile(0.75))
-    context['common_ingredients'] = build_top_ingredient_sentence(df['ingredients'])
-    atwater_results = df.atwater_result.value_counts().to_dict()
-    if 'Within Threshold' not in atwater_results:
-        atwater_results['Within Threshold'] = 0
-    context['atwater_pass'] = atwater_results['Within Threshold']
-    if 'Investigation Required' not in atwater_results:
-        atwater_results['Investigation Required'] = 0
-    context['atwater_fail'] = atwater_results['Investigation Required']
-    if 'Missing Information' not in atwater_results:
-        atwater_results['Missing Information'] = 0
-    context['atwater_missing'] = atwater_results['Missing Information']
+        if context['by'] is None:
+            histograms.columns = [nutrient.label]
+        context['figure1'] = nutrient_histogram_plot(histograms, nutrient,
+                                                     legend_title=self.groupings.get(context['by'], 'Nutrient'))
+        return context
+
+
+def category_context_builder(context: dict, stats: pd.Series):
+    """ Fills in the report context from the row of category_aggregates for one (sub)category """
+    context['ingredient_q25'] = int(stats.ingredient_count_q25)
+    context['ingredient_q75'] = int(stats.ingredient_count_q75)
+    context['common_ingredients'] = build_top_ingredient_sentence(list(stats.top_ingredients))
+    context['atwater_pass'] = int(stats.atwater_pass)
+    context['atwater_fail'] = int(stats.atwater_fail)
+    context['atwater_missing'] = int(stats.atwater_missing)
 
     # Top bar
     context['image'] = context['category'].lower()
-    context['product_count'] = df.shape[0]
-    context['store_count'] = df['store'].nunique()
-    context['manual_category_count'] = df['manual_category_text'].dropna().shape[0]
+    context['product_count'] = int(stats.product_count)
+    context['store_count'] = int(stats.store_count)
+    context['manual_category_count'] = int(stats.manual_category_count)
     context['predicted_category_count'] = context['product_count'] - context['manual_category_count']
 
-    context['calorie_median'] = f'{df.calories.fillna(0).median():.0f}'
+    context['calorie_median'] = f'{stats.calories_median:.0f}'
+
+    context['sodium_color'] = nutrient_color(stats.sodium_dv_median)
+    context['sodium_median'] = f'{stats.sodium_dv_median * 100:.0f}%'
 
-    context['sodium_color'] = nutrient_color(df.sodium_dv.fillna(0).median())
-    context['sodium_median'] = f'{df.sodium_dv.fillna(0).median() * 100:.0f}%'
+    context['fat_color'] = nutrient_color(stats.saturatedfat_dv_median)
+    context['fat_median'] = f'{stats.saturatedfat_dv_median * 100:.0f}%'
 
-    context['fat_color'] = nutrient_color(df.saturatedfat_dv.fillna(0).median())
-    context['fat_median'] = f'{df.saturatedfat_dv.fillna(0).median() * 100:.0f}%'
+    context['sugar_color'] = nutrient_color(stats.sugar_median)
+    context['sugar_median'] = f'{stats.sugar_median * 100:.0f}%'
 
-    context['sugar_color'] = nutrient_color(df.sugar.fillna(0).median())
-    context['sugar_median'] = f'{df.sugar.fillna(0).median() * 100:.0f}%'
+    context['sodium_rank'] = rank_suffix(int(stats.sodium_rank))
+    context['fat_rank'] = rank_suffix(int(stats.fat_rank))
+    context['sugar_rank'] = rank_suffix(int(stats.sugar_rank))
 
     # Visualizations
-    context['figure1'] = nutrient_distribution_plot(df)
+    context['figure1'] = category_distribution_figure(context['category'], context.get('subcategory'))
     return
 
 
@@ -66,8 +108,6 @@ class SubcategoryView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        data = ReportData()
-        df = data.df.copy()  # temp copy
 
         context['subcategory'] = self.kwargs['subcategory']
         # Figure out parent category for image display
@@ -75,25 +115,16 @@ class SubcategoryView(LoginRequiredMixin, TemplateView):
             if self.kwargs['subcategory'] in subcategories:
                 context['category'] = category
                 context['image'] = category.lower()
+        all_subcategories = read_category_aggregates('subcategory')
         subcategories = list(
-            set(REFERENCE_SUBCATEGORIES_CODING_DICT.values()).intersection(set(df['subcategory_text'].unique())))
+            set(REFERENCE_SUBCATEGORIES_CODING_DICT.values()).intersection(set(all_subcategories.index)))
         subcategories.sort()
         context['subcategories'] = subcategories
 
-        df = df.loc[df['category_text'] == context['category']]
+        aggregates = all_subcategories.loc[all_subcategories['category_text'] == context['category']]
+        context['category_count'] = len(aggregates)
 
-        context['category_count'] = df['subcategory_text'].nunique()
-        medians = df.groupby('subcategory_text').median()
-
-        context['sodium_rank'] = rank_suffix(medians.sort_values(by='sodium_dv', ascending=False)
-                                             .index.get_loc(context['subcategory']))
-        context['fat_rank'] = rank_suffix(medians.sort_values(by='saturatedfat_dv', ascending=False)
-                                          .index.get_loc(context['subcategory']))
-        context['sugar_rank'] = rank_suffix(medians.sort_values(by='sugar', ascending=False)
-                                            .index.get_loc(context['subcategory']))
-
-        df = df.loc[df['subcategory_text'] == context['subcategory']]
-        category_context_builder(df, context)
+        category_context_builder(context, aggregates.loc[context['subcategory']])
         return context
 
 
@@ -102,29 +133,19 @@ class CategoryView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        data = ReportData()
-        df = data.df.copy()  # temp copy
+        aggregates = read_category_aggregates('category')
         context['product_categories'] = REFERENCE_CATEGORIES_DICT.keys()
 
         # set default category
         if 'category' not in self.kwargs:
-            context['category'] = df['category_text'].value_counts().index[0]
+            context['category'] = aggregates['product_count'].idxmax()
         else:
             # pulls category from URL e.g. /reports/category/Beverages
             context['category'] = unquote(self.kwargs['category'])
 
-        context['category_count'] = df['category_text'].nunique()
-        medians = df.groupby('category_text').median()
-
-        context['sodium_rank'] = rank_suffix(medians.sort_values(by='sodium_dv', ascending=False)
-                                             .index.get_loc(context['category']))
-        context['fat_rank'] = rank_suffix(medians.sort_values(by='saturatedfat_dv', ascending=False)
-                                          .index.get_loc(context['category']))
-        context['sugar_rank'] = rank_suffix(medians.sort_values(by='sugar', ascending=False)
-                                            .index.get_loc(context['category']))
+        context['category_count'] = len(aggregates)
 
-        df = df.loc[df['category_text'] == context['category']]
-        category_context_builder(df, context)
+        category_context_builder(context, aggregates.loc[context['category']])
         return context
 
 
@@ -138,18 +159,18 @@ class StoreView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['product_stores'] = [x[0] for x in PRODUCT_STORES]
-        data = StoreReportData()
-        df = data.df.copy()
+        # Shared with every request in this process, so only the requested store's slice is copied
+        all_stores = StoreReportData().df
 
-        context['category_count'] = df['category_text'].nunique()
+        context['category_count'] = all_stores['category_text'].nunique()
 
         if 'store' not in self.kwargs:
-            context['store'] = np.random.choice(df['store'].unique())  # set default category
+            context['store'] = np.random.choice(all_stores['store'].unique())  # set default category
         else:
             context['store'] = unquote(
                 self.kwargs['store'].upper())  # pulls category from URL e.g. /reports/store/Loblaws
 
-        df = df.loc[df['store'] == context['store']]
+        df = all_stores.loc[all_stores['store'] == context['store']].copy()
 
         context['manual_category_count'] = df['manual_category_text'].dropna().shape[0]
 
@@ -243,5 +264,5 @@ class StoreView(LoginRequiredMixin, TemplateView):
         context['complete'] = complete_df['complete'].value_counts()[True]
 
         # Visualizations
-        context['figure1'] = category_nutrient_distribution_plot(df)
+        context['figure1'] = store_distribution_figure(context['store'].upper())
         return context
@@ -0,0 +1,89 @@
+import pandas as pd
+import plotly.graph_objects as go
+from django.conf import settings
+
+"""
+Box plot summaries for the visualizer figures.
+
+Passing raw values to go.Box embeds every data point in the page. In summary mode the quartiles, whiskers and mean of
+each box are computed here instead, and only a bounded sample of each box's outliers is sent along as a marker trace,
+so the size of the page doesn't depend on the size of the catalogue. Set VISUALIZER_BOX_SUMMARY = False to go back to
+plotting the raw values.
+"""
+
+BOX_SUMMARY = getattr(settings, 'VISUALIZER_BOX_SUMMARY', True)
+MAX_OUTLIERS = getattr(settings, 'VISUALIZER_MAX_OUTLIERS', 50)
+
+
+def box_summary(values: pd.Series, max_outliers: int = MAX_OUTLIERS, random_state: int = 3) -> dict:
+    """
+    Quartiles, mean, Tukey whiskers (the most extreme values within 1.5 IQR of the box) and a sample of at most
+    max_outliers of the values outside the whiskers. Returns None if there are no values.
+    """
+    values = values.dropna()
+    if values.empty:
+        return None
+
+    q1, median, q3 = values.quantile([0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    within = values.between(q1 - 1.5 * iqr, q3 + 1.5 * iqr)
+    outliers = values[~within]
+    if len(outliers) > max_outliers:
+        outliers = outliers.sample(max_outliers, random_state=random_state)
+
+    return {'q1': q1, 'median': median, 'q3': q3, 'mean': values.mean(),
+            'lowerfence': values[within].min(), 'upperfence': values[within].max(),
+            'count': len(values), 'outliers': outliers.tolist()}
+
+
+def summarize(df: pd.DataFrame, column: str, by: str = None, scale: float = 1,
+              max_outliers: int = MAX_OUTLIERS) -> pd.DataFrame:
+    """ box_summary() of df[column] * scale for each value of the by column (or for all of df), one row per box """
+    values = df[column] * scale
+    if by is None:
+        groups = [(None, values)]
+    else:
+        groups = values.groupby(df[by], sort=True)
+
+    summaries = {}
+    for group, group_values in groups:
+        summary = box_summary(group_values, max_outliers)
+        if summary is not None:
+            summaries[group] = summary
+    return pd.DataFrame.from_dict(summaries, orient='index')
+
+
+def box_traces(df: pd.DataFrame, column: str, name: str, by: str = None, scale: float = 1,
+               orientation: str = 'v', summary: bool = BOX_SUMMARY) -> list:
+    """
+    Box trace(s) for df[column] * scale, one box per value of the by column (or a single box called name). In summary
+    mode this is a box trace built from summarize() plus a marker trace with the sampled outliers; otherwise it is one
+    box trace over the raw values. Every trace has legendgroup=name.
+    """
+    values_axis, position_axis = ('x', 'y') if orientation == 'h' else ('y', 'x')
+
+    if not summary:
+        positions = df[by] if by is not None else None
+        return [go.Box(**{values_axis: df[column] * scale, position_axis: positions}, name=name, legendgroup=name,
+                       boxmean=True, orientation=orientation)]
+
+    stats = summarize(df, column, by, scale)
+    positions = list(stats.index) if by is not None else [name] * len(stats)
+    box = go.Box(**{position_axis: positions}, q1=stats.get('q1'), median=stats.get('median'), q3=stats.get('q3'),
+                 mean=stats.get('mean'), lowerfence=stats.get('lowerfence'), upperfence=stats.get('upperfence'),
+                 name=name, legendgroup=name, boxmean=True, boxpoints=False, orientation=orientation)
+
+    outlier_values, outlier_positions = [], []
+    for position, outliers in zip(positions, stats.get('outliers', [])):
+        outlier_values.extend(outliers)
+        outlier_positions.extend([position] * len(outliers))
+    # Markers sit on the box's category rather than its offset within a group of boxes, which is close enough for a
+    # sample of outliers
+    points = go.Scatter(**{values_axis: outlier_values, position_axis: outlier_positions}, mode='markers',
+                        name=f'{name} outliers', legendgroup=name, showlegend=False, marker_size=4, opacity=0.6)
+    return [box, points]
+
+
+def legendgroup_visibility(traces: list, group: str = None) -> [bool]:
+    """ Trace visibility list for an updatemenu button showing one legend group, or every trace if group is None """
+    return [group is None or trace.legendgroup == group for trace in traces]
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from flaim.visualizer.summaries import box_summary, box_traces
+
+
+def test_box_summary():
+    values = pd.Series(list(range(1, 101)) + [1000, np.nan])
+    summary = box_summary(values, max_outliers=5)
+    assert summary['q1'] == values.quantile(0.25)
+    assert summary['median'] == values.quantile(0.5)
+    assert summary['upperfence'] == 100
+    assert summary['lowerfence'] == 1
+    assert summary['outliers'] == [1000]
+    assert summary['count'] == 101
+
+
+def test_summary_size_is_bounded():
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame({'store': rng.choice(['LOBLAWS', 'WALMART'], 100000),
+                       'sodium_dv': rng.lognormal(size=100000)})
+    box, points = box_traces(df, 'sodium_dv', 'Sodium', by='store', scale=100, summary=True)
+    assert list(box.x) == ['LOBLAWS', 'WALMART']
+    assert len(box.q1) == 2
+    assert len(points.y) <= 2 * 50
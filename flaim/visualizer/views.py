@@ -7,6 +7,9 @@ from plotly.io import to_html
 from django.contrib.auth.mixins import LoginRequiredMixin
 
 from flaim.database import models
+from flaim.reports.analytics import read_report_dataset
+from flaim.reports.cache import cached_figure
+from flaim.visualizer.summaries import box_traces, legendgroup_visibility
 
 
 class IndexView(LoginRequiredMixin, ListView):
@@ -15,12 +18,16 @@ class IndexView(LoginRequiredMixin, ListView):
     template_name = 'visualizer/index.html'
     context_object_name = 'products'
 
+    @staticmethod
+    def nutrient_traces(df, by=None, orientation='v'):
+        """ Sodium, total fat and sugar boxes (as % daily value), summarized server side unless BOX_SUMMARY is off """
+        return (box_traces(df, 'sodium_dv', 'Sodium', by, scale=100, orientation=orientation) +
+                box_traces(df, 'totalfat_dv', 'Total Fat', by, scale=100, orientation=orientation) +
+                box_traces(df, 'sugar', 'Sugar', by, orientation=orientation))
+
     @staticmethod
     def get_figure1(df):
-        fig = go.Figure()
-        fig.add_trace(go.Box(x=df['sodium_dv'].dropna() * 100, name='Sodium', boxmean=True))
-        fig.add_trace(go.Box(x=df['totalfat_dv'].dropna() * 100, name='Total Fat', boxmean=True))
-        fig.add_trace(go.Box(x=df['sugar'].dropna(), name='Sugar', boxmean=True))
+        fig = go.Figure(data=IndexView.nutrient_traces(df, orientation='h'))
 
         fig.update_layout(barmode='stack')
         fig.update_traces(opacity=0.75)
@@ -44,28 +51,26 @@ class IndexView(LoginRequiredMixin, ListView):
 
     @staticmethod
     def get_figure2(df):
-        data = [go.Box(y=df['store'], x=df['sodium_dv'] * 100, name='Sodium', boxmean=True, orientation='h'),
-                go.Box(y=df['store'], x=df['totalfat_dv'] * 100, name='Total Fat', boxmean=True, orientation='h'),
-                go.Box(y=df['store'], x=df['sugar'], name='Sugar', boxmean=True, orientation='h')]
+        data = IndexView.nutrient_traces(df, by='store', orientation='h')
 
         update_menus = list([
             dict(active=0,
                  buttons=list([
                      dict(label='All',
                           method='update',
-                          args=[{'visible': [True, True, True]},
+                          args=[{'visible': legendgroup_visibility(data, None)},
                                 {'title': 'Distribution of Select Nutrients by Store'}]),
                      dict(label='Sodium',
                           method='update',
-                          args=[{'visible': [True, False, False]},
+                          args=[{'visible': legendgroup_visibility(data, 'Sodium')},
                                 {'title': 'Distribution of Sodium by Store'}]),
                      dict(label='Total Fat',
                           method='update',
-                          args=[{'visible': [False, True, False]},
+                          args=[{'visible': legendgroup_visibility(data, 'Total Fat')},
                                 {'title': 'Distribution of Total Fat by Store'}]),
                      dict(label='Sugar',
                           method='update',
-                          args=[{'visible': [False, False, True]},
+                          args=[{'visible': legendgroup_visibility(data, 'Sugar')},
                                 {'title': 'Distribution of Sugar by Store'}])
                  ]),
                  )
@@ -102,28 +107,26 @@ class IndexView(LoginRequiredMixin, ListView):
             top_breadcrumbs = top_breadcrumbs[:-1]
         plot_df = plot_df[plot_df['breadcrumbs_last'].isin(top_breadcrumbs)]
 
-        data = [go.Box(x=plot_df['breadcrumbs_last'], y=plot_df['sodium_dv'] * 100, name='Sodium', boxmean=True),
-                go.Box(x=plot_df['breadcrumbs_last'], y=plot_df['totalfat_dv'] * 100, name='Total Fat', boxmean=True),
-                go.Box(x=plot_df['breadcrumbs_last'], y=plot_df['sugar'], name='Sugar', boxmean=True)]
+        data = IndexView.nutrient_traces(plot_df, by='breadcrumbs_last')
 
         update_menus = list([
             dict(active=0,
                  buttons=list([
                      dict(label='All',
                           method='update',
-                          args=[{'visible': [True, True, True]},
+                          args=[{'visible': legendgroup_visibility(data, None)},
                                 {'title': 'Distribution of Select Nutrients by Category (Top 20 Breadcrumbs)'}]),
                      dict(label='Sodium',
                           method='update',
-                          args=[{'visible': [True, False, False]},
+                          args=[{'visible': legendgroup_visibility(data, 'Sodium')},
                                 {'title': 'Distribution of Sodium by Category (Top 20 Breadcrumbs)'}]),
                      dict(label='Total Fat',
                           method='update',
-                          args=[{'visible': [False, True, False]},
+                          args=[{'visible': legendgroup_visibility(data, 'Total Fat')},
                                 {'title': 'Distribution of Total Fat by Category (Top 20 Breadcrumbs)'}]),
                      dict(label='Sugar',
                           method='update',
-                          args=[{'visible': [False, False, True]},
+                          args=[{'visible': legendgroup_visibility(data, 'Sugar')},
                                 {'title': 'Distribution of Sugar by Category (Top 20 Breadcrumbs)'}])
                  ]),
                  )
@@ -150,26 +153,34 @@ class IndexView(LoginRequiredMixin, ListView):
 
         return to_html(fig, include_plotlyjs=False, full_html=False)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-
-        df1 = pd.DataFrame(list(self.model.objects.filter(most_recent=True).values()))
-        # df1['breadcrumbs_array'] = df1['breadcrumbs_array'].apply(lambda row: list(filter(None, ast.literal_eval(row))))
+    @staticmethod
+    def get_figures() -> dict:
+        """ Renders the three figures, once per report data version """
+        def build():
+            df = read_report_dataset(['store', 'breadcrumbs_array', 'sodium_dv', 'totalfat_dv', 'sugar'])
 
-        def last_crumb(breadcrumbs):
-            return breadcrumbs[-1] if breadcrumbs and len(breadcrumbs) > 0 else np.nan
-        df1['breadcrumbs_last'] = df1['breadcrumbs_array'].apply(lambda row: last_crumb(row))
+            def last_crumb(breadcrumbs):
+                # Snapshot list columns come back as arrays, which don't have a truth value
+                return breadcrumbs[-1] if breadcrumbs is not None and len(breadcrumbs) > 0 else np.nan
+            df['breadcrumbs_last'] = df['breadcrumbs_array'].apply(lambda row: last_crumb(row))
 
-        df2 = pd.DataFrame(list(self.nutrition_facts.objects.filter(product__most_recent=True).values()))
+            return {'figure1': IndexView.get_figure1(df),
+                    'figure2': IndexView.get_figure2(df),
+                    'figure3': IndexView.get_figure3(df)}
 
-        df = df1.merge(df2, left_on='id', right_on='product_id')
+        return cached_figure('visualizer_index', build)
 
-        context['figure1'] = IndexView.get_figure1(df)
-        context['figure2'] = IndexView.get_figure2(df)
-        context['figure3'] = IndexView.get_figure3(df)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(IndexView.get_figures())
         return context
 
 
+def warm_visualizer_figures():
+    """ RQ job queued after each load (see flaim.reports.cache.FIGURE_WARMERS) """
+    IndexView.get_figures()
+
+
 class LoblawsBreadcrumbView(View):
     """ Should calculate the data needed for the treemap on the server and store it to serve the end JSON to
      the user to prevent unnecessary delay """